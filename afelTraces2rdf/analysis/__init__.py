@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# from .activityIndex import ActivityIndex
+# from .timelineStore import TimelineStore
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import csv
+import datetime
+import logging
+import tempfile
+from collections import Counter, OrderedDict, namedtuple
+from rdflib.namespace import RDF, XSD
+from rdflib import Graph, Literal, URIRef
+from ..common.namespaces import concatenate_uriref
+from ..common.vocabulary import EXTAFL, SCHEMA
+from ..tracesLoaders.didactaliaTraces import DIDACTALIA_URL
+from ..tracesLoaders.afelAppTraces import AFEL_URL
+
+__all__ = ['ActivityHistogram', 'HistogramRow', 'GRANULARITIES']
+
+LOG = logging.getLogger(__name__)
+
+# Size of the buckets, in seconds, by granularity
+GRANULARITIES = OrderedDict([('hour', 3600), ('day', 86400)])
+
+# Granularity of the counts added to the graph
+TRIPLES_GRANULARITY = 'day'
+
+# Location of the activities of each source, as given by their schema:location
+SOURCE_LOCATIONS = dict(didactalia=DIDACTALIA_URL, afelApp=AFEL_URL)
+
+HistogramRow = namedtuple('HistogramRow', ['granularity', 'bucket', 'source', 'activity_type', 'user_id', 'count'])
+
+_TABLE_COLUMNS = list(HistogramRow._fields)
+
+
+def _bucket_date(timestamp: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+class ActivityHistogram:
+    """
+    Counters of the activities converted, by hourly and daily bucket of their start date (UTC), per source and
+    activity type, and optionally per user. They are filled while the activities are converted, so that overview
+    plots can be drawn from a small summary table (or from aggregate triples) instead of a full scan of the dataset.
+    The per-user counts are kept apart from the per-source and per-type ones: a count by bucket, source, type and
+    user would be almost one row per activity.
+    """
+    def __init__(self, per_user: bool=False):
+        """
+        :param per_user: True to also count the activities of each user, by bucket
+        """
+        self.per_user = per_user
+        # (bucket, source, activity class URI) -> count, by granularity
+        self._counters = OrderedDict((granularity, Counter()) for granularity in GRANULARITIES)
+        # (bucket, user id) -> count, by granularity
+        self._user_counters = OrderedDict((granularity, Counter()) for granularity in GRANULARITIES) \
+            if per_user else None
+        self._type_names = dict()  # activity class URI -> local name
+
+    @property
+    def options(self) -> dict:
+        """
+        The arguments of the histogram (e.g. to create the histograms of worker processes)
+        """
+        return dict(per_user=self.per_user)
+
+    def add_activities(self, source: str, activities) -> None:
+        """
+        Count the activities of a source
+        :param source: the source name
+        :param activities: the activities (with their start date, user id and RDF representation)
+        """
+        type_names = self._type_names
+        counters = [(counter, GRANULARITIES[granularity]) for granularity, counter in self._counters.items()]
+        user_counters = [(counter, GRANULARITIES[granularity])
+                         for granularity, counter in (self._user_counters or dict()).items()]
+        for activity in activities:
+            type_uri = str(activity.rdf).rsplit('#', 1)[0]
+            if type_uri not in type_names:
+                type_names[type_uri] = type_uri.rsplit('/', 1)[-1]
+            timestamp = int(activity.start_date.timestamp())
+            for counter, size in counters:
+                counter[(timestamp - timestamp % size, source, type_uri)] += 1
+            for counter, size in user_counters:
+                counter[(timestamp - timestamp % size, activity.user_id)] += 1
+
+    def merge(self, histogram: dict) -> None:
+        """
+        Add the counts of another histogram (as given by to_dict)
+        """
+        for type_uri, name in histogram['types'].items():
+            self._type_names.setdefault(type_uri, name)
+        for granularity, rows in histogram['counts'].items():
+            counter = self._counters[granularity]
+            for bucket, source, type_uri, count in rows:
+                counter[(bucket, source, type_uri)] += count
+        if self._user_counters is not None and histogram['user_counts'] is not None:
+            for granularity, rows in histogram['user_counts'].items():
+                counter = self._user_counters[granularity]
+                for bucket, user_id, count in rows:
+                    counter[(bucket, user_id)] += count
+
+    def to_dict(self) -> dict:
+        def counts(counters):
+            return {granularity: [list(key) + [count] for key, count in counter.items()]
+                    for granularity, counter in counters.items()}
+        return dict(types=dict(self._type_names), counts=counts(self._counters),
+                    user_counts=counts(self._user_counters) if self._user_counters is not None else None)
+
+    def __len__(self) -> int:
+        return sum(len(counter) for counter in self._counters.values()) + \
+            sum(len(counter) for counter in (self._user_counters or dict()).values())
+
+    def rows(self):
+        """
+        :return: a generator of the HistogramRow, by granularity: the counts per source and activity type (without
+        user id) sorted by bucket, source and activity type, then the counts per user (without source nor activity
+        type) sorted by bucket and user
+        """
+        for granularity, counter in self._counters.items():
+            for key in sorted(counter):
+                bucket, source, type_uri = key
+                yield HistogramRow(granularity, _bucket_date(bucket), source, self._type_names[type_uri], None,
+                                   counter[key])
+            if self._user_counters is not None:
+                user_counter = self._user_counters[granularity]
+                for key in sorted(user_counter):
+                    bucket, user_id = key
+                    yield HistogramRow(granularity, _bucket_date(bucket), None, None, user_id, user_counter[key])
+
+    def counts(self, granularity: str='hour', source: str=None, activity_type: str=None,
+               user_id: str=None) -> OrderedDict:
+        """
+        The number of activities of each bucket, for a source and an activity type (all if None), or for a user
+        :return: an OrderedDict bucket start date -> count, sorted by bucket
+        """
+        totals = Counter()
+        if user_id is not None:
+            if self._user_counters is None:
+                raise ValueError("The activities are not counted per user")
+            if source is not None or activity_type is not None:
+                raise ValueError("The activities of a user are not counted per source nor activity type")
+            for (bucket, row_user_id), count in self._user_counters[granularity].items():
+                if row_user_id == user_id:
+                    totals[bucket] += count
+        else:
+            for (bucket, row_source, type_uri), count in self._counters[granularity].items():
+                if (source is None or row_source == source) and \
+                        (activity_type is None or self._type_names[type_uri] == activity_type):
+                    totals[bucket] += count
+        return OrderedDict((_bucket_date(bucket), totals[bucket]) for bucket in sorted(totals))
+
+    def write_table(self, destination: str) -> None:
+        """
+        Write the summary table into a CSV file (columns granularity, bucket, source, activity_type, user_id, count)
+        """
+        directory = os.path.dirname(os.path.abspath(destination))
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.histogram')
+        try:
+            with os.fdopen(fd, 'w', newline='') as f:
+                writer = csv.writer(f, dialect='unix')
+                writer.writerow(_TABLE_COLUMNS)
+                for row in self.rows():
+                    writer.writerow(row._replace(bucket=row.bucket.isoformat()))
+            os.replace(tmp_name, destination)
+        except Exception:
+            os.remove(tmp_name)
+            raise
+
+    def dump_to_graph(self, graph: Graph) -> int:
+        """
+        Add an ActivityCount resource per daily count of a source and an activity type: its bucket (start and size),
+        its location, activity type and count. The hourly and per-user counts are only written in the table.
+        :return: the number of triples added
+        """
+        nb_triples = 0
+        granularity = TRIPLES_GRANULARITY
+        size = Literal(granularity)
+        for (bucket, source, type_uri), count in self._counters[granularity].items():
+            start = _bucket_date(bucket)
+            activity_count = concatenate_uriref(EXTAFL.ActivityCount, '%s_%s_%s_%s' % (
+                granularity, start.strftime('%Y%m%dT%H'), source, self._type_names[type_uri]))
+            graph.add((activity_count, RDF.type, EXTAFL.ActivityCount))
+            graph.add((activity_count, EXTAFL.bucketSize, size))
+            graph.add((activity_count, EXTAFL.bucketStart, Literal(start, datatype=XSD.dateTime)))
+            graph.add((activity_count, EXTAFL.activityType, URIRef(type_uri)))
+            graph.add((activity_count, EXTAFL.activityCount, Literal(count)))
+            nb_triples += 5
+            location = SOURCE_LOCATIONS.get(source)
+            if location is not None:
+                graph.add((activity_count, SCHEMA.location, Literal(location)))
+                nb_triples += 1
+        return nb_triples
+
+    def log_summary(self, level=logging.INFO) -> None:
+        for granularity, counter in self._counters.items():
+            LOG.log(level, "%-6s %9d counts, %9d activities" % (granularity, len(counter), sum(counter.values())))
+            if self._user_counters is not None:
+                LOG.log(level, "%-6s %9d counts per user" % (granularity, len(self._user_counters[granularity])))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import math
+import heapq
+import bisect
+import datetime
+import logging
+from array import array
+from collections import namedtuple, defaultdict
+from ..tracesLoaders.learners import LearnerMappingParser
+from ..tracesLoaders.didactaliaTraces import DidactaliaLearningTracesParser, GamePlayedActivity, \
+    UNFINISHED_GAME_DURATION
+from ..tracesLoaders.afelAppTraces import AfelAppTracesParser
+from ..common.mappedHits import MappedHits
+
+__all__ = ['ActivityIndex', 'IndexedActivity']
+
+LOG = logging.getLogger(__name__)
+
+IndexedActivity = namedtuple('IndexedActivity', ['id', 'user_id', 'activity_type', 'platform', 'start', 'end'])
+
+# Columns of the numpy and pandas results
+_COLUMNS = list(IndexedActivity._fields)
+
+
+def _to_timestamp(date) -> float:
+    return date.timestamp() if isinstance(date, datetime.datetime) else float(date)
+
+
+def rdf_type_name(activity) -> str:
+    """
+    :return: the local name of the RDF type of an activity (e.g. ArtifactView, Search, DidactaliaGamePlayed)
+    """
+    return str(activity.rdf).rsplit('#', 1)[0].rsplit('/', 1)[-1]
+
+
+def activity_end_date(activity) -> datetime.datetime:
+    """
+    :return: the end date of an activity. Unfinished game sessions last UNFINISHED_GAME_DURATION.
+    """
+    if isinstance(activity, GamePlayedActivity) and not activity.is_achieved:
+        return activity.start_date + UNFINISHED_GAME_DURATION
+    return activity.end_date
+
+
+class _IntervalLevel:
+    """
+    Intervals sorted by start, with their ends and their row in the index.
+    The intervals overlapping [t0, t1] start in [t0 - max_duration, t1]: two bisections bound the candidates,
+    that are then filtered by their end.
+    """
+    __slots__ = ('starts', 'ends', 'rows', 'max_duration')
+
+    def __init__(self, rows, starts, ends):
+        order = sorted(rows, key=lambda row: starts[row])
+        self.rows = array('L', order)
+        self.starts = array('d', (starts[row] for row in order))
+        self.ends = array('d', (ends[row] for row in order))
+        self.max_duration = max(max((e - s for s, e in zip(self.starts, self.ends)), default=0.), 0.)
+
+    def overlapping(self, t0: float, t1: float):
+        """
+        :return: a generator of the (start, row) of the intervals that overlap [t0, t1], sorted by start
+        """
+        first = bisect.bisect_left(self.starts, t0 - self.max_duration)
+        last = bisect.bisect_right(self.starts, t1)
+        starts = self.starts
+        ends = self.ends
+        rows = self.rows
+        for position in range(first, last):
+            if ends[position] >= t0:
+                yield starts[position], rows[position]
+
+
+def _duration_level(duration: float) -> int:
+    """
+    :return: the level of a duration: k for the durations in [2^(k-1), 2^k[ seconds, 0 up to a second
+    """
+    return math.frexp(duration)[1] if duration > 1. else 0
+
+
+class _SortedIntervals:
+    """
+    Intervals grouped by level of duration, the intervals of a level lasting at most twice as long as each other.
+    The search window of a level only depends on its own longest interval, so that a few long intervals (e.g.
+    unfinished game sessions) do not widen the search of the short ones: a query costs two bisections per level
+    (at most a few tens of levels) plus the candidates of each level, the levels being merged by start.
+    """
+    __slots__ = ('levels',)
+
+    def __init__(self, rows, starts, ends):
+        rows_by_level = defaultdict(list)
+        for row in rows:
+            rows_by_level[_duration_level(ends[row] - starts[row])].append(row)
+        self.levels = [_IntervalLevel(level_rows, starts, ends) for _, level_rows in sorted(rows_by_level.items())]
+
+    def overlapping(self, t0: float, t1: float):
+        """
+        :return: a generator of the rows of the intervals that overlap [t0, t1], sorted by start (and row)
+        """
+        return (row for _, row in heapq.merge(*(level.overlapping(t0, t1) for level in self.levels)))
+
+
+class ActivityIndex:
+    """
+    Temporal index over the activities of the learners, to answer "the activities (of a user, or of all users)
+    that overlap [t0, t1], of some types and platforms" without scanning all of them.
+    Activities are stored by columns; each user, and all users together, have their intervals sorted by start.
+    A query costs two bisections per level of duration plus the candidates of each level, that start in
+    [t0 - longest duration of the level, t1].
+    """
+    def __init__(self):
+        self._ids = []
+        self._user_ids = []
+        self._types = []
+        self._platforms = []
+        self._starts = array('d')
+        self._ends = array('d')
+        self._by_user = None
+        self._all = None
+
+    def add(self, activity_id: str, user_id: str, activity_type: str, platform: str, start, end) -> None:
+        """
+        Add an activity to the index
+        :param start: the start date (datetime or POSIX timestamp)
+        :param end: the end date (datetime or POSIX timestamp)
+        """
+        self._ids.append(activity_id)
+        self._user_ids.append(user_id)
+        self._types.append(activity_type)
+        self._platforms.append(platform)
+        self._starts.append(_to_timestamp(start))
+        self._ends.append(_to_timestamp(end))
+        self._by_user = self._all = None
+
+    def add_activities(self, platform: str, activities) -> None:
+        """
+        Add the activities of a traces parser (Didactalia or AFEL App)
+        :param platform: the platform name (the source name of the parser)
+        :param activities: the activities
+        """
+        for activity in activities:
+            self.add(activity.id, activity.user_id, rdf_type_name(activity), platform, activity.start_date,
+                     activity_end_date(activity))
+
+    @classmethod
+    def from_traces(cls, learners_filename: str, didactalia_filename: str=None,
+                    afelapp_filename: str=None) -> 'ActivityIndex':
+        """
+        Load the traces and index their activities. The namespaces manager must have been initialized.
+        """
+        index = cls()
+        learners_parser = LearnerMappingParser()
+        with open(learners_filename, 'r') as f:
+            learners_parser.load(f)
+        for filename, parser in ((didactalia_filename, DidactaliaLearningTracesParser()),
+                                 (afelapp_filename, AfelAppTracesParser())):
+            if filename is None:
+                continue
+            with MappedHits(filename) as hits:
+                parser.load(hits, learners_parser)
+            index.add_activities(parser.SOURCE_NAME, parser.activities)
+        LOG.debug("%d activities indexed." % len(index))
+        return index
+
+    def _build(self) -> None:
+        rows_by_user = defaultdict(list)
+        for row, user_id in enumerate(self._user_ids):
+            rows_by_user[user_id].append(row)
+        self._by_user = {user_id: _SortedIntervals(rows, self._starts, self._ends)
+                         for user_id, rows in rows_by_user.items()}
+        self._all = _SortedIntervals(range(len(self._ids)), self._starts, self._ends)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def users(self) -> list:
+        if self._by_user is None:
+            self._build()
+        return list(self._by_user)
+
+    def _overlapping_rows(self, t0, t1, user_id: str=None, activity_types=None, platforms=None) -> list:
+        if self._by_user is None:
+            self._build()
+        if user_id is None:
+            intervals = self._all
+        else:
+            intervals = self._by_user.get(user_id)
+            if intervals is None:
+                return []
+        rows = intervals.overlapping(_to_timestamp(t0), _to_timestamp(t1))
+        if activity_types is not None:
+            activity_types = set(activity_types)
+            rows = (row for row in rows if self._types[row] in activity_types)
+        if platforms is not None:
+            platforms = set(platforms)
+            rows = (row for row in rows if self._platforms[row] in platforms)
+        return list(rows)
+
+    def overlapping(self, t0, t1, user_id: str=None, activity_types=None, platforms=None) -> list:
+        """
+        Find the activities that overlap [t0, t1] (bounds included)
+        :param t0: the start of the period (datetime or POSIX timestamp)
+        :param t1: the end of the period (datetime or POSIX timestamp)
+        :param user_id: the user of the activities (all users if None)
+        :param activity_types: the activity types to keep (e.g. ['ArtifactView', 'Search']), all if None
+        :param platforms: the platforms to keep (e.g. ['didactalia']), all if None
+        :return: the list of IndexedActivity, sorted by start. Dates are UTC datetimes.
+        """
+        return [IndexedActivity(self._ids[row], self._user_ids[row], self._types[row], self._platforms[row],
+                                datetime.datetime.fromtimestamp(self._starts[row], datetime.timezone.utc),
+                                datetime.datetime.fromtimestamp(self._ends[row], datetime.timezone.utc))
+                for row in self._overlapping_rows(t0, t1, user_id, activity_types, platforms)]
+
+    def overlapping_arrays(self, t0, t1, user_id: str=None, activity_types=None, platforms=None) -> dict:
+        """
+        Same as overlapping, by columns as numpy arrays (requires numpy). Dates are datetime64[us] (UTC).
+        :return: a dict of the arrays, by column name
+        """
+        import numpy as np
+        rows = np.array(self._overlapping_rows(t0, t1, user_id, activity_types, platforms), dtype=np.int64)
+        starts = np.frombuffer(self._starts, dtype=np.float64)[rows]
+        ends = np.frombuffer(self._ends, dtype=np.float64)[rows]
+        return dict(id=np.array([self._ids[row] for row in rows], dtype=object),
+                    user_id=np.array([self._user_ids[row] for row in rows], dtype=object),
+                    activity_type=np.array([self._types[row] for row in rows], dtype=object),
+                    platform=np.array([self._platforms[row] for row in rows], dtype=object),
+                    start=(starts * 1e6).astype('datetime64[us]'),
+                    end=(ends * 1e6).astype('datetime64[us]'))
+
+    def overlapping_dataframe(self, t0, t1, user_id: str=None, activity_types=None, platforms=None):
+        """
+        Same as overlapping, as a pandas DataFrame (requires pandas)
+        """
+        import pandas as pd
+        return pd.DataFrame(self.overlapping_arrays(t0, t1, user_id, activity_types, platforms), columns=_COLUMNS)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import math
+import logging
+import warnings
+import concurrent.futures
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+__all__ = ['user_features', 'knowledge_features', 'correlations', 'significant_correlations',
+           'bootstrap_correlations', 'BootstrapResult', 'ACTIVITY_FEATURES', 'KNOWLEDGE_FEATURES',
+           'KNOWLEDGE_QUESTION_REGEX']
+
+LOG = logging.getLogger(__name__)
+
+# Features of the activities of each user (or group), as computed by the knowledge notebooks
+ACTIVITY_FEATURES = ['nbArt', 'nbAct', 'actTimeSum', 'actTimeMean', 'actTimeStd', 'artTimeSum', 'artTimeMean',
+                     'artTimeStd']
+
+# Statistics of the knowledge improvement of each user (post-test rating - pre-test rating of each question)
+KNOWLEDGE_FEATURES = ['minKnow', 'meanKnow', 'maxKnow', 'stdKnow']
+
+# Identifiers of the questions of the knowledge tests: test (PRE|POST), questionnaire category and question
+KNOWLEDGE_QUESTION_REGEX = r'^AFEL_2_KNOW_(PRE|POST)_(GEO|HIST)_(.*)$'
+
+BootstrapResult = namedtuple('BootstrapResult', ['mean', 'std', 'low', 'high', 'nb_samples'])
+
+# Maximum number of iterations of the continued fraction of the incomplete beta function
+_BETA_MAX_ITERATIONS = 300
+_BETA_EPSILON = 1e-15
+_TINY = 1e-300
+
+
+def _group_codes(frame: pd.DataFrame, keys: list) -> (np.ndarray, pd.Index):
+    """
+    :return: the code of the group of each row and the sorted group keys (an Index, or a MultiIndex for several keys)
+    """
+    if len(keys) == 1:
+        codes, uniques = pd.factorize(frame[keys[0]], sort=True)
+        return codes, pd.Index(uniques, name=keys[0])
+    codes, uniques = pd.MultiIndex.from_frame(frame[keys]).factorize(sort=True)
+    return codes, pd.MultiIndex.from_tuples(list(uniques), names=keys)
+
+
+def _grouped_stats(codes: np.ndarray, values: np.ndarray, nb_groups: int) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Sum, mean and standard deviation (ddof=1) of the values of each group, the NaN values being skipped as pandas does
+    """
+    present = ~np.isnan(values)
+    codes = codes[present]
+    values = values[present]
+    counts = np.bincount(codes, minlength=nb_groups)
+    sums = np.bincount(codes, weights=values, minlength=nb_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        # Second pass on the deviations rather than the sums of squares, for the precision of large durations
+        squares = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=nb_groups)
+        stds = np.sqrt(squares / (counts - 1))
+    stds[counts < 2] = np.nan
+    return sums, means, stds
+
+
+def _durations(codes: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Duration of each activity, in seconds, the activities being sorted by group and start date: the time between its
+    start and its end if it ends after it starts, the time until the next activity of the group otherwise (NaN for the
+    last one of the group)
+    """
+    durations = np.full(len(starts), np.nan)
+    same_group = codes[1:] == codes[:-1]
+    durations[:-1][same_group] = (starts[1:] - starts[:-1])[same_group]
+    timed = starts < ends
+    durations[timed] = (ends - starts)[timed]
+    return durations
+
+
+def _seconds(dates: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        if isinstance(dates.dtype, pd.DatetimeTZDtype):
+            dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+        return dates.to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    return dates.to_numpy(dtype=float)
+
+
+def user_features(activities: pd.DataFrame, keys=('userid',), artifact: str='artId', start: str='actStartTime',
+                  end: str='actEndTime', drop_na: bool=True) -> pd.DataFrame:
+    """
+    Compute the features of the activities of each user (or group of activities of a user) in a single grouped pass:
+    the number of distinct artifacts (nbArt) and of activities (nbAct), the sum, mean and standard deviation of the
+    durations of the activities (actTime*) and of the total time spent on each artifact (artTime*).
+    The duration of an activity is the time between its start and its end if it ends after it starts, the time until
+    the next activity of the group otherwise, as in the knowledge notebooks.
+    :param activities: the activities, one row each
+    :param keys: the columns of the groups (e.g. ('userid', 'catQuest'))
+    :param artifact: the column of the artifact of the activities, None if they have none (no nbArt nor artTime*)
+    :param start: the column of the start dates (datetimes or seconds)
+    :param end: the column of the end dates (datetimes or seconds)
+    :param drop_na: True to ignore the activities of unknown duration, as the notebooks do, False to count them
+    :return: a DataFrame of the features, indexed by the group keys, sorted
+    """
+    keys = list(keys)
+    codes, groups = _group_codes(activities, keys)
+    starts = _seconds(activities[start])
+    ends = _seconds(activities[end])
+    order = np.lexsort((starts, codes))
+    codes = codes[order]
+    durations = _durations(codes, starts[order], ends[order])
+    rows = np.arange(len(order))
+    if drop_na:
+        rows = rows[~np.isnan(durations)]
+    codes = codes[rows]
+    durations = durations[rows]
+    nb_groups = len(groups)
+    features = dict()
+    if artifact is not None:
+        artifact_codes, artifacts = pd.factorize(activities[artifact].to_numpy()[order][rows])
+        known = artifact_codes >= 0
+        pairs, pair_codes = np.unique(codes[known].astype(np.int64) * max(len(artifacts), 1) + artifact_codes[known],
+                                      return_inverse=True)
+        pair_groups = pairs // max(len(artifacts), 1)
+        features['nbArt'] = np.bincount(pair_groups, minlength=nb_groups)
+        durations_known = np.where(np.isnan(durations[known]), 0., durations[known])
+        artifact_times = np.bincount(pair_codes.ravel(), weights=durations_known, minlength=len(pairs))
+    features['nbAct'] = np.bincount(codes, minlength=nb_groups)
+    features['actTimeSum'], features['actTimeMean'], features['actTimeStd'] = \
+        _grouped_stats(codes, durations, nb_groups)
+    if artifact is not None:
+        features['artTimeSum'], features['artTimeMean'], features['artTimeStd'] = \
+            _grouped_stats(pair_groups, artifact_times, nb_groups)
+    frame = pd.DataFrame(features, index=groups, columns=[f for f in ACTIVITY_FEATURES if f in features])
+    # Groups of which all the activities are of unknown duration
+    return frame[frame.nbAct > 0] if drop_na else frame
+
+
+def knowledge_features(tests: pd.DataFrame, user: str='userid', question: str='questionID',
+                       rating: str='ratingValue', question_regex: str=KNOWLEDGE_QUESTION_REGEX) -> pd.DataFrame:
+    """
+    Compute the statistics of the knowledge improvement of each user and questionnaire category (minKnow, meanKnow,
+    maxKnow, stdKnow), the improvement of a question being its post-test rating minus its pre-test rating.
+    As in the knowledge notebooks, the users that did not rate every question of a category in both tests are left
+    out of this category.
+    :param tests: the ratings of the questions of the tests, one row each
+    :param user: the column of the users
+    :param question: the column of the question identifiers
+    :param rating: the column of the ratings
+    :param question_regex: the regex of the identifiers: its groups are the test (PRE or POST), the category and the
+    question
+    :return: a DataFrame of the statistics, indexed by (user, catQuest), sorted
+    """
+    parts = tests[question].str.extract(question_regex, expand=True)
+    tests = pd.DataFrame({user: tests[user].to_numpy(), 'test': parts[0].to_numpy(), 'catQuest': parts[1].to_numpy(),
+                          'question': parts[2].to_numpy(), 'rating': pd.to_numeric(tests[rating]).to_numpy()})
+    tests = tests.dropna(subset=['test'])
+    codes, groups = _group_codes(tests, [user, 'catQuest'])
+    row_categories, categories = pd.factorize(tests['catQuest'])
+    question_codes, questions = pd.factorize(tests['catQuest'] + '\0' + tests['question'])
+    # Rating of each (group, question, test), then improvement of each (group, question)
+    ratings = np.full((len(groups), len(questions), 2), np.nan)
+    ratings[codes, question_codes, (tests['test'] == 'POST').to_numpy(dtype=int)] = tests['rating'].to_numpy()
+    improvements = ratings[:, :, 1] - ratings[:, :, 0]
+    # The questions of a category are the ones rated by any user
+    question_categories = np.empty(len(questions), dtype=np.int64)
+    question_categories[question_codes] = row_categories
+    group_categories = categories.get_indexer(groups.get_level_values('catQuest'))
+    in_category = group_categories[:, None] == question_categories[None, :]
+    complete = ~np.any(in_category & np.isnan(improvements), axis=1)
+    improvements = np.where(in_category, improvements, np.nan)[complete]
+    with warnings.catch_warnings():
+        # Categories of a single question: no standard deviation
+        warnings.simplefilter('ignore', RuntimeWarning)
+        statistics = [np.nanmin(improvements, axis=1), np.nanmean(improvements, axis=1),
+                      np.nanmax(improvements, axis=1), np.nanstd(improvements, axis=1, ddof=1)]
+    return pd.DataFrame(dict(zip(KNOWLEDGE_FEATURES, statistics)), index=groups[complete], columns=KNOWLEDGE_FEATURES)
+
+
+def _log_gamma(values: np.ndarray) -> np.ndarray:
+    return np.vectorize(math.lgamma, otypes=[float])(values)
+
+
+def _beta_continued_fraction(a: np.ndarray, b: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    Continued fraction of the incomplete beta function (modified Lentz's method), evaluated element-wise
+    """
+    qab = a + b
+    qap = a + 1.
+    qam = a - 1.
+    c = np.ones_like(x)
+    d = 1. - qab * x / qap
+    d = 1. / np.where(np.abs(d) < _TINY, _TINY, d)
+    h = d
+    for m in range(1, _BETA_MAX_ITERATIONS + 1):
+        m2 = 2 * m
+        for numerator in (m * (b - m) * x / ((qam + m2) * (a + m2)),
+                          -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1. + numerator * d
+            d = 1. / np.where(np.abs(d) < _TINY, _TINY, d)
+            c = 1. + numerator / c
+            c = np.where(np.abs(c) < _TINY, _TINY, c)
+            delta = c * d
+            h = h * delta
+        if np.all(np.abs(delta - 1.) < _BETA_EPSILON):
+            break
+    return h
+
+
+def _incomplete_beta(a: np.ndarray, b: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    Regularized incomplete beta function I_x(a, b), evaluated element-wise (the NaN values stay NaN)
+    """
+    a, b, x = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float), np.asarray(x, dtype=float))
+    result = np.full(x.shape, np.nan)
+    valid = ~(np.isnan(a) | np.isnan(b) | np.isnan(x))
+    result[valid & (x <= 0.)] = 0.
+    result[valid & (x >= 1.)] = 1.
+    inner = valid & (x > 0.) & (x < 1.)
+    if not np.any(inner):
+        return result
+    a, b, x = a[inner], b[inner], x[inner]
+    front = np.exp(_log_gamma(a + b) - _log_gamma(a) - _log_gamma(b) + a * np.log(x) + b * np.log1p(-x))
+    # The continued fraction converges quickly below (a + 1) / (a + b + 2), I_x(a, b) = 1 - I_1-x(b, a) above
+    direct = x < (a + 1.) / (a + b + 2.)
+    values = np.empty(x.shape)
+    values[direct] = front[direct] * _beta_continued_fraction(a[direct], b[direct], x[direct]) / a[direct]
+    swapped = ~direct
+    values[swapped] = 1. - front[swapped] * _beta_continued_fraction(b[swapped], a[swapped], 1. - x[swapped]) / \
+        b[swapped]
+    result[inner] = values
+    return result
+
+
+def _pearson(x: np.ndarray, y: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Pearson correlation of each column of x with each column of y, on the rows where both are known
+    :return: the matrix of the correlations and the matrix of the number of rows of each pair
+    """
+    x_known = ~np.isnan(x)
+    y_known = ~np.isnan(y)
+    # Centered on the column means first, for the precision of the sums below
+    with warnings.catch_warnings():
+        # Columns without values: their correlations are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        x = np.where(x_known, x - np.nanmean(x, axis=0), 0.)
+        y = np.where(y_known, y - np.nanmean(y, axis=0), 0.)
+    x_known = x_known.astype(float)
+    y_known = y_known.astype(float)
+    counts = x_known.T @ y_known
+    x_sums = x.T @ y_known
+    y_sums = x_known.T @ y
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariances = x.T @ y - x_sums * y_sums / counts
+        x_variances = (x ** 2).T @ y_known - x_sums ** 2 / counts
+        y_variances = x_known.T @ (y ** 2) - y_sums ** 2 / counts
+        r = covariances / np.sqrt(x_variances * y_variances)
+    return np.clip(r, -1., 1.), counts
+
+
+def _p_values(r: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Two-sided p-values of the correlations, under the hypothesis of uncorrelated normal variables (as
+    scipy.stats.pearsonr): the t statistic of n - 2 degrees of freedom, computed with the incomplete beta function
+    """
+    freedom = np.where(counts > 2, counts - 2., np.nan)
+    return _incomplete_beta(freedom / 2., 0.5, 1. - r ** 2)
+
+
+def _aligned(x: pd.DataFrame, y: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+    if y is None:
+        return x, x
+    if x.index.equals(y.index):
+        return x, y
+    return x.align(y, join='inner', axis=0)
+
+
+def correlations(x: pd.DataFrame, y: pd.DataFrame=None) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Compute the Pearson correlation and its p-value for every pair of variables at once, as matrix products instead
+    of a call of scipy.stats.pearsonr per pair. The missing values are left out pair by pair.
+    :param x: the independent variables, one column each (e.g. the user features)
+    :param y: the dependent variables (e.g. the knowledge features), joined to x by index; the columns of x if None
+    :return: the DataFrame of the correlations and the DataFrame of the p-values, indexed by the columns of x, the
+    columns being the ones of y
+    """
+    x, y = _aligned(x, y)
+    r, counts = _pearson(x.to_numpy(dtype=float), y.to_numpy(dtype=float))
+    return pd.DataFrame(r, index=x.columns, columns=y.columns), \
+        pd.DataFrame(_p_values(r, counts), index=x.columns, columns=y.columns)
+
+
+def significant_correlations(r: pd.DataFrame, p_values: pd.DataFrame, threshold: float=0.05) -> pd.DataFrame:
+    """
+    :return: the pairs of variables of which the correlation is significant (p-value <= threshold), sorted by
+    absolute correlation, as a DataFrame of columns x, y, r and pval. A pair of a symmetric matrix is given once.
+    """
+    pairs = r.stack().rename('r').to_frame().join(p_values.stack().rename('pval'))
+    pairs.index.names = ['x', 'y']
+    pairs = pairs.reset_index()
+    pairs = pairs[pairs.x != pairs.y]
+    if r.index.equals(r.columns):
+        position = {name: i for i, name in enumerate(r.index)}
+        pairs = pairs[pairs.x.map(position) < pairs.y.map(position)]
+    pairs = pairs[pairs.pval <= threshold]
+    return pairs.iloc[np.argsort(-pairs.r.abs().to_numpy(), kind='stable')].reset_index(drop=True)
+
+
+def _bootstrap_samples(x: np.ndarray, y: np.ndarray, nb_samples: int, seed) -> np.ndarray:
+    """
+    Correlation matrices of bootstrap samples of the rows (run by the workers)
+    """
+    generator = np.random.default_rng(seed)
+    samples = np.empty((nb_samples, x.shape[1], y.shape[1]))
+    for i in range(nb_samples):
+        rows = generator.integers(0, x.shape[0], x.shape[0])
+        samples[i] = _pearson(x[rows], y[rows])[0]
+    return samples
+
+
+def bootstrap_correlations(x: pd.DataFrame, y: pd.DataFrame=None, nb_samples: int=1000, workers: int=None,
+                           seed: int=None, confidence: float=0.95, chunk_size: int=100) -> BootstrapResult:
+    """
+    Estimate the distribution of the correlations by bootstrap: the rows (users) are resampled with replacement and
+    the correlation matrix of each sample is computed. The samples are shared by chunks between worker processes,
+    each chunk having its own random generator derived from the seed, so that the result does not depend on the
+    number of workers.
+    :param x: the independent variables, one column each
+    :param y: the dependent variables, joined to x by index; the columns of x if None
+    :param nb_samples: the number of bootstrap samples
+    :param workers: the number of worker processes (None for the number of processors, 1 to run in this process)
+    :param seed: the seed of the random generators (optional)
+    :param confidence: the level of the percentile confidence intervals
+    :param chunk_size: the number of samples computed by each task of the workers
+    :return: the BootstrapResult of the mean, standard deviation and confidence interval (low, high) of each
+    correlation, as DataFrames shaped as the correlation matrix
+    """
+    x, y = _aligned(x, y)
+    x_values = x.to_numpy(dtype=float)
+    y_values = y.to_numpy(dtype=float)
+    chunks = [min(chunk_size, nb_samples - start) for start in range(0, nb_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    if workers is not None and workers <= 1:
+        samples = [_bootstrap_samples(x_values, y_values, size, chunk_seed) for size, chunk_seed in zip(chunks, seeds)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            samples = list(executor.map(_bootstrap_samples, [x_values] * len(chunks), [y_values] * len(chunks),
+                                        chunks, seeds))
+    samples = np.concatenate(samples) if samples else np.empty((0, x.shape[1], y.shape[1]))
+    LOG.debug("%d bootstrap samples of %d rows computed" % (len(samples), len(x)))
+    tail = (1. - confidence) / 2. * 100.
+    with warnings.catch_warnings():
+        # Correlations undefined in every sample (constant variables) give NaN statistics
+        warnings.simplefilter('ignore', RuntimeWarning)
+        statistics = [np.nanmean(samples, axis=0), np.nanstd(samples, axis=0, ddof=1),
+                      np.nanpercentile(samples, tail, axis=0), np.nanpercentile(samples, 100. - tail, axis=0)]
+    frames = [pd.DataFrame(values, index=x.columns, columns=y.columns) for values in statistics]
+    return BootstrapResult(*frames, nb_samples=len(samples))
+
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import re
+import time
+import hashlib
+import logging
+import datetime
+import tempfile
+import threading
+import ujson as json
+
+__all__ = ['QueryResultCache', 'normalize_query', 'write_dataset_stamp', 'read_dataset_stamp']
+
+LOG = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1 << 20
+
+# Tokens of a SPARQL query that are kept as they are (IRIs and strings, which may contain # or spaces), comments and
+# whitespaces
+_QUERY_TOKEN_REGEX = re.compile(r'(<[^<>"{}|^`\\\x00-\x20]*>'
+                                r'|"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\''
+                                r'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')'
+                                r'|(#[^\n]*)|(\s+)', re.DOTALL)
+
+
+def normalize_query(query: str) -> str:
+    """
+    :return: the query without its comments, its whitespaces being collapsed outside of its IRIs and strings
+    """
+    pieces = []
+    position = 0
+    for match in _QUERY_TOKEN_REGEX.finditer(query):
+        if match.start() > position:
+            pieces.append(query[position:match.start()])
+        if match.group(1) is not None:
+            pieces.append(match.group(1))
+        elif pieces and not pieces[-1].endswith(' '):
+            pieces.append(' ')
+        position = match.end()
+    pieces.append(query[position:])
+    return ''.join(pieces).strip()
+
+
+def write_dataset_stamp(stamp_filename: str, dataset_filename: str) -> dict:
+    """
+    Write the version stamp of a dataset (the content hash of the migrator output), replaced atomically
+    :return: the stamp
+    """
+    digest = hashlib.sha256()
+    with open(dataset_filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    stamp = dict(version=digest.hexdigest(), dataset=os.path.abspath(dataset_filename),
+                 size=os.path.getsize(dataset_filename),
+                 date=datetime.datetime.now(datetime.timezone.utc).isoformat())
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(stamp_filename)), prefix='.stamp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(stamp, f, indent=2)
+        os.replace(tmp_filename, stamp_filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+    return stamp
+
+
+def read_dataset_stamp(stamp_filename: str) -> dict:
+    with open(stamp_filename, 'r') as f:
+        return json.load(f)
+
+
+class QueryResultCache:
+    """
+    Disk cache of the DataFrames of SPARQL queries, keyed by the normalized query text, the read options and the
+    version of the dataset: the results are reused across kernel restarts until the migrator converts a new dataset.
+    Each result is stored as an uncompressed npz file of its columns (strings as UTF-8 buffers and offsets,
+    categories as codes, dates as integers), loaded without pickle. The cache size is bounded: the least recently
+    used results are evicted first.
+    """
+    INDEX_FILENAME = 'query_index.json'
+
+    def __init__(self, directory: str, version: str=None, stamp_filename: str=None, max_size: int=1 << 29):
+        """
+        :param directory: the cache directory
+        :param version: the version of the dataset queried
+        :param stamp_filename: the stamp file written by the migrator (--dataset-stamp), read again when it changes,
+        if no version is given. The results are not cached while it is missing.
+        :param max_size: the maximum size of the cached results, in bytes
+        """
+        if version is None and stamp_filename is None:
+            raise ValueError("The cache requires a dataset version or stamp file")
+        self.directory = directory
+        self.max_size = max_size
+        self.stamp_filename = stamp_filename
+        self._version = version
+        self._stamp_mtime = None
+        self._stamp_missing = False
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index = self._load_index()
+
+    @property
+    def version(self) -> str:
+        """
+        :return: the version of the dataset, or None if the stamp file cannot be read
+        """
+        if self.stamp_filename is not None:
+            try:
+                mtime = os.stat(self.stamp_filename).st_mtime_ns
+                if mtime != self._stamp_mtime:
+                    self._version = read_dataset_stamp(self.stamp_filename)['version']
+                    self._stamp_mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                if not self._stamp_missing:
+                    LOG.warning("Dataset stamp %s cannot be read (%s): the query results are not cached."
+                                % (self.stamp_filename, e))
+                self._stamp_missing = True
+                self._version = self._stamp_mtime = None
+                return None
+            self._stamp_missing = False
+        return self._version
+
+    @property
+    def index_filename(self) -> str:
+        return os.path.join(self.directory, self.INDEX_FILENAME)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict(entries=dict())
+
+    def _save_index(self) -> None:
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix='.index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_filename, self.index_filename)
+
+    def key(self, query: str, **read_kwargs) -> str:
+        """
+        :return: the key of the result of a query read with some options
+        """
+        options = repr(sorted(read_kwargs.items()))
+        return hashlib.sha256('\0'.join((self.version, normalize_query(query), options)).encode('utf-8')).hexdigest()
+
+    def get(self, query: str, **read_kwargs):
+        """
+        :return: the cached DataFrame of a query, or None
+        """
+        if self.version is None:
+            return None
+        key = self.key(query, **read_kwargs)
+        with self._lock:
+            entry = self._index['entries'].get(key)
+            if entry is None:
+                return None
+            try:
+                frame = _load_frame(os.path.join(self.directory, entry['filename']))
+            except (OSError, ValueError, KeyError) as e:
+                LOG.warning("Cached result %s cannot be read (%s), discarding it." % (entry['filename'], e))
+                self._remove(key)
+                self._save_index()
+                return None
+            entry['last_used'] = time.time()
+            self._save_index()
+        return frame
+
+    def put(self, query: str, frame, **read_kwargs) -> bool:
+        """
+        Store the DataFrame of a query, then evict the least recently used results beyond the cache size
+        :return: True if the result is kept in the cache (False if it is larger than the cache, or if its columns
+        cannot be stored, or without dataset version)
+        """
+        if self.version is None:
+            return False
+        key = self.key(query, **read_kwargs)
+        filename = key + '.npz'
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix='.result', suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                _save_frame(f, frame)
+        except (TypeError, ValueError) as e:
+            os.remove(tmp_filename)
+            LOG.warning("Result not cached: %s" % e)
+            return False
+        with self._lock:
+            os.replace(tmp_filename, os.path.join(self.directory, filename))
+            self._index['entries'][key] = dict(filename=filename, version=self.version, last_used=time.time(),
+                                               size=os.path.getsize(os.path.join(self.directory, filename)),
+                                               query=normalize_query(query)[:200])
+            self._evict()
+            self._save_index()
+            return key in self._index['entries']
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._index['entries']):
+                self._remove(key)
+            self._save_index()
+
+    def _evict(self) -> None:
+        entries = self._index['entries']
+        total_size = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total_size <= self.max_size:
+                break
+            total_size -= entries[key]['size']
+            LOG.info("Evicting cached result %s" % entries[key]['filename'])
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._index['entries'].pop(key)
+        try:
+            os.remove(os.path.join(self.directory, entry['filename']))
+        except OSError:
+            pass
+
+
+def _encode_strings(values, arrays: dict, name: str) -> None:
+    import numpy as np
+    import pandas as pd
+    mask = pd.isna(values)
+    encoded = []
+    for value, missing in zip(values, mask):
+        if missing:
+            encoded.append(b'')
+        elif isinstance(value, str):
+            encoded.append(value.encode('utf-8'))
+        else:
+            raise TypeError("column %s has values of type %s" % (name, type(value).__name__))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    arrays[name + '.data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    arrays[name + '.offsets'] = offsets
+    arrays[name + '.mask'] = np.asarray(mask, dtype=bool)
+
+
+def _decode_strings(arrays, name: str) -> list:
+    data = arrays[name + '.data'].tobytes()
+    offsets = arrays[name + '.offsets'].tolist()
+    mask = arrays[name + '.mask'].tolist()
+    return [None if mask[i] else data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(mask))]
+
+
+def _encode_column(series, arrays: dict, name: str) -> dict:
+    """
+    Encode a column into arrays named after name
+    :return: the description of the column
+    """
+    import pandas as pd
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        arrays[name] = series.cat.codes.to_numpy()
+        return dict(kind='category', ordered=bool(dtype.ordered),
+                    categories=_encode_column(pd.Series(dtype.categories), arrays, name + '.categories'))
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        arrays[name] = series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy()
+        return dict(kind='datetimetz', tz=str(dtype.tz))
+    if dtype == object or isinstance(dtype, pd.StringDtype):
+        _encode_strings(series.to_numpy(dtype=object), arrays, name)
+        return dict(kind='string', dtype=str(dtype))
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        # Nullable integers and booleans: their values and their mask
+        arrays[name] = series.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+        arrays[name + '.mask'] = series.isna().to_numpy()
+        return dict(kind='masked', dtype=str(dtype))
+    arrays[name] = series.to_numpy()
+    return dict(kind='numpy')
+
+
+def _decode_column(arrays, name: str, description: dict):
+    import pandas as pd
+    kind = description['kind']
+    if kind == 'category':
+        categories = _decode_column(arrays, name + '.categories', description['categories'])
+        return pd.Categorical.from_codes(arrays[name], categories=categories, ordered=description['ordered'])
+    if kind == 'datetimetz':
+        return pd.Series(arrays[name]).dt.tz_localize('UTC').dt.tz_convert(description['tz'])
+    if kind == 'string':
+        values = pd.Series(_decode_strings(arrays, name), dtype=object)
+        return values if description['dtype'] == 'object' else values.astype(description['dtype'])
+    if kind == 'masked':
+        values = pd.Series(arrays[name]).astype(description['dtype'])
+        values[arrays[name + '.mask']] = pd.NA
+        return values
+    return arrays[name]
+
+
+def _save_frame(f, frame) -> None:
+    import numpy as np
+    import pandas as pd
+    index_names = None
+    if not isinstance(frame.index, pd.RangeIndex) or frame.index.start != 0 or frame.index.step != 1:
+        index_names = list(frame.index.names)
+        frame = frame.reset_index()
+    if not frame.columns.is_unique:
+        raise ValueError("the column names are not unique")
+    arrays = dict()
+    columns = [[column, _encode_column(frame[column], arrays, 'c%d' % i)] for i, column in enumerate(frame.columns)]
+    meta = dict(columns=columns, index_names=index_names, nb_rows=len(frame))
+    arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+    np.savez(f, **arrays)
+
+
+def _load_frame(filename: str):
+    import numpy as np
+    import pandas as pd
+    with np.load(filename, allow_pickle=False) as arrays:
+        meta = json.loads(arrays['meta'].tobytes().decode('utf-8'))
+        columns = [pd.Series(_decode_column(arrays, 'c%d' % i, description))
+                   for i, (_, description) in enumerate(meta['columns'])]
+    frame = pd.DataFrame({column: values for (column, _), values in zip(meta['columns'], columns)},
+                         columns=[column for column, _ in meta['columns']])
+    if meta['index_names'] is not None:
+        nb_levels = len(meta['index_names'])
+        frame = frame.set_index(list(frame.columns[:nb_levels]))
+        frame.index.names = meta['index_names']
+    return frame
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import re
+import queue
+import logging
+import http.client
+import urllib.parse
+import concurrent.futures
+from contextlib import contextmanager
+from .queryCache import QueryResultCache
+
+__all__ = ['SparqlClient', 'SparqlError', 'SPARQL_PREFIX']
+
+LOG = logging.getLogger(__name__)
+
+# Prefixes of the queries of the analysis notebooks
+SPARQL_PREFIX = """
+    PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+    PREFIX extafl: <http://vocab.afel-project.eu/extension/>
+    PREFIX afl: <http://vocab.afel-project.eu/>
+    PREFIX sch: <http://schema.org/>
+"""
+
+_LIMIT_OFFSET_REGEX = re.compile(r'\b(LIMIT|OFFSET)\s+\d+\s*$', re.IGNORECASE)
+
+# Errors of a kept-alive connection closed by the endpoint in the meantime: the request is sent again once
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class SparqlError(Exception):
+    """
+    An error response of the SPARQL endpoint
+    """
+    def __init__(self, status: int, reason: str, message: str):
+        super().__init__("SPARQL endpoint error %d %s: %s" % (status, reason, message))
+        self.status = status
+        self.reason = reason
+        self.message = message
+
+
+class SparqlClient:
+    """
+    A client of a SPARQL endpoint (e.g. Fuseki) that reads the CSV results of SELECT queries as pandas DataFrames.
+    The HTTP connections are kept alive in a pool, so that several queries are run at once (query_many) without a
+    new connection each time, and the results are parsed while they are received instead of being buffered: all at
+    once (query), by chunks of rows (query_chunks) or by pages of LIMIT/OFFSET queries (query_pages).
+    """
+    def __init__(self, endpoint: str, pool_size: int=4, timeout: float=300., prefix: str='',
+                 cache: QueryResultCache=None):
+        """
+        :param endpoint: the URL of the query endpoint (e.g. http://localhost:3030/evalafel/query)
+        :param pool_size: the number of HTTP connections, i.e. of queries run at once
+        :param timeout: the timeout of the connections, in seconds
+        :param prefix: the prefix declarations added before each query (e.g. SPARQL_PREFIX)
+        :param cache: the cache of the query results (optional), used by query, query_many and query_pages
+        """
+        url = urllib.parse.urlsplit(endpoint)
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise ValueError("Wrong SPARQL endpoint URL %s" % endpoint)
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.prefix = prefix
+        self.cache = cache
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self._host = url.hostname
+        self._port = url.port
+        self._path = (url.path or '/') + ('?' + url.query if url.query else '')
+        # The connections are created when first needed; a query waits for a free connection
+        self._pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._pool.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the idle connections of the pool
+        """
+        connections = []
+        for _ in range(self.pool_size):
+            connection = self._pool.get()
+            if connection is not None:
+                connection.close()
+            connections.append(None)
+        for connection in connections:
+            self._pool.put(connection)
+
+    @contextmanager
+    def _connection(self):
+        connection = self._pool.get()
+        if connection is None:
+            connection = self._connection_class(self._host, self._port, timeout=self.timeout)
+        try:
+            yield connection
+        except BaseException:
+            # The response may not have been read to its end (e.g. a generator closed early): not to be reused
+            connection.close()
+            raise
+        finally:
+            self._pool.put(connection)
+
+    def _post(self, connection: http.client.HTTPConnection, query: str) -> http.client.HTTPResponse:
+        body = urllib.parse.urlencode({'query': self.prefix + query})
+        headers = {'Accept': 'text/csv', 'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
+        reused = connection.sock is not None
+        try:
+            connection.request('POST', self._path, body, headers)
+            response = connection.getresponse()
+        except _STALE_CONNECTION_ERRORS:
+            if not reused:
+                raise
+            LOG.debug("Connection to %s closed by the endpoint, reconnecting" % self.endpoint)
+            connection.close()
+            connection.request('POST', self._path, body, headers)
+            response = connection.getresponse()
+        if response.status != 200:
+            message = response.read().decode('utf-8', errors='replace').strip()
+            raise SparqlError(response.status, response.reason, message)
+        return response
+
+    def query(self, query: str, dtype=None, **kwargs):
+        """
+        Run a SELECT query
+        :param query: the query (with its prefix declarations if the client has none)
+        :param dtype: the dtypes of the columns (a type, or a dict by column name), as for pandas.read_csv
+        :param kwargs: other arguments of pandas.read_csv (e.g. parse_dates)
+        :return: the results as a DataFrame
+        """
+        import pandas as pd
+        if self.cache is not None:
+            frame = self.cache.get(self.prefix + query, dtype=dtype, **kwargs)
+            if frame is not None:
+                return frame
+        with self._connection() as connection:
+            response = self._post(connection, query)
+            frame = pd.read_csv(response, dtype=dtype, **kwargs)
+            # The response must be read to its end for the connection to be reused
+            response.read()
+        if self.cache is not None:
+            self.cache.put(self.prefix + query, frame, dtype=dtype, **kwargs)
+        return frame
+
+    def query_chunks(self, query: str, chunksize: int=50000, dtype=None, **kwargs):
+        """
+        Run a SELECT query and parse its results by chunks of rows while they are received
+        :param query: the query (with its prefix declarations if the client has none)
+        :param chunksize: the number of rows of each chunk
+        :param dtype: the dtypes of the columns (a type, or a dict by column name), as for pandas.read_csv
+        :param kwargs: other arguments of pandas.read_csv (e.g. parse_dates)
+        :return: a generator of DataFrames
+        """
+        import pandas as pd
+        with self._connection() as connection:
+            response = self._post(connection, query)
+            for chunk in pd.read_csv(response, chunksize=chunksize, dtype=dtype, **kwargs):
+                yield chunk
+            response.read()
+
+    def query_pages(self, query: str, page_size: int=100000, dtype=None, **kwargs):
+        """
+        Run a SELECT query by pages: each page is the query with a LIMIT and an OFFSET. The query should have an
+        ORDER BY clause, for the pages to be consistent.
+        :param query: the query (without LIMIT nor OFFSET)
+        :param page_size: the number of rows of each page
+        :param dtype: the dtypes of the columns (a type, or a dict by column name), as for pandas.read_csv
+        :param kwargs: other arguments of pandas.read_csv (e.g. parse_dates)
+        :return: a generator of DataFrames, one per non-empty page
+        """
+        if _LIMIT_OFFSET_REGEX.search(query.strip()):
+            raise ValueError("A paged query must not have its own LIMIT or OFFSET")
+        offset = 0
+        while True:
+            page = self.query("%s\nLIMIT %d OFFSET %d" % (query, page_size, offset), dtype=dtype, **kwargs)
+            if len(page) > 0:
+                yield page
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def query_many(self, queries: list, dtype=None, **kwargs) -> list:
+        """
+        Run several SELECT queries at once, on the connections of the pool
+        :param queries: the queries (with its prefix declarations if the client has none)
+        :param dtype: the dtypes of the columns (a type, or a dict by column name), as for pandas.read_csv
+        :param kwargs: other arguments of pandas.read_csv (e.g. parse_dates)
+        :return: the DataFrame of each query, in the order of the queries
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            futures = [executor.submit(self.query, query, dtype=dtype, **kwargs) for query in queries]
+            return [future.result() for future in futures]
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import re
+import sys
+import struct
+import bisect
+import datetime
+import logging
+import tempfile
+import unicodedata
+from array import array
+from collections import Counter, namedtuple, OrderedDict
+import ujson as json
+from ..tracesLoaders.didactaliaTraces import SearchActivity
+from ..tracesLoaders.afelAppTraces import AfelAppArtifactView, AfelAppRecommendedArtifactView, AfelAppViewScope
+from .activityIndex import rdf_type_name
+
+__all__ = ['TextIndex', 'TextHit', 'tokenize', 'TEXT_FIELDS']
+
+LOG = logging.getLogger(__name__)
+
+# Free-text fields of the activities: (field name, text attribute, artifact attribute or None) by activity class
+TEXT_FIELDS = OrderedDict([
+    (SearchActivity, [('search', 'query', None)]),
+    (AfelAppArtifactView, [('content', 'artifact_content', 'artifact_url')]),
+    (AfelAppRecommendedArtifactView, [('content', 'artifact_content', 'artifact_url')]),
+    (AfelAppViewScope, [('scope', 'scope', 'scope')]),
+])
+
+TextHit = namedtuple('TextHit', ['id', 'user_id', 'activity_type', 'field', 'start', 'artifact'])
+
+_TOKEN_REGEX = re.compile(r'\w+')
+
+_MAGIC = b'AFELTXT1'
+
+# Typecode of the row numbers of the postings, always stored on 4 bytes
+_ROW_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+
+def tokenize(text: str) -> list:
+    """
+    :return: the tokens of a text: its words, lowercased and without accents
+    """
+    if not text:
+        return []
+    folded = unicodedata.normalize('NFKD', text.lower())
+    folded = ''.join(c for c in folded if not unicodedata.combining(c))
+    return _TOKEN_REGEX.findall(folded)
+
+
+def _timestamp(date) -> float:
+    if date is None:
+        return None
+    return date.timestamp() if isinstance(date, datetime.datetime) else float(date)
+
+
+class TextIndex:
+    """
+    Inverted index of the free text of the activities (Didactalia search queries, content of the artifacts viewed in
+    the AFEL App and labels of the scopes viewed), filled while the activities are converted.
+    Each indexed text is a row (activity, field), the rows being sorted by start date once the index is complete:
+    the postings of a token are increasing row numbers, so that a time window is two bisections in each of them.
+    The vocabulary is sorted, for prefix lookups.
+    """
+    def __init__(self):
+        self._ids = []
+        self._user_ids = []
+        self._types = []
+        self._fields = []
+        self._artifacts = []
+        self._starts = array('d')
+        self._row_tokens = []  # tokens of the rows added since the postings were built
+        self._vocabulary = []  # sorted tokens
+        self._postings = dict()  # token -> array of rows
+        self._nb_built_rows = 0
+        self._values = dict()  # interned strings (users, types, fields, artifacts)
+
+    def _intern(self, value):
+        if value is None:
+            return None
+        return self._values.setdefault(value, value)
+
+    def add_activities(self, source: str, activities) -> None:
+        """
+        Index the free text of the activities of a source
+        :param source: the source name
+        :param activities: the activities (the classes without free text are ignored)
+        """
+        nb_rows = len(self._ids)
+        for activity in activities:
+            fields = TEXT_FIELDS.get(type(activity))
+            if fields is None:
+                continue
+            for field, text_attribute, artifact_attribute in fields:
+                tokens = set(tokenize(getattr(activity, text_attribute)))
+                if not tokens:
+                    continue
+                artifact = getattr(activity, artifact_attribute) if artifact_attribute is not None else None
+                self._ids.append(activity.id)
+                self._user_ids.append(self._intern(activity.user_id))
+                self._types.append(self._intern(rdf_type_name(activity)))
+                self._fields.append(self._intern(field))
+                self._artifacts.append(self._intern(artifact.strip() if artifact is not None else None))
+                self._starts.append(activity.start_date.timestamp())
+                self._row_tokens.append(tokens)
+        if len(self._ids) > nb_rows:
+            LOG.debug("%d texts of %s indexed" % (len(self._ids) - nb_rows, source))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _build(self) -> None:
+        """
+        Sort the rows by start date and build the postings
+        """
+        if self._nb_built_rows == len(self._ids):
+            return
+        if self._nb_built_rows > 0:
+            # Rows added to a built index: the tokens of the built rows are read back from the postings
+            row_tokens = [set() for _ in range(self._nb_built_rows)]
+            for token, rows in self._postings.items():
+                for row in rows:
+                    row_tokens[row].add(token)
+            self._row_tokens = row_tokens + self._row_tokens
+        order = sorted(range(len(self._ids)), key=self._starts.__getitem__)
+        for name in ('_ids', '_user_ids', '_types', '_fields', '_artifacts'):
+            column = getattr(self, name)
+            setattr(self, name, [column[row] for row in order])
+        self._starts = array('d', (self._starts[row] for row in order))
+        postings = dict()
+        for new_row, row in enumerate(order):
+            for token in self._row_tokens[row]:
+                rows = postings.get(token)
+                if rows is None:
+                    rows = postings[token] = array(_ROW_TYPECODE)
+                rows.append(new_row)
+        self._row_tokens = []
+        self._postings = postings
+        self._vocabulary = sorted(postings)
+        self._nb_built_rows = len(self._ids)
+
+    def terms(self, prefix: str='') -> list:
+        """
+        :return: the (token, number of texts) of the vocabulary that start with a prefix, in alphabetical order
+        """
+        self._build()
+        return [(token, len(self._postings[token])) for token in self._prefixed(prefix)]
+
+    def _prefixed(self, prefix: str) -> list:
+        vocabulary = self._vocabulary
+        first = bisect.bisect_left(vocabulary, prefix)
+        last = first
+        while last < len(vocabulary) and vocabulary[last].startswith(prefix):
+            last += 1
+        return vocabulary[first:last]
+
+    def _token_rows(self, token: str, prefix: bool, first: int, last: int) -> set:
+        tokens = self._prefixed(token) if prefix else ([token] if token in self._postings else [])
+        rows = set()
+        for t in tokens:
+            posting = self._postings[t]
+            rows.update(posting[bisect.bisect_left(posting, first):bisect.bisect_left(posting, last)])
+        return rows
+
+    def _matching_rows(self, text: str, prefix: bool, fields, since, until, user_id) -> list:
+        self._build()
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        since = _timestamp(since)
+        until = _timestamp(until)
+        first = bisect.bisect_left(self._starts, since) if since is not None else 0
+        last = bisect.bisect_left(self._starts, until) if until is not None else len(self._starts)
+        rows = None
+        # The rarest tokens first, for the intersection to shrink quickly
+        for token in sorted(set(tokens), key=lambda t: len(self._postings.get(t, ())) if not prefix else 0):
+            token_rows = self._token_rows(token, prefix, first, last)
+            rows = token_rows if rows is None else rows & token_rows
+            if not rows:
+                return []
+        if fields is not None:
+            fields = set(fields)
+            rows = (row for row in rows if self._fields[row] in fields)
+        if user_id is not None:
+            rows = (row for row in rows if self._user_ids[row] == user_id)
+        return sorted(rows)
+
+    def search(self, text: str, prefix: bool=False, fields: list=None, since=None, until=None,
+               user_id: str=None) -> list:
+        """
+        Look for the texts that contain all the tokens of a text
+        :param text: the text looked for (e.g. 'roman empire')
+        :param prefix: True to match the tokens that start with the tokens of the text
+        :param fields: the fields to look into (search, content, scope), all by default
+        :param since: the minimal start date (datetime or timestamp) of the activities, included (optional)
+        :param until: the maximal start date of the activities, excluded (optional)
+        :param user_id: the user of the activities (optional)
+        :return: the TextHit of the activities, sorted by start date
+        """
+        return [TextHit(self._ids[row], self._user_ids[row], self._types[row], self._fields[row],
+                        datetime.datetime.fromtimestamp(self._starts[row], datetime.timezone.utc), self._artifacts[row])
+                for row in self._matching_rows(text, prefix, fields, since, until, user_id)]
+
+    def user_frequencies(self, text: str, prefix: bool=False, fields: list=None, since=None, until=None) -> Counter:
+        """
+        Count, by user, the texts that contain all the tokens of a text (e.g. who searched for X before the post-test)
+        :return: a Counter of the number of texts by user id
+        """
+        user_ids = self._user_ids
+        return Counter(user_ids[row] for row in self._matching_rows(text, prefix, fields, since, until, None))
+
+    def artifact_frequencies(self, text: str, prefix: bool=False, fields: list=None, since=None,
+                             until=None) -> Counter:
+        """
+        :return: a Counter of the number of texts by artifact, for the texts that contain all the tokens of a text
+        """
+        artifacts = self._artifacts
+        return Counter(artifacts[row] for row in self._matching_rows(text, prefix, fields, since, until, None)
+                       if artifacts[row] is not None)
+
+    def save(self, destination: str) -> None:
+        """
+        Write the index into a file (replaced atomically): a JSON header of the columns of strings and of the
+        vocabulary, followed by the start dates and the concatenated postings
+        """
+        self._build()
+        counts = array('Q', (len(self._postings[token]) for token in self._vocabulary))
+        header = dict(byteorder=sys.byteorder, ids=self._ids, user_ids=self._user_ids, types=self._types,
+                      fields=self._fields, artifacts=self._artifacts, vocabulary=self._vocabulary)
+        header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(destination))
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.textindex')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_MAGIC)
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                self._starts.tofile(f)
+                counts.tofile(f)
+                for token in self._vocabulary:
+                    self._postings[token].tofile(f)
+            os.replace(tmp_name, destination)
+        except Exception:
+            os.remove(tmp_name)
+            raise
+
+    @classmethod
+    def load(cls, filename: str) -> 'TextIndex':
+        """
+        Load an index written by save
+        """
+        index = cls()
+        with open(filename, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError("%s is not a text index" % filename)
+            header_size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_size).decode('utf-8'))
+            swap = header['byteorder'] != sys.byteorder
+            nb_rows = len(header['ids'])
+            starts = array('d')
+            starts.fromfile(f, nb_rows)
+            counts = array('Q')
+            counts.fromfile(f, len(header['vocabulary']))
+            if swap:
+                starts.byteswap()
+                counts.byteswap()
+            postings = dict()
+            for token, count in zip(header['vocabulary'], counts):
+                rows = array(_ROW_TYPECODE)
+                rows.fromfile(f, count)
+                if swap:
+                    rows.byteswap()
+                postings[token] = rows
+        index._ids = header['ids']
+        index._user_ids = header['user_ids']
+        index._types = header['types']
+        index._fields = header['fields']
+        index._artifacts = header['artifacts']
+        index._starts = starts
+        index._vocabulary = header['vocabulary']
+        index._postings = postings
+        index._nb_built_rows = nb_rows
+        return index
+
+    def log_summary(self, level=logging.INFO) -> None:
+        self._build()
+        LOG.log(level, "Text index: %d texts, %d tokens, %d postings" % (len(self._ids), len(self._vocabulary),
+                                                                       sum(map(len, self._postings.values()))))
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import heapq
+import bisect
+import datetime
+import logging
+from array import array
+from collections import namedtuple, defaultdict, OrderedDict
+from ..tracesLoaders.learners import LearnerMappingParser
+from ..tracesLoaders.didactaliaTraces import DidactaliaLearningTracesParser
+from ..tracesLoaders.afelAppTraces import AfelAppTracesParser
+from ..common.mappedHits import MappedHits
+from .activityIndex import rdf_type_name, activity_end_date
+
+__all__ = ['TimelineStore', 'TimelineEntry', 'SnapshotEntry']
+
+LOG = logging.getLogger(__name__)
+
+TimelineEntry = namedtuple('TimelineEntry', ['start', 'end', 'activity_type', 'platform', 'id'])
+
+# State of a learner at a given time: the number of activities started so far (in total and per platform) and the
+# last activity started
+SnapshotEntry = namedtuple('SnapshotEntry', ['nb_activities', 'nb_by_platform', 'last_activity'])
+
+
+def _utc(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def _sorted_runs(entries: list) -> list:
+    """
+    Split a sequence of entries into its runs sorted by start
+    """
+    runs = []
+    run = []
+    for entry in entries:
+        if run and entry[0] < run[-1][0]:
+            runs.append(run)
+            run = []
+        run.append(entry)
+    if run:
+        runs.append(run)
+    return runs
+
+
+class _Timeline:
+    """
+    The activities of a learner, sorted by start and stored by columns (types and platforms as codes)
+    """
+    __slots__ = ('starts', 'ends', 'types', 'platforms', 'ids', 'counts_by_platform')
+
+    def __init__(self, entries, nb_platforms: int):
+        self.starts = array('d')
+        self.ends = array('d')
+        self.types = array('H')
+        self.platforms = array('B')
+        self.ids = []
+        # Cumulated number of activities of each platform, to count the activities before any date in O(1)
+        self.counts_by_platform = [array('L') for _ in range(nb_platforms)]
+        counts = [0] * nb_platforms
+        for start, end, type_code, platform_code, activity_id in entries:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.types.append(type_code)
+            self.platforms.append(platform_code)
+            self.ids.append(activity_id)
+            counts[platform_code] += 1
+            for code in range(nb_platforms):
+                self.counts_by_platform[code].append(counts[code])
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.types, self.platforms, self.ids)
+
+
+class TimelineStore:
+    """
+    The cross-platform timelines of the learners: the activities of each learner from all the sources, sorted by
+    start in compact arrays.
+    Each source gives its activities in an order made of a few sorted runs (e.g. the Didactalia game sessions,
+    then the other activities): the runs of all sources are merged per learner with a k-way merge (heapq.merge)
+    instead of being sorted again. The store can then be iterated per learner, and gives snapshots of the state
+    of the whole cohort at any date.
+    """
+    def __init__(self):
+        self._types = []  # activity types, by code
+        self._platforms = []  # platforms, by code
+        self._pending = defaultdict(list)  # user id -> runs not merged yet into the timeline
+        self._timelines = OrderedDict()
+
+    @staticmethod
+    def _code(vocabulary: list, value: str) -> int:
+        try:
+            return vocabulary.index(value)
+        except ValueError:
+            vocabulary.append(value)
+            return len(vocabulary) - 1
+
+    def add_source(self, platform: str, activities) -> None:
+        """
+        Add the activities of a source, in the order of the source
+        :param platform: the platform name (the source name of the parser)
+        :param activities: the activities of the traces parser
+        """
+        platform_code = self._code(self._platforms, platform)
+        type_codes = dict()
+        entries_by_user = defaultdict(list)
+        for activity in activities:
+            type_name = rdf_type_name(activity)
+            type_code = type_codes.get(type_name)
+            if type_code is None:
+                type_code = type_codes[type_name] = self._code(self._types, type_name)
+            entries_by_user[activity.user_id].append((activity.start_date.timestamp(),
+                                                      activity_end_date(activity).timestamp(), type_code,
+                                                      platform_code, activity.id))
+        # Splitting by user keeps the order of the source, hence its sorted runs
+        for user_id, entries in entries_by_user.items():
+            self._pending[user_id].extend(_sorted_runs(entries))
+
+    @classmethod
+    def from_traces(cls, learners_filename: str, didactalia_filename: str=None,
+                    afelapp_filename: str=None) -> 'TimelineStore':
+        """
+        Load the traces and store the timelines of their activities. The namespaces manager must have been
+        initialized.
+        """
+        store = cls()
+        learners_parser = LearnerMappingParser()
+        with open(learners_filename, 'r') as f:
+            learners_parser.load(f)
+        for filename, parser in ((didactalia_filename, DidactaliaLearningTracesParser()),
+                                 (afelapp_filename, AfelAppTracesParser())):
+            if filename is None:
+                continue
+            with MappedHits(filename) as hits:
+                parser.load(hits, learners_parser)
+            store.add_source(parser.SOURCE_NAME, parser.activities)
+        return store
+
+    def _merge_pending(self) -> None:
+        if not self._pending:
+            return
+        nb_platforms = len(self._platforms)
+        for user_id, runs in self._pending.items():
+            timeline = self._timelines.get(user_id)
+            if timeline is not None:
+                runs.append(list(timeline))  # the current timeline is a sorted run itself
+            self._timelines[user_id] = _Timeline(heapq.merge(*runs, key=lambda entry: entry[0]), nb_platforms)
+        # Timelines built before a new platform was added need its counts
+        for timeline in self._timelines.values():
+            while len(timeline.counts_by_platform) < nb_platforms:
+                timeline.counts_by_platform.append(array('L', [0] * len(timeline)))
+        self._pending.clear()
+
+    @property
+    def users(self) -> list:
+        self._merge_pending()
+        return list(self._timelines)
+
+    @property
+    def platforms(self) -> list:
+        return list(self._platforms)
+
+    def __len__(self) -> int:
+        self._merge_pending()
+        return sum(len(timeline) for timeline in self._timelines.values())
+
+    def _entry(self, timeline: _Timeline, position: int) -> TimelineEntry:
+        return TimelineEntry(_utc(timeline.starts[position]), _utc(timeline.ends[position]),
+                             self._types[timeline.types[position]], self._platforms[timeline.platforms[position]],
+                             timeline.ids[position])
+
+    def timeline(self, user_id: str):
+        """
+        Iterate over the activities of a learner, sorted by start
+        :return: a generator of TimelineEntry
+        """
+        self._merge_pending()
+        timeline = self._timelines.get(user_id)
+        if timeline is None:
+            return
+        for position in range(len(timeline)):
+            yield self._entry(timeline, position)
+
+    def iter_users(self):
+        """
+        :return: a generator of the (user id, timeline generator) of all the learners
+        """
+        for user_id in self.users:
+            yield user_id, self.timeline(user_id)
+
+    def snapshot(self, date) -> dict:
+        """
+        The state of the whole cohort at a date: for each learner, the activities started until then (included)
+        :param date: the date (datetime or POSIX timestamp)
+        :return: a dict user id -> SnapshotEntry
+        """
+        self._merge_pending()
+        timestamp = date.timestamp() if isinstance(date, datetime.datetime) else float(date)
+        snapshot = OrderedDict()
+        for user_id, timeline in self._timelines.items():
+            position = bisect.bisect_right(timeline.starts, timestamp)
+            if position == 0:
+                snapshot[user_id] = SnapshotEntry(0, {platform: 0 for platform in self._platforms}, None)
+            else:
+                snapshot[user_id] = SnapshotEntry(
+                    position, {platform: timeline.counts_by_platform[code][position - 1]
+                               for code, platform in enumerate(self._platforms)},
+                    self._entry(timeline, position - 1))
+        return snapshot
+
+    def to_dataframe(self, user_id: str=None):
+        """
+        The timelines (of a learner, or of all of them) as a pandas DataFrame sorted by user and start, with
+        columns userid, platform, activityType, actStartTime and actEndTime (requires pandas)
+        """
+        import pandas as pd
+        self._merge_pending()
+        users = [user_id] if user_id is not None else list(self._timelines)
+        rows = [(uid, entry.platform, entry.activity_type, entry.start, entry.end)
+                for uid in users for entry in self.timeline(uid)]
+        return pd.DataFrame(rows, columns=['userid', 'platform', 'activityType', 'actStartTime', 'actEndTime'])
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import io
+import os
+import gzip
+import hashlib
+import logging
+import asyncio
+import concurrent.futures
+from collections import namedtuple
+from rdflib import Graph
+from rdflib.namespace import RDF
+from .common.namespaces import AfelNamespacesManager
+from .common.vocabulary import AFEL, EXTAFL, SCHEMA
+from .common.metrics import ConversionMetrics
+from .common.partitioning import Partition
+from .common.mappedHits import MappedHits
+from .common.traceFilter import TraceFilter, combine_user_filters
+from .analysis.activityHistogram import ActivityHistogram
+from .tracesLoaders.learners import LearnerMappingParser
+from .tracesLoaders.afelAppTraces import AfelAppTracesParser
+from .tracesLoaders.didactaliaTraces import DidactaliaLearningTracesParser
+from .tracesLoaders.questionnaires import QuestionnaireParser
+from .migrator import TracesCollection, GraphDuplicateWatcher, PartitionGraph, save_graph_to_file, select_sources
+
+__all__ = ['AsyncConversionPipeline', 'convert_questionnaires']
+
+LOG = logging.getLogger(__name__)
+
+# A unit of work of the pipeline: a source, its files and extra information (the layout of a questionnaire)
+ConversionUnit = namedtuple('ConversionUnit', ['source', 'filenames', 'info'])
+
+# The N-Triples of a unit: those of its own resources and their number, and the lines of the shared resources
+UnitTriples = namedtuple('UnitTriples', ['own', 'nb_own', 'shared_lines'])
+
+# Types of the resources that several units can describe (e.g. an artifact viewed from both trace sources): only
+# their triples are deduplicated by the writer. The other resources (activities, answers) belong to a single unit.
+SHARED_TYPES = [AFEL.Artifact, AFEL.Learner, AFEL.User, EXTAFL.Questionnaire, SCHEMA.Question]
+
+# Formats that can be written chunk by chunk, by concatenation of the serialization of each unit
+STREAMABLE_FORMATS = ['nt']
+
+# Sources of which the uncompressed exports are memory-mapped by the worker processes instead of being read
+MAPPED_SOURCES = ['didactalia', 'afelApp']
+
+_SENTINEL = None
+
+# State of a worker process, initialized by its first unit
+_WORKER_STATE = dict()
+
+
+def _user_filter(partition: Partition, trace_filter: TraceFilter):
+    return combine_user_filters(partition.contains_user if partition is not None else None,
+                                trace_filter.user_filter if trace_filter is not None else None)
+
+
+def _init_worker(schema_kwargs: dict, learners_data: bytes, partition: Partition, trace_filter: TraceFilter,
+                 histogram_options: dict, decode_whole: bool=False):
+    if _WORKER_STATE:
+        return
+    AfelNamespacesManager(**schema_kwargs)
+    learners_parser = LearnerMappingParser(user_filter=_user_filter(partition, trace_filter))
+    learners_parser.load(io.StringIO(learners_data.decode('utf-8')))
+    _WORKER_STATE['learners_parser'] = learners_parser
+    _WORKER_STATE['partition'] = partition
+    _WORKER_STATE['trace_filter'] = trace_filter
+    _WORKER_STATE['histogram_options'] = histogram_options
+    _WORKER_STATE['decode_whole'] = decode_whole
+    logging.getLogger('afelTraces2rdf.migrator').setLevel(logging.ERROR)
+
+
+def _read_files(unit: ConversionUnit) -> list:
+    """
+    Read (and decompress if needed) the files of a unit. Run in a thread: both file reads and zlib release the GIL.
+    The files that are mapped by the worker processes are not read (None is returned for them).
+    """
+    datas = []
+    for filename in unit.filenames:
+        if unit.source in MAPPED_SOURCES and not filename.endswith('.gz'):
+            datas.append(None)
+            continue
+        with open(filename, 'rb') as f:
+            data = f.read()
+        datas.append(gzip.decompress(data) if filename.endswith('.gz') else data)
+    return datas
+
+
+def _open_hits(filename: str, data: bytes):
+    # Processes mapping the same file share its pages instead of receiving their own copy of it
+    return MappedHits(filename, decode_whole=_WORKER_STATE['decode_whole']) if data is None else io.BytesIO(data)
+
+
+def _serialize_unit(graph: Graph) -> UnitTriples:
+    """
+    Serialize the triples of a unit into N-Triples, the triples of the shared resources apart. The shared
+    triples are removed from the graph.
+    """
+    shared = Graph()
+    for rdf_type in SHARED_TYPES:
+        for subject in list(graph.subjects(RDF.type, rdf_type)):
+            for triple in graph.triples((subject, None, None)):
+                shared.add(triple)
+    for triple in shared:
+        graph.remove(triple)
+    # The serializations end with an empty line
+    shared_lines = shared.serialize(format='nt').splitlines(keepends=True)[:-1]
+    return UnitTriples(graph.serialize(format='nt')[:-1], len(graph), shared_lines)
+
+
+def _convert_unit(unit: ConversionUnit, datas: list, worker_args: tuple) -> (UnitTriples, int, dict, dict):
+    """
+    Parse and convert a unit into N-Triples. Run in a worker process.
+    :return: the N-Triples of the unit, the number of triples generated, the metrics report of the unit and its
+    activity histogram (None if not requested)
+    """
+    _init_worker(*worker_args)
+    learners_parser = _WORKER_STATE['learners_parser']
+    partition = _WORKER_STATE['partition']
+    trace_filter = _WORKER_STATE['trace_filter']
+    histogram_options = _WORKER_STATE['histogram_options']
+    histogram = ActivityHistogram(**histogram_options) if histogram_options is not None else None
+    graph = PartitionGraph(partition) if partition is not None else GraphDuplicateWatcher()
+    metrics = ConversionMetrics()
+    if unit.source == 'didactalia':
+        parser = DidactaliaLearningTracesParser(metrics=metrics, trace_filter=trace_filter)
+        with _open_hits(unit.filenames[0], datas[0]) as f:
+            nb_triples = parser.load_and_dump(f, learners_parser, graph)
+        if histogram is not None:
+            histogram.add_activities(parser.SOURCE_NAME, parser.activities)
+    elif unit.source == 'afelApp':
+        parser = AfelAppTracesParser(metrics=metrics, trace_filter=trace_filter)
+        with _open_hits(unit.filenames[0], datas[0]) as f:
+            nb_triples = parser.load_and_dump(f, learners_parser, graph)
+        if histogram is not None:
+            histogram.add_activities(parser.SOURCE_NAME, parser.activities)
+    else:
+        parser = QuestionnaireParser(unit.info, metrics=metrics, trace_filter=trace_filter)
+        nb_triples = parser.load_and_dump(io.StringIO(datas[0].decode('utf-8')), learners_parser, graph,
+                                          f_texts=io.BytesIO(datas[1]) if len(datas) > 1 else None)
+    with metrics.stage(unit.source, 'serialization') as stage:
+        stage.items += 1
+        stage.triples += len(graph)
+        data = _serialize_unit(graph)
+    return data, nb_triples, metrics.to_dict(), histogram.to_dict() if histogram is not None else None
+
+
+class _TriplesCollector:
+    """
+    A graph-like sink that keeps the triples added, duplicates included
+    """
+    def __init__(self):
+        self.triples = []
+
+    def add(self, triple):
+        self.triples.append(triple)
+
+
+def _collect_questionnaire(layout, worker_args: tuple) -> (list, int, dict):
+    """
+    Parse and convert the files of a questionnaire. Run in a worker process.
+    :return: the triples generated (duplicates included), their number and the metrics report of the questionnaire
+    """
+    _init_worker(*worker_args)
+    metrics = ConversionMetrics()
+    collector = _TriplesCollector()
+    parser = QuestionnaireParser(layout, metrics=metrics, trace_filter=_WORKER_STATE['trace_filter'])
+    nb_triples = parser.load_files_and_dump(_WORKER_STATE['learners_parser'], collector)
+    return collector.triples, nb_triples, metrics.to_dict()
+
+
+def convert_questionnaires(layouts: list, learners_filename: str, workers: int, metrics: ConversionMetrics=None,
+                           partition: Partition=None, trace_filter: TraceFilter=None):
+    """
+    Convert the files of some questionnaires in a pool of worker processes, the largest files being scheduled first.
+    The triples are given back to be added to the graph of the caller, which counts the duplicates and the triples
+    of other partitions as if the questionnaires were converted in its own process.
+    :param layouts: the QuestionnaireLayout of the questionnaires
+    :param learners_filename: the learners mapping file
+    :param workers: the number of worker processes
+    :param metrics: the metrics collector (optional)
+    :param partition: the partition to convert (optional)
+    :param trace_filter: the selection of the traces to convert (optional)
+    :return: a generator of (layout, triples generated, number of triples generated), in the order of the layouts
+    """
+    with open(learners_filename, 'rb') as f:
+        learners_data = f.read()
+    worker_args = (AfelNamespacesManager().schema_kwargs, learners_data, partition, trace_filter, None)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = dict()
+        for layout in sorted(layouts, key=lambda l: os.path.getsize(l.filename), reverse=True):
+            futures[layout.id] = executor.submit(_collect_questionnaire, layout, worker_args)
+        for layout in layouts:
+            triples, nb_triples, report = futures[layout.id].result()
+            if metrics is not None:
+                metrics.merge(report)
+            yield layout, triples, nb_triples
+
+
+async def _run_stages(stages: list) -> None:
+    """
+    Run the stages of the pipeline until they are all done. The first failure of a stage cancels the others (a stage
+    that stops consuming its queue would block the previous one forever) and is raised.
+    :param stages: the tasks of the stages
+    """
+    try:
+        await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+        for task in stages:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in stages:
+            task.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+
+
+class AsyncConversionPipeline:
+    """
+    Convert all the traces with an asyncio pipeline that overlaps I/O and computation across the sources:
+    an async reader stage (file reads and decompression in threads), a conversion stage (JSON/CSV parsing, date
+    normalization and triple building in worker processes) and an async writer stage. The stages are connected by
+    bounded queues, so that the reader stops when the conversion stage is late (backpressure).
+    The writes, and the deduplication of the triples of the resources shared by several units, run in a thread so
+    that the event loop keeps feeding the workers.
+    """
+    def __init__(self, files_collection: TracesCollection, schema_kwargs: dict, workers: int=None,
+                 queue_size: int=2, metrics: ConversionMetrics=None, partition: Partition=None,
+                 trace_filter: TraceFilter=None, histogram: ActivityHistogram=None, histogram_triples: bool=False,
+                 decode_whole: bool=False):
+        """
+        :param files_collection: the traces files collection
+        :param schema_kwargs: the arguments of the AfelNamespacesManager, given to the worker processes
+        :param workers: the number of worker processes (number of CPUs by default)
+        :param queue_size: the maximum number of units waiting between two stages
+        :param metrics: the metrics collector (optional)
+        :param partition: the partition to convert (optional)
+        :param trace_filter: the selection of the traces to convert (optional)
+        :param histogram: the histogram that counts the activities converted (optional)
+        :param histogram_triples: True to write the counts of the histogram with the triples
+        :param decode_whole: True to decode the mapped exports at once when all their hits are needed
+        """
+        self.files_collection = files_collection
+        self.schema_kwargs = schema_kwargs
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.queue_size = queue_size
+        self.partition = partition
+        self.trace_filter = trace_filter
+        self.histogram = histogram
+        self.histogram_triples = histogram_triples
+        self.decode_whole = decode_whole
+        self._metrics = metrics if metrics is not None else ConversionMetrics()
+        self._seen_shared_lines = set()
+        self._nb_written = 0
+
+    @property
+    def units(self) -> list:
+        fc = self.files_collection
+        if self.trace_filter is not None:
+            fc = select_sources(fc, self.trace_filter)
+        units = []
+        if fc.didactalia is not None:
+            units.append(ConversionUnit('didactalia', [fc.didactalia], None))
+        if fc.afelApp is not None:
+            units.append(ConversionUnit('afelApp', [fc.afelApp], None))
+        if fc.questionnaires is not None:
+            units.extend(ConversionUnit(layout.source, layout.files, layout)
+                         for layout in fc.questionnaires.questionnaires)
+        return units
+
+    def run(self, destination: str, file_format: str='nt') -> int:
+        """
+        Run the pipeline
+        :param destination: the output filename
+        :param file_format: the RDF format. N-Triples are written unit by unit, other formats are serialized once
+        all units are converted.
+        :return: the number of triples written
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._run(loop, destination, file_format))
+        finally:
+            loop.close()
+
+    async def _run(self, loop, destination: str, file_format: str) -> int:
+        with open(self.files_collection.learners, 'rb') as f:
+            learners_data = f.read()
+        # Learners are required by all the units: they are converted first
+        learners_parser = LearnerMappingParser(metrics=self._metrics,
+                                               user_filter=_user_filter(self.partition, self.trace_filter))
+        learners_parser.load(io.StringIO(learners_data.decode('utf-8')))
+        learners_graph = PartitionGraph(self.partition) if self.partition is not None else Graph()
+        nb_generated = learners_parser.dump_to_graph(learners_graph)
+
+        raw_queue = asyncio.Queue(maxsize=self.queue_size)
+        converted_queue = asyncio.Queue(maxsize=self.queue_size)
+        io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        cpu_executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        worker_args = (self.schema_kwargs, learners_data, self.partition, self.trace_filter,
+                       self.histogram.options if self.histogram is not None else None, self.decode_whole)
+        try:
+            with open(destination, 'wb') as f_out:
+                try:
+                    graph_out = None if file_format in STREAMABLE_FORMATS else Graph()
+                    await self._write(loop, io_executor, f_out, graph_out, _serialize_unit(learners_graph))
+                    converters = [asyncio.ensure_future(self._convert(loop, cpu_executor, worker_args, raw_queue,
+                                                                      converted_queue))
+                                  for _ in range(self.workers)]
+                    closer = asyncio.ensure_future(self._close_conversion(converters, converted_queue))
+                    reader = asyncio.ensure_future(self._read(loop, io_executor, raw_queue))
+                    writer = asyncio.ensure_future(self._write_all(loop, io_executor, converted_queue, f_out,
+                                                                   graph_out))
+                    await _run_stages([reader] + converters + [closer, writer])
+                    nb_generated += closer.result()
+                finally:
+                    # The writes running in the thread are over before the output is closed, even after a failure
+                    io_executor.shutdown()
+            if graph_out is not None:
+                self._nb_written = len(graph_out)
+                with self._metrics.stage('output', 'serialization') as stage:
+                    save_graph_to_file(graph_out, destination=destination, format=file_format)
+                    stage.items += 1
+                    stage.triples += len(graph_out)
+        finally:
+            cpu_executor.shutdown()
+            io_executor.shutdown()
+        LOG.info("%d triples have been generated." % nb_generated)
+        LOG.info("%d triples have been written" % self._nb_written)
+        self._metrics.set_counter('generated_triples', nb_generated)
+        self._metrics.set_counter('written_triples', self._nb_written)
+        return self._nb_written
+
+    async def _read(self, loop, executor, raw_queue: asyncio.Queue) -> None:
+        for unit in self.units:
+            with self._metrics.stage(unit.source, 'reading') as stage:
+                datas = await loop.run_in_executor(executor, _read_files, unit)
+                stage.items += sum(1 for data in datas if data is not None)
+            LOG.info("%s read (%s)." % (unit.source, ', '.join(unit.filenames)))
+            await raw_queue.put((unit, datas))
+        for _ in range(self.workers):
+            await raw_queue.put(_SENTINEL)
+
+    async def _convert(self, loop, executor, worker_args: tuple, raw_queue: asyncio.Queue,
+                       converted_queue: asyncio.Queue) -> int:
+        nb_generated = 0
+        while True:
+            item = await raw_queue.get()
+            if item is _SENTINEL:
+                return nb_generated
+            unit, datas = item
+            data, nb_triples, unit_metrics, unit_histogram = await loop.run_in_executor(executor, _convert_unit, unit,
+                                                                                       datas, worker_args)
+            del datas
+            self._metrics.merge(unit_metrics)
+            if unit_histogram is not None:
+                self.histogram.merge(unit_histogram)
+            nb_generated += nb_triples
+            LOG.info("%s converted." % ', '.join(unit.filenames))
+            await converted_queue.put(data)
+
+    async def _close_conversion(self, converters: list, converted_queue: asyncio.Queue) -> int:
+        """
+        Wait for the converters, then add the histogram triples (if requested) and close the converted queue
+        :return: the number of triples generated by the converters and the histogram
+        """
+        nb_generated = sum(await asyncio.gather(*converters))
+        if self.histogram is not None and self.histogram_triples:
+            histogram_graph = PartitionGraph(self.partition) if self.partition is not None else Graph()
+            nb_generated += self.histogram.dump_to_graph(histogram_graph)
+            await converted_queue.put(_serialize_unit(histogram_graph))
+        await converted_queue.put(_SENTINEL)
+        return nb_generated
+
+    async def _write_all(self, loop, executor, converted_queue: asyncio.Queue, f_out, graph_out: Graph) -> None:
+        while True:
+            data = await converted_queue.get()
+            if data is _SENTINEL:
+                return
+            await self._write(loop, executor, f_out, graph_out, data)
+
+    async def _write(self, loop, executor, f_out, graph_out: Graph, data: UnitTriples) -> None:
+        await loop.run_in_executor(executor, self._write_triples, f_out, graph_out, data)
+
+    def _write_triples(self, f_out, graph_out: Graph, data: UnitTriples) -> None:
+        """
+        Write the triples of a unit, or add them to the output graph (that deduplicates them itself). Run in a thread,
+        one unit at a time.
+        """
+        with self._metrics.stage('output', 'writing') as stage:
+            stage.items += 1
+            if graph_out is not None:
+                graph_out.parse(data=(data.own + b''.join(data.shared_lines)).decode('utf-8'), format='nt')
+                return
+            # Triples of the resources shared by several units (e.g. artifacts) are written once
+            shared_lines = []
+            for line in data.shared_lines:
+                key = hashlib.blake2b(line, digest_size=16).digest()
+                if key not in self._seen_shared_lines:
+                    self._seen_shared_lines.add(key)
+                    shared_lines.append(line)
+            self._nb_written += data.nb_own + len(shared_lines)
+            stage.triples += data.nb_own + len(shared_lines)
+            f_out.write(data.own)
+            f_out.write(b''.join(shared_lines))
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# from .syntheticTraces import SyntheticTracesGenerator
+# from .benchmarkRunner import BenchmarkRunner
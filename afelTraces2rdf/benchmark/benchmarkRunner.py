@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import sys
+import time
+import logging
+import argparse
+import datetime
+import platform
+import tempfile
+import multiprocessing
+import csv
+import ujson as json
+import rdflib
+from rdflib import Graph
+from .syntheticTraces import SyntheticTracesGenerator
+from ..common.namespaces import AfelNamespacesManager
+from ..common.metrics import peak_rss
+from ..common.turtleWriter import save_turtle
+from ..tracesLoaders.learners import LearnerMappingParser
+from ..tracesLoaders.afelAppTraces import AfelAppTracesParser
+from ..tracesLoaders.didactaliaTraces import DidactaliaLearningTracesParser
+from ..tracesLoaders.questionnaires import QuestionnaireParser
+
+__all__ = ['BenchmarkRunner']
+
+LOG = logging.getLogger(__name__)
+
+PARSERS_NAME = ['learners', 'didactalia', 'afelApp', 'appQuest', 'knowledge']
+GRAPHS_NAME = ['Graph', 'GraphDuplicateWatcher']
+# turtle-writer is the Turtle writer of the migrator (TurtleWriter), the other formats are rdflib serializers
+SERIALIZATION_FORMATS = ['turtle', 'turtle-writer', 'nt', 'xml', 'pretty-xml', 'n3', 'trix', 'trig', 'nquads']
+
+
+class _TriplesCollector:
+    """
+    A graph-like sink that only keeps the triples added, to replay them later
+    """
+    def __init__(self):
+        self.triples = []
+
+    def add(self, triple):
+        self.triples.append(triple)
+
+
+class BenchmarkRunner:
+    """
+    Measure the throughput (traces/s, triples/s) and the peak RSS of each parser, of the graph implementations
+    used by the migrator and of each serialization format, on a traces directory laid out as resources/raw_traces.
+    Each case is run in a dedicated process so that its peak RSS is not biased by the previous cases.
+    """
+    def __init__(self, data_directory: str, schema_kwargs: dict=None, formats=None, repeat: int=1):
+        """
+        :param data_directory: the traces directory (same layout as resources/raw_traces)
+        :param schema_kwargs: the arguments given to the AfelNamespacesManager
+        :param formats: the serialization formats to measure (all by default)
+        :param repeat: the number of runs of each case, the best run is kept
+        """
+        self.data_directory = data_directory
+        self.schema_kwargs = schema_kwargs if schema_kwargs is not None else dict()
+        self.formats = formats if formats is not None else SERIALIZATION_FORMATS
+        self.repeat = repeat
+
+    @property
+    def files(self) -> dict:
+        g = SyntheticTracesGenerator
+        files = dict(learners=g.LEARNERS_FILE, didactalia=g.DIDACTALIA_FILE, afelApp=g.AFELAPP_FILE,
+                     appQuest=g.APP_QUEST_FILE, appQuestDetails=g.APP_QUEST_DETAILS_FILE,
+                     knowledge=g.KNOWLEDGE_DIRECTORY)
+        files = {k: os.path.join(self.data_directory, v) for k, v in files.items()}
+        return {k: v if os.path.exists(v) else None for k, v in files.items()}
+
+    def run(self) -> dict:
+        """
+        Run all the benchmark cases
+        :return: the report, as a json-serializable dict
+        """
+        files = self.files
+        if files['learners'] is None:
+            raise Exception("No learners mapping file in %s" % self.data_directory)
+        report = dict(date=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                      python=platform.python_version(), rdflib=rdflib.__version__, platform=platform.platform(),
+                      data_directory=os.path.abspath(self.data_directory), repeat=self.repeat,
+                      inventory=self._run_in_process('inventory', None, files, None), results=[])
+        for name in PARSERS_NAME:
+            if files[name] is None:
+                LOG.info("No file for %s, skip its benchmark." % name)
+                continue
+            report['results'].append(self._run_case('parser', name, files, report['inventory'][name]))
+        for name in GRAPHS_NAME:
+            report['results'].append(self._run_case('graph', name, files))
+        for name in self.formats:
+            report['results'].append(self._run_case('serialization', name, files))
+        return report
+
+    def _run_case(self, kind: str, name: str, files: dict, nb_items: int=None) -> dict:
+        LOG.info("Benchmark %s %s..." % (kind, name))
+        runs = [self._run_in_process(kind, name, files, nb_items) for _ in range(self.repeat)]
+        result = min(runs, key=lambda r: r['seconds'])
+        result['peak_rss'] = max(r['peak_rss'] for r in runs)
+        LOG.info("%s %s: %.3fs, %.0f items/s, %.0f triples/s, peak RSS %.1f MiB"
+                 % (kind, name, result['seconds'], result['items_per_second'], result['triples_per_second'],
+                    result['peak_rss'] / 2**20))
+        return result
+
+    def _run_in_process(self, kind: str, name: str, files: dict, nb_items: int) -> dict:
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_case_process,
+                                          args=(child_conn, kind, name, files, self.schema_kwargs, nb_items))
+        process.start()
+        child_conn.close()
+        try:
+            result = parent_conn.recv()
+        except EOFError:
+            raise Exception("Benchmark case %s %s died (exit code %s)" % (kind, name, process.exitcode))
+        finally:
+            process.join()
+        if 'error' in result:
+            raise Exception("Benchmark case %s %s failed: %s" % (kind, name, result['error']))
+        return result
+
+
+def _run_case_process(conn, kind, name, files, schema_kwargs, nb_items):
+    try:
+        if kind == 'inventory':
+            result = _inventory(files)
+        else:
+            AfelNamespacesManager(**schema_kwargs)
+            extra = dict()
+            if kind == 'parser':
+                triples, seconds = _bench_parser(name, files)
+                items = nb_items
+            elif kind == 'graph':
+                items, triples, seconds = _bench_graph(name, files)
+            else:
+                triples, seconds, extra['output_size'], extra['serialization_rss'] = _bench_serialization(name, files)
+                items = triples
+            result = dict(kind=kind, name=name, items=items, triples=triples, seconds=seconds,
+                          items_per_second=items / seconds if seconds else 0.,
+                          triples_per_second=triples / seconds if seconds else 0., peak_rss=peak_rss(), **extra)
+    except Exception as e:
+        result = dict(error="%s: %s" % (type(e).__name__, str(e)))
+    conn.send(result)
+    conn.close()
+
+
+def _inventory(files) -> dict:
+    def count_csv_rows(filename):
+        with open(filename, 'r') as f:
+            return sum(1 for _ in csv.reader(f)) - 1
+
+    def count_hits(filename):
+        with open(filename, 'rb') as f:
+            return len(json.load(f)['hits']['hits'])
+
+    inventory = dict()
+    inventory['learners'] = count_csv_rows(files['learners'])
+    for name in ('didactalia', 'afelApp'):
+        if files[name] is not None:
+            inventory[name] = count_hits(files[name])
+    for name in ('appQuest', 'knowledge'):
+        if files[name] is not None:
+            inventory[name] = sum(count_csv_rows(layout.filename) for layout in _questionnaire_layouts(files, name))
+    return inventory
+
+
+def _questionnaire_layouts(files, source) -> list:
+    """
+    :return: the layouts of the questionnaires of a source of the default manifest, relocated to the generated files
+    """
+    from ..migrator import default_questionnaires
+    manifest = default_questionnaires(files['appQuest'], files['appQuestDetails'], files['knowledge'] or '')
+    return [layout for layout in manifest.questionnaires if layout.source == source]
+
+
+def _load_learners(files, graph) -> (LearnerMappingParser, int):
+    learners_parser = LearnerMappingParser()
+    with open(files['learners'], 'r') as f:
+        nb_triples = learners_parser.load_and_dump(f, graph)
+    return learners_parser, nb_triples
+
+
+def _bench_parser(name, files) -> (int, float):
+    """
+    Time the loading and the dump of a single source into a Graph
+    :return: the number of triples generated and the time spent
+    """
+    graph = Graph()
+    if name == 'learners':
+        start = time.perf_counter()
+        _, nb_triples = _load_learners(files, graph)
+        return nb_triples, time.perf_counter() - start
+    learners_parser, _ = _load_learners(files, Graph())
+    start = time.perf_counter()
+    if name == 'didactalia':
+        with open(files['didactalia'], 'rb') as f:
+            nb_triples = DidactaliaLearningTracesParser().load_and_dump(f, learners_parser, graph)
+    elif name == 'afelApp':
+        with open(files['afelApp'], 'rb') as f:
+            nb_triples = AfelAppTracesParser().load_and_dump(f, learners_parser, graph)
+    else:
+        nb_triples = sum(QuestionnaireParser(layout).load_files_and_dump(learners_parser, graph)
+                         for layout in _questionnaire_layouts(files, name))
+    return nb_triples, time.perf_counter() - start
+
+
+def _collect_all_triples(files) -> list:
+    collector = _TriplesCollector()
+    learners_parser, _ = _load_learners(files, collector)
+    if files['didactalia'] is not None:
+        with open(files['didactalia'], 'rb') as f:
+            DidactaliaLearningTracesParser().load_and_dump(f, learners_parser, collector)
+    if files['afelApp'] is not None:
+        with open(files['afelApp'], 'rb') as f:
+            AfelAppTracesParser().load_and_dump(f, learners_parser, collector)
+    for name in ('appQuest', 'knowledge'):
+        if files[name] is not None:
+            for layout in _questionnaire_layouts(files, name):
+                QuestionnaireParser(layout).load_files_and_dump(learners_parser, collector)
+    return collector.triples
+
+
+def _bench_graph(name, files) -> (int, int, float):
+    """
+    Time the insertion of all the generated triples (duplicates included) into a graph implementation
+    :return: the number of triples inserted, the number of triples in the graph and the time spent
+    """
+    from ..migrator import GraphDuplicateWatcher
+    triples = _collect_all_triples(files)
+    graph = GraphDuplicateWatcher() if name == 'GraphDuplicateWatcher' else Graph()
+    # Duplicates warnings would bias the measure
+    logging.getLogger('afelTraces2rdf.migrator').setLevel(logging.ERROR)
+    start = time.perf_counter()
+    for triple in triples:
+        graph.add(triple)
+    return len(triples), len(graph), time.perf_counter() - start
+
+
+def _bench_serialization(name, files) -> (int, float, int, int):
+    """
+    Time the serialization of the whole graph into a temporary file
+    :return: the number of triples serialized, the time spent, the size of the file written (bytes) and the growth of
+    the peak RSS during the serialization (bytes)
+    """
+    graph = Graph()
+    for triple in _collect_all_triples(files):
+        graph.add(triple)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        destination = os.path.join(tmp_dir, 'output')
+        rss = peak_rss()
+        start = time.perf_counter()
+        if name == 'turtle-writer':
+            save_turtle(graph, destination)
+        else:
+            graph.serialize(destination, format=name)
+        seconds = time.perf_counter() - start
+        return len(graph), seconds, os.path.getsize(destination), peak_rss() - rss
+
+
+def configure_args():
+    parser = argparse.ArgumentParser(description="Benchmark the traces loaders, the graph and the serialization "
+                                                 "formats on a traces directory")
+    parser.add_argument('report', help='Output JSON report file', type=str)
+    parser.add_argument('-d', '--data-directory', help='Traces directory, laid out as resources/raw_traces. '
+                                                       'A temporary one is used if --generate is set and '
+                                                       'no directory is given', type=str, default=None)
+    parser.add_argument('-g', '--generate', help='Generate synthetic traces into the data directory before '
+                                                 'running the benchmark', action='store_true')
+    parser.add_argument('-l', '--learners', help='Number of synthetic learners', type=int, default=100)
+    parser.add_argument('-dt', '--didactalia-traces', help='Number of synthetic Didactalia traces', type=int,
+                        default=10000)
+    parser.add_argument('-at', '--afelapp-traces', help='Number of synthetic AFEL App traces', type=int,
+                        default=5000)
+    parser.add_argument('-gs', '--game-sessions', help='Number of synthetic game sessions', type=int, default=500)
+    parser.add_argument('-qr', '--questionnaire-rows', help='Number of rows of each synthetic questionnaire',
+                        type=int, default=None)
+    parser.add_argument('-s', '--seed', help='Seed of the synthetic traces generator', type=int, default=42)
+    parser.add_argument('-f', '--formats', help='Serialization formats to measure', nargs='+', type=str,
+                        default=SERIALIZATION_FORMATS)
+    parser.add_argument('-r', '--repeat', help='Number of runs of each case (the fastest is kept)', type=int,
+                        default=1)
+
+    parser.add_argument('-ap', '--afel-publicid', help='Afel schema public id', type=str,
+                        default='http://vocab.afel-project.eu/')
+    parser.add_argument('-as', '--afel-schema', help='Afel schema source', type=str,
+                        default='http://data.afel-project.eu/vocab/afel_schema.rdf')
+    parser.add_argument('-eap', '--ext-afel-publicid', help='Extended Afel schema public id', type=str,
+                        default='http://vocab.afel-project.eu/extension/')
+    parser.add_argument('-eas', '--ext-afel-schema', help='Extended Afel schema source', type=str,
+                        default='./resources/afel_schema_extension.rdf')
+    return parser.parse_args()
+
+
+def main():
+    from ..common.utils import get_default_loggin_config
+    get_default_loggin_config(logging.INFO)
+    args = configure_args()
+    schema_kwargs = dict(afel_source=args.afel_schema, afel_publicID=args.afel_publicid,
+                         ext_afel_source=args.ext_afel_schema, ext_afel_publicID=args.ext_afel_publicid)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_directory = args.data_directory if args.data_directory is not None else tmp_dir
+        if args.generate:
+            SyntheticTracesGenerator(nb_learners=args.learners, nb_didactalia_traces=args.didactalia_traces,
+                                     nb_afelapp_traces=args.afelapp_traces, nb_game_sessions=args.game_sessions,
+                                     nb_questionnaire_rows=args.questionnaire_rows,
+                                     seed=args.seed).generate(data_directory)
+        elif args.data_directory is None:
+            print("A data directory is required if synthetic traces are not generated.")
+            sys.exit(1)
+        report = BenchmarkRunner(data_directory, schema_kwargs, formats=args.formats, repeat=args.repeat).run()
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    LOG.info("Report written in %s" % args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import csv
+import uuid
+import random
+import logging
+import argparse
+import datetime
+import ujson as json
+import pytz
+from ..tracesLoaders.questionnaires import QuestionnaireManifest, DEFAULT_MANIFEST
+
+__all__ = ['SyntheticTracesGenerator']
+
+LOG = logging.getLogger(__name__)
+
+
+class SyntheticTracesGenerator:
+    """
+    Generate a synthetic set of raw traces, with the same layout and shapes than the resources/raw_traces directory
+    (learners mapping, elasticsearch exports of Didactalia and AFEL App, App questionnaire and knowledge
+    questionnaires), at a configurable scale.
+    """
+    # (relative path, shape) of each generated file, as expected by the migrator default options
+    LEARNERS_FILE = 'userID_mapping.csv'
+    DIDACTALIA_FILE = os.path.join('didactalia_activity', 'behaviour_traces.json')
+    AFELAPP_FILE = os.path.join('app_logs', 'app_logs.json')
+    APP_QUEST_FILE = os.path.join('app_questionnaire', 'app_questionnaire.csv')
+    APP_QUEST_DETAILS_FILE = os.path.join('app_questionnaire', 'question_details.json')
+    KNOWLEDGE_DIRECTORY = 'knowledge_questionnaire'
+
+    # Layout of the App questionnaire answers (kind, nb of questions), see the answer types of the default manifest
+    _APP_QUEST_LAYOUT = [('int', 27), ('comment', 2), ('int', 5), ('comment', 1), ('int', 3), ('comment', 2),
+                         ('float', 6)]
+    _DIDACTALIA_SIMPLE_ACTIONS = ['resourceVisited', 'freeTextSearch', 'facetsSearchAdd', 'facetsSearchRemove']
+    _GAME_CHANGE_ACTIONS = {'labelStateChange': 'labelState', 'languageChange': 'gameLanguage',
+                            'audioStateChange': 'audioState', 'answersDetailsStateChange': 'answersDetailsState',
+                            'playStudyChange': 'state'}
+    _AFELAPP_TYPES = ['displaychange', 'view scope', 'back', 'activitycheck', 'recocheck']
+    _AFELAPP_TYPES_WEIGHTS = [50, 24, 21, 4, 2]
+    _WORDS = ['river', 'mountain', 'france', 'roman', 'empire', 'lake', 'capital', 'europe', 'war', 'king',
+              'ocean', 'desert', 'volcano', 'revolution', 'castle', 'island', 'border', 'temple', 'city', 'map']
+
+    def __init__(self, nb_learners: int=100, nb_didactalia_traces: int=10000, nb_afelapp_traces: int=5000,
+                 nb_game_sessions: int=500, nb_questionnaire_rows: int=None, nb_artifacts: int=1000,
+                 start_date: datetime.datetime=datetime.datetime(2018, 5, 2, 8, tzinfo=pytz.utc),
+                 nb_days: int=21, seed: int=42):
+        """
+        :param nb_learners: the number of learners of the mapping file
+        :param nb_didactalia_traces: the number of Didactalia traces (game traces excluded)
+        :param nb_afelapp_traces: the number of AFEL App traces
+        :param nb_game_sessions: the number of game sessions played on Didactalia (each generates several traces)
+        :param nb_questionnaire_rows: the number of answered rows of each questionnaire (nb_learners if None)
+        :param nb_artifacts: the number of distinct artifacts viewed
+        :param start_date: the date of the first trace
+        :param nb_days: the number of days covered by the traces
+        :param seed: the seed of the random generator, for reproducible data sets
+        """
+        self.nb_learners = nb_learners
+        self.nb_didactalia_traces = nb_didactalia_traces
+        self.nb_afelapp_traces = nb_afelapp_traces
+        self.nb_game_sessions = nb_game_sessions
+        self.nb_questionnaire_rows = min(nb_learners, nb_questionnaire_rows if nb_questionnaire_rows is not None
+                                         else nb_learners)
+        self.nb_artifacts = nb_artifacts
+        self.start_date = start_date
+        self.nb_days = nb_days
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._learners = []
+
+    def generate(self, directory: str) -> dict:
+        """
+        Generate the whole data set into a directory
+        :param directory: the destination directory (created if needed)
+        :return: a dict of the number of items written for each file
+        """
+        self._random.seed(self.seed)
+        for sub_dir in (os.path.dirname(self.DIDACTALIA_FILE), os.path.dirname(self.AFELAPP_FILE),
+                        os.path.dirname(self.APP_QUEST_FILE), self.KNOWLEDGE_DIRECTORY):
+            os.makedirs(os.path.join(directory, sub_dir), exist_ok=True)
+        counts = dict()
+        LOG.info("Generate %d learners..." % self.nb_learners)
+        with open(os.path.join(directory, self.LEARNERS_FILE), 'w', newline='') as f:
+            counts['learners'] = self.write_learners(f)
+        LOG.info("Generate Didactalia traces...")
+        with open(os.path.join(directory, self.DIDACTALIA_FILE), 'w') as f:
+            counts['didactalia'] = self.write_didactalia_traces(f)
+        LOG.info("Generate AFEL App traces...")
+        with open(os.path.join(directory, self.AFELAPP_FILE), 'w') as f:
+            counts['afelApp'] = self.write_afelapp_traces(f)
+        LOG.info("Generate AFEL App questionnaire...")
+        with open(os.path.join(directory, self.APP_QUEST_FILE), 'w', newline='') as f_data, \
+                open(os.path.join(directory, self.APP_QUEST_DETAILS_FILE), 'w') as f_details:
+            counts['appQuest'] = self.write_app_questionnaire(f_data, f_details)
+        LOG.info("Generate knowledge questionnaires...")
+        counts['knowledge'] = 0
+        for filename in self._knowledge_filenames():
+            with open(os.path.join(directory, self.KNOWLEDGE_DIRECTORY, filename), 'w', newline='') as f:
+                counts['knowledge'] += self.write_knowledge_questionnaire(f, nb_questions=40 if 'calib' in filename
+                                                                         or 'final' in filename else 10)
+        LOG.info("Generation done: %s" % counts)
+        return counts
+
+    @staticmethod
+    def _knowledge_filenames() -> list:
+        manifest = QuestionnaireManifest.load(DEFAULT_MANIFEST)
+        return [os.path.basename(layout.filename) for layout in manifest.questionnaires if layout.source == 'knowledge']
+
+    def write_learners(self, f) -> int:
+        self._learners = [("project.afel+%03d@gmail.com" % (i + 1), str(uuid.UUID(int=self._random.getrandbits(128))))
+                          for i in range(self.nb_learners)]
+        writer = csv.writer(f, dialect='unix')
+        writer.writerow(['login', 'userid'])
+        writer.writerows(self._learners)
+        return len(self._learners)
+
+    def write_didactalia_traces(self, f) -> int:
+        sources = [self._didactalia_simple_source() for _ in range(self.nb_didactalia_traces)]
+        for _ in range(self.nb_game_sessions):
+            sources.extend(self._didactalia_game_sources())
+        self._random.shuffle(sources)
+        return self._write_es_export(f, 'afel-didactalia-behaviour', sources)
+
+    def write_afelapp_traces(self, f) -> int:
+        sources = [self._afelapp_source() for _ in range(self.nb_afelapp_traces)]
+        return self._write_es_export(f, 'afel-didactalia-logs', sources)
+
+    def write_app_questionnaire(self, f_data, f_details) -> int:
+        headers = ['ID']
+        kinds = []
+        for kind, nb in self._APP_QUEST_LAYOUT:
+            for _ in range(nb):
+                headers.append('Q%d' % len(headers))
+                kinds.append(kind)
+        json.dump({h: "Synthetic question %s" % h for h in headers}, f_details)
+        writer = csv.writer(f_data, dialect='unix', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(headers)
+        internal_ids = self._sample_internal_ids()
+        i = 0
+        while i < len(internal_ids):
+            row_ids = str(internal_ids[i])
+            # Some rows are shared by several learners, as in the original questionnaire: the next learner has then
+            # no row of its own, not to give it two sets of answers
+            if i % 10 == 9 and i + 1 < len(internal_ids):
+                row_ids = "%s&%d" % (row_ids, internal_ids[i + 1])
+                i += 1
+            writer.writerow([row_ids] + [self._app_answer(kind) for kind in kinds])
+            i += 1
+        return len(internal_ids)
+
+    def write_knowledge_questionnaire(self, f, nb_questions: int) -> int:
+        writer = csv.writer(f, dialect='unix', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(['userID'] + ['q%d' % (i + 1) for i in range(nb_questions)] + ['time', 'ip'])
+        internal_ids = self._sample_internal_ids()
+        for i, internal_id in enumerate(internal_ids):
+            # Some rows give the learner email instead of its internal id
+            uid = self._learners[internal_id - 1][0] if i % 7 == 6 else str(internal_id)
+            date = self._random_date().astimezone(pytz.timezone('Europe/Madrid'))
+            writer.writerow([uid] + [self._random.randint(1, 5) for _ in range(nb_questions)]
+                            + [date.strftime('%Y-%m-%d %H:%M:%S'), '10.0.%d.%d' % divmod(internal_id % 65536, 256)])
+        return len(internal_ids)
+
+    def _write_es_export(self, f, index: str, sources: list) -> int:
+        # Write hits one by one to keep memory bounded on large exports
+        f.write('{"took": 30, "timed_out": false, '
+                '"_shards": {"total": 1, "successful": 1, "failed": 0}, '
+                '"hits": {"total": %d, "max_score": 1.0, "hits": [\n' % len(sources))
+        for i, source in enumerate(sources):
+            if i > 0:
+                f.write(',\n')
+            f.write(json.dumps({'_index': index, '_type': 'event', '_id': self._random_es_id(), '_score': 1.0,
+                                '_source': source}))
+        f.write('\n]}}\n')
+        return len(sources)
+
+    def _didactalia_base_source(self, action_type, date=None, user_id=None):
+        return {'user_id': user_id if user_id is not None else self._random_userid(),
+                'community_id': '0000-didactalia', 'actionType': action_type, 'type': action_type,
+                'date': self._format_didactalia_date(date if date is not None else self._random_date())}
+
+    def _didactalia_simple_source(self):
+        action_type = self._random.choice(self._DIDACTALIA_SIMPLE_ACTIONS)
+        source = self._didactalia_base_source(action_type)
+        if action_type == 'resourceVisited':
+            artifact_id = self._random_artifact_id()
+            source['Item'] = artifact_id
+            source['referer_url'] = 'https://didactalia.net/comunidad/recurso/%s' % artifact_id
+        elif action_type == 'freeTextSearch':
+            source['search_text'] = self._random_text(1, 3)
+        else:
+            source['facet'] = 'rdf:type=%s' % self._random.choice(self._WORDS)
+        return source
+
+    def _didactalia_game_sources(self):
+        user_id = self._random_userid()
+        play_session = str(uuid.UUID(int=self._random.getrandbits(128)))
+        resource_id = self._random_artifact_id()
+        date = self._random_date()
+        common = {'playSession': play_session, 'resource_id': resource_id, 'gameLanguage': 'es',
+                  'labelState': 'on', 'answersDetailsState': 'off', 'audioState': 'on', 'state': 'play'}
+        start = self._didactalia_base_source('playStart', date, user_id)
+        start.update(common)
+        start.update({'longitude': '%.6f' % self._random.uniform(-10, 10),
+                      'latitude': '%.6f' % self._random.uniform(35, 50),
+                      'zoomLevel': str(self._random.randint(1, 12))})
+        sources = [start]
+        for _ in range(self._random.randint(0, 3)):
+            date += datetime.timedelta(seconds=self._random.randint(1, 60))
+            change = self._didactalia_base_source(self._random.choice(list(self._GAME_CHANGE_ACTIONS)),
+                                                  date, user_id)
+            change.update(common)
+            sources.append(change)
+        # A few sessions are never ended
+        if self._random.random() < 0.9:
+            date += datetime.timedelta(seconds=self._random.randint(30, 900))
+            end = self._didactalia_base_source('playEnd', date, user_id)
+            end.update(common)
+            total = self._random.randint(5, 20)
+            corrects = [self._random.randint(0, total // 4) for _ in range(4)]
+            end.update({'correctAtFirst': str(corrects[0]), 'correctAtSecond': str(corrects[1]),
+                        'correctAtThird': str(corrects[2]), 'correctAtFourth': str(corrects[3]),
+                        'totalElements': str(total), 'score': str(self._random.randint(0, 1000))})
+            sources.append(end)
+        return sources
+
+    def _afelapp_source(self):
+        action_type = self._random.choices(self._AFELAPP_TYPES, weights=self._AFELAPP_TYPES_WEIGHTS)[0]
+        if action_type in ('activitycheck', 'recocheck'):
+            label = 'https://didactalia.net/comunidad/recurso/%s' % self._random_artifact_id()
+            message = 'clicked on resource %s :: %s' % (label, self._random_text(5, 40))
+        elif action_type == 'view scope':
+            label = self._random_text(1, 2)
+            message = 'clicked on scope %s' % label
+        elif action_type == 'displaychange':
+            label = self._random.choice(['diversity', 'mixed', 'coverage'])
+            message = 'change the display to %s' % label
+        else:
+            label = self._random.choice(['scopes', 'activities', 'recommendations'])
+            message = 'go back to %s' % label
+        return {'user': self._random_userid(), 'type': action_type, 'label': label, 'message': message,
+                'time': int(self._random_date().timestamp() * 1000)}
+
+    def _app_answer(self, kind):
+        if kind == 'int':
+            return self._random.randint(1, 7)
+        elif kind == 'float':
+            return '%.1f' % self._random.uniform(1, 7)
+        # Comments may be left empty
+        return self._random_text(2, 12) if self._random.random() < 0.7 else ''
+
+    def _sample_internal_ids(self):
+        ids = self._random.sample(range(1, self.nb_learners + 1), self.nb_questionnaire_rows)
+        ids.sort()
+        return ids
+
+    def _random_userid(self):
+        return self._random.choice(self._learners)[1]
+
+    def _random_artifact_id(self):
+        return 'art-%06d' % self._random.randrange(self.nb_artifacts)
+
+    def _random_es_id(self):
+        return '%020x' % self._random.getrandbits(80)
+
+    def _random_text(self, min_words, max_words):
+        return ' '.join(self._random.choice(self._WORDS) for _ in range(self._random.randint(min_words, max_words)))
+
+    def _random_date(self):
+        return self.start_date + datetime.timedelta(seconds=self._random.randrange(self.nb_days * 86400),
+                                                    milliseconds=self._random.randrange(1000))
+
+    @staticmethod
+    def _format_didactalia_date(date):
+        return date.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (date.microsecond // 1000)
+
+
+def configure_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic set of raw traces with the same layout "
+                                                 "than resources/raw_traces")
+    parser.add_argument('directory', help='Output directory', type=str)
+    parser.add_argument('-l', '--learners', help='Number of learners', type=int, default=100)
+    parser.add_argument('-dt', '--didactalia-traces', help='Number of Didactalia traces (game traces excluded)',
+                        type=int, default=10000)
+    parser.add_argument('-at', '--afelapp-traces', help='Number of AFEL App traces', type=int, default=5000)
+    parser.add_argument('-gs', '--game-sessions', help='Number of Didactalia game sessions', type=int, default=500)
+    parser.add_argument('-qr', '--questionnaire-rows', help='Number of rows of each questionnaire '
+                                                            '(default: one per learner)', type=int, default=None)
+    parser.add_argument('-na', '--artifacts', help='Number of distinct artifacts', type=int, default=1000)
+    parser.add_argument('-s', '--seed', help='Seed of the random generator', type=int, default=42)
+    return parser.parse_args()
+
+
+def main():
+    from ..common.utils import get_default_loggin_config
+    get_default_loggin_config(logging.INFO)
+    args = configure_args()
+    generator = SyntheticTracesGenerator(nb_learners=args.learners, nb_didactalia_traces=args.didactalia_traces,
+                                         nb_afelapp_traces=args.afelapp_traces, nb_game_sessions=args.game_sessions,
+                                         nb_questionnaire_rows=args.questionnaire_rows, nb_artifacts=args.artifacts,
+                                         seed=args.seed)
+    generator.generate(args.directory)
+
+
+if __name__ == '__main__':
+    main()
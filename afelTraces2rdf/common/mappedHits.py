@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import re
+import mmap
+import hashlib
+import logging
+from array import array
+import ujson as json
+
+__all__ = ['MappedHits', 'load_hits', 'select_hits', 'select_hits_where']
+
+LOG = logging.getLogger(__name__)
+
+# Start of the hits array of an Elasticsearch export ({"hits": {"total": ..., "hits": [...]}})
+_HITS_ARRAY = re.compile(rb'"hits"\s*:\s*\[')
+# Next structural character of the hits array (group 1), skipping the plain characters and the strings in between
+# so that the braces inside the strings are ignored
+_TOKEN = re.compile(rb'[^"{}\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\]]*)*([{}\]])', re.DOTALL)
+
+
+class MappedHits:
+    """
+    The hits of an Elasticsearch export file, mapped in memory.
+    The file is scanned once, on the first access to a hit, to locate the boundaries of each hit; a hit is decoded
+    only when it is accessed. The mapping is read-only and backed by the page cache, so that processes mapping the
+    same file share one copy: only the hit decoded is copied. When all the hits are needed, decode_all decodes the
+    file at once instead, faster but copying the whole file in memory.
+    """
+    def __init__(self, filename: str, decode_whole: bool=False):
+        """
+        :param filename: the export file (an uncompressed JSON file)
+        :param decode_whole: True to decode the file at once when all its hits are needed (see load_hits)
+        """
+        self.filename = filename
+        self.decode_whole = decode_whole
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._file.close()
+            raise ValueError("%s is empty" % filename)
+        self._starts = None
+        self._ends = None
+
+    def _locate_hits(self) -> array:
+        """
+        Locate the boundaries of the hits, on the first call
+        :return: the starts of the hits
+        """
+        if self._starts is not None:
+            return self._starts
+        mapped = self._map
+        match = _HITS_ARRAY.search(mapped)
+        if match is None:
+            raise ValueError("No hits array found in %s" % self.filename)
+        starts = array('Q')
+        ends = array('Q')
+        depth = 0
+        start = 0
+        for token in _TOKEN.finditer(mapped, match.end()):
+            position = token.start(1)
+            char = mapped[position]
+            if char == 0x7b:  # {
+                if depth == 0:
+                    start = position
+                depth += 1
+            elif char == 0x7d:  # }
+                depth -= 1
+                if depth == 0:
+                    starts.append(start)
+                    ends.append(position + 1)
+            elif char == 0x5d and depth == 0:  # ] closing the hits array
+                self._starts = starts
+                self._ends = ends
+                return starts
+        raise ValueError("Unterminated hits array in %s" % self.filename)
+
+    def digest(self) -> str:
+        """
+        :return: the content hash of the file, computed on the mapping
+        """
+        return hashlib.blake2b(self._map, digest_size=32).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._locate_hits())
+
+    def __iter__(self):
+        for i in range(len(self._locate_hits())):
+            yield self.decode(i)
+
+    def __getitem__(self, index: int) -> dict:
+        return self.decode(index)
+
+    def raw(self, index: int) -> memoryview:
+        """
+        :return: a read-only view of the raw JSON of a hit, without any copy. It has to be released before the
+        mapping is closed.
+        """
+        self._locate_hits()
+        return memoryview(self._map)[self._starts[index]:self._ends[index]]
+
+    def decode(self, index: int) -> dict:
+        """
+        :return: the decoded hit
+        """
+        self._locate_hits()
+        # ujson only decodes bytes: the hit (and only it) is copied
+        return json.loads(self._map[self._starts[index]:self._ends[index]])
+
+    def decode_all(self) -> list:
+        """
+        Decode all the hits at once, without locating them: about twice as fast as decoding them one by one, but the
+        whole file is copied in memory (the decoder only accepts bytes), besides the decoded hits
+        :return: the list of decoded hits
+        """
+        return json.loads(self._map[:])['hits']['hits']
+
+    def raw_field(self, index: int, field: str):
+        """
+        Extract a string or number field of a hit from its raw JSON, without decoding it
+        :return: the field value, or None if the field is missing or is neither a plain string nor a number
+        """
+        self._locate_hits()
+        pattern = _field_pattern(field)
+        match = pattern.search(self._map, self._starts[index], self._ends[index])
+        if match is None:
+            return None
+        if match.group(1) is not None:
+            return match.group(1).decode('utf-8')
+        number = match.group(2)
+        return float(number) if b'.' in number or b'e' in number or b'E' in number else int(number)
+
+    def select(self, field: str, predicate):
+        """
+        Decode only the hits of which the given field of their source satisfies the predicate
+        :param field: the name of the field of the hit '_source'
+        :param predicate: a function of the field value
+        :return: a generator of the decoded hits selected
+        """
+        return self.select_where([((field,), predicate)])
+
+    def select_where(self, conditions: list):
+        """
+        Decode only the hits of which the source satisfies all the conditions. The conditions are checked in
+        order, on the raw fields of the hit; a hit is decoded to check them only if a field cannot be extracted.
+        :param conditions: a list of (fields, predicate): the names of fields of the hit '_source' and a function
+        of their values (None for a missing field)
+        :return: a generator of the decoded hits selected
+        """
+        for i in range(len(self._locate_hits())):
+            values = dict()
+            source = None
+            selected = True
+            for fields, predicate in conditions:
+                for field in fields:
+                    if field not in values:
+                        value = self.raw_field(i, field)
+                        if value is None:
+                            # Value missing, escaped or not a string: decode the hit to get it
+                            if source is None:
+                                source = self.decode(i)['_source']
+                            value = source.get(field)
+                        values[field] = value
+                if not predicate(*(values[field] for field in fields)):
+                    selected = False
+                    break
+            if selected:
+                yield self.decode(i)
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_FIELD_PATTERNS = dict()
+
+
+def _field_pattern(field: str):
+    pattern = _FIELD_PATTERNS.get(field)
+    if pattern is None:
+        pattern = re.compile(rb'"' + re.escape(field.encode('utf-8')) +
+                             rb'"\s*:\s*(?:"([^"\\]*)"|(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)\s*[,}])')
+        _FIELD_PATTERNS[field] = pattern
+    return pattern
+
+
+def load_hits(f, selective: bool=True):
+    """
+    Load the hits of an Elasticsearch export
+    :param f: a MappedHits instance, or a file object of the export
+    :param selective: whether the hits are then selected on their raw fields. If not, all of them are decoded at
+    once when the MappedHits instance is created with decode_whole.
+    :return: the MappedHits instance itself, or the list of decoded hits
+    """
+    if isinstance(f, MappedHits):
+        return f.decode_all() if not selective and f.decode_whole else f
+    return json.load(f)['hits']['hits']
+
+
+def select_hits(hits, field: str, predicate):
+    """
+    Select the hits of which the given field of their source satisfies the predicate
+    :param hits: a MappedHits instance or a list of decoded hits
+    :return: a generator of the decoded hits selected
+    """
+    if isinstance(hits, MappedHits):
+        return hits.select(field, predicate)
+    return (hit for hit in hits if predicate(hit['_source'][field]))
+
+
+def select_hits_where(hits, conditions: list):
+    """
+    Select the hits of which the source satisfies all the conditions
+    :param hits: a MappedHits instance or a list of decoded hits
+    :param conditions: a list of (fields, predicate), see MappedHits.select_where
+    :return: a generator of the decoded hits selected
+    """
+    if isinstance(hits, MappedHits):
+        return hits.select_where(conditions)
+    return (hit for hit in hits
+            if all(predicate(*(hit['_source'].get(field) for field in fields)) for fields, predicate in conditions))
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import sys
+import time
+import logging
+import resource
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+import ujson as json
+
+__all__ = ['StageRecord', 'ConversionMetrics', 'REPORT_FORMATS']
+
+LOG = logging.getLogger(__name__)
+
+REPORT_FORMATS = ['json', 'prometheus']
+
+
+def peak_rss() -> int:
+    """
+    :return: the peak resident set size of the current process, in bytes
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class StageRecord:
+    """
+    Measures of a stage (loading, normalization, sorting...) of a source (learners, didactalia...).
+    A stage run several times (e.g. once per knowledge questionnaire file) accumulates its measures.
+    """
+    __slots__ = ('source', 'stage', 'seconds', 'items', 'triples', 'peak_rss', 'runs')
+
+    def __init__(self, source: str, stage: str):
+        self.source = source
+        self.stage = stage
+        self.seconds = 0.
+        self.items = 0
+        self.triples = 0
+        self.peak_rss = 0
+        self.runs = 0
+
+    @property
+    def triples_per_second(self) -> float:
+        return self.triples / self.seconds if self.seconds > 0 else 0.
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds > 0 else 0.
+
+    def to_dict(self) -> dict:
+        return dict(source=self.source, stage=self.stage, seconds=self.seconds, items=self.items,
+                    triples=self.triples, items_per_second=self.items_per_second,
+                    triples_per_second=self.triples_per_second, peak_rss=self.peak_rss, runs=self.runs)
+
+
+class ConversionMetrics:
+    """
+    Collect per-source and per-stage measures (wall time, items, triples, peak memory) and per-activity-class
+    triple counts during a conversion, and write them as a JSON or a Prometheus textfile report.
+    """
+    def __init__(self):
+        self._stages = OrderedDict()
+        self._classes = OrderedDict()
+        self._counters = OrderedDict()
+
+    @contextmanager
+    def stage(self, source: str, stage: str):
+        """
+        Measure a stage. The yielded record can be used to count the items and the triples processed.
+        :param source: the source name
+        :param stage: the stage name
+        """
+        record = self._stages.get((source, stage))
+        if record is None:
+            record = self._stages[(source, stage)] = StageRecord(source, stage)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds += time.perf_counter() - start
+            record.peak_rss = max(record.peak_rss, peak_rss())
+            record.runs += 1
+
+    def count_class(self, source: str, class_name: str, nb_items: int, nb_triples: int) -> None:
+        """
+        Count the items and triples generated by an RDF representation class
+        """
+        key = (source, class_name)
+        items, triples = self._classes.get(key, (0, 0))
+        self._classes[key] = (items + nb_items, triples + nb_triples)
+
+    def count_dump(self, source: str, representations, graph) -> int:
+        """
+        Dump some RDF representations into a graph while counting their triples by class
+        :param source: the source name
+        :param representations: an iterable of RdfRepresentation
+        :param graph: the graph
+        :return: the number of triples generated
+        """
+        by_class = dict()
+        for representation in representations:
+            nb_triples = representation.dump_to_graph(graph)
+            class_name = type(representation).__name__
+            items, triples = by_class.get(class_name, (0, 0))
+            by_class[class_name] = (items + 1, triples + nb_triples)
+        for class_name, (items, triples) in by_class.items():
+            self.count_class(source, class_name, items, triples)
+        return sum(triples for _, triples in by_class.values())
+
+    def merge(self, report: dict) -> None:
+        """
+        Accumulate the measures of another collector, given as its to_dict() report (e.g. from a worker process)
+        """
+        for r in report['stages']:
+            record = self._stages.get((r['source'], r['stage']))
+            if record is None:
+                record = self._stages[(r['source'], r['stage'])] = StageRecord(r['source'], r['stage'])
+            record.seconds += r['seconds']
+            record.items += r['items']
+            record.triples += r['triples']
+            record.peak_rss = max(record.peak_rss, r['peak_rss'])
+            record.runs += r['runs']
+        for c in report['classes']:
+            self.count_class(c['source'], c['class_name'], c['items'], c['triples'])
+
+    def set_counter(self, name: str, value) -> None:
+        self._counters[name] = value
+
+    @property
+    def stages(self) -> list:
+        return list(self._stages.values())
+
+    def to_dict(self) -> dict:
+        return dict(stages=[r.to_dict() for r in self._stages.values()],
+                    classes=[dict(source=source, class_name=class_name, items=items, triples=triples)
+                             for (source, class_name), (items, triples) in self._classes.items()],
+                    counters=dict(self._counters))
+
+    def to_prometheus(self, prefix: str='afel_migrator') -> str:
+        lines = []
+
+        def add_metric(name, metric_type, help_text, samples):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, metric_type))
+            for labels, value in samples:
+                label_str = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                     for k, v in labels)
+                lines.append("%s_%s%s %s" % (prefix, name, '{%s}' % label_str if label_str else '',
+                                             repr(float(value))))
+
+        stages = self._stages.values()
+        add_metric('stage_seconds', 'gauge', 'Wall time of the stage',
+                   [((('source', r.source), ('stage', r.stage)), r.seconds) for r in stages])
+        add_metric('stage_items', 'gauge', 'Items processed by the stage',
+                   [((('source', r.source), ('stage', r.stage)), r.items) for r in stages])
+        add_metric('stage_triples', 'gauge', 'Triples generated by the stage',
+                   [((('source', r.source), ('stage', r.stage)), r.triples) for r in stages])
+        add_metric('stage_triples_per_second', 'gauge', 'Triples generated per second by the stage',
+                   [((('source', r.source), ('stage', r.stage)), r.triples_per_second) for r in stages])
+        add_metric('stage_peak_rss_bytes', 'gauge', 'Peak resident set size at the end of the stage',
+                   [((('source', r.source), ('stage', r.stage)), r.peak_rss) for r in stages])
+        add_metric('class_items', 'gauge', 'Instances dumped by RDF representation class',
+                   [((('source', s), ('class', c)), items) for (s, c), (items, _) in self._classes.items()])
+        add_metric('class_triples', 'gauge', 'Triples generated by RDF representation class',
+                   [((('source', s), ('class', c)), triples) for (s, c), (_, triples) in self._classes.items()])
+        for name, value in self._counters.items():
+            add_metric(name, 'gauge', name.replace('_', ' ').capitalize(), [((), value)])
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, destination: str, format: str='json') -> None:
+        """
+        Write the report into a file. The file is replaced atomically so that a textfile collector never reads a
+        partial report.
+        :param destination: the report filename
+        :param format: the report format ('json' or 'prometheus')
+        """
+        if format not in REPORT_FORMATS:
+            raise ValueError("Unknown metrics report format %s" % format)
+        content = json.dumps(self.to_dict(), indent=2) if format == 'json' else self.to_prometheus()
+        directory = os.path.dirname(os.path.abspath(destination))
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.metrics')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp_name, destination)
+        except Exception:
+            os.remove(tmp_name)
+            raise
+
+    def log_summary(self, level=logging.INFO) -> None:
+        for r in self._stages.values():
+            LOG.log(level, "%-12s %-14s %8.3fs %9d items %9d triples %10.0f triples/s peak RSS %.1f MiB"
+                    % (r.source, r.stage, r.seconds, r.items, r.triples, r.triples_per_second, r.peak_rss / 2**20))
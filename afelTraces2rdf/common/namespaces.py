@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 # author: Rémi Venant
 import logging
-from rdflib import Graph
 from rdflib.namespace import ClosedNamespace, Namespace
 from .utils import Singleton
+from .vocabularyBuilder import schema_names
+from . import vocabulary
 
-__all__ = ['concatenate_uriref', 'AfelNamespacesManager']
+__all__ = ['concatenate_uriref', 'schema_names', 'AfelNamespacesManager']
 
 LOG = logging.getLogger(__name__)
 
@@ -25,9 +26,36 @@ class AfelNamespacesManager(metaclass=Singleton):
                     afel_publicID="http://vocab.afel-project.eu/",
                     ext_afel_source="./resources/afel_schema_extension.rdf",
                     ext_afel_publicID="http://vocab.afel-project.eu/extension/"):
-        self._afel_ns = self.__get_closed_ns(afel_source, afel_publicID)
-        self._ext_afel_ns = self.__get_closed_ns(ext_afel_source, ext_afel_publicID)
-        self._schema_ns = Namespace('http://schema.org/')
+        self._schema_kwargs = dict(afel_source=afel_source, afel_publicID=afel_publicID,
+                                   ext_afel_source=ext_afel_source, ext_afel_publicID=ext_afel_publicID)
+        afel_names = schema_names(afel_source, afel_publicID)
+        ext_afel_names = schema_names(ext_afel_source, ext_afel_publicID)
+        self._afel_ns = ClosedNamespace(afel_publicID, afel_names)
+        self._ext_afel_ns = ClosedNamespace(ext_afel_publicID, ext_afel_names)
+        self._schema_ns = Namespace(vocabulary.SCHEMA_NS)
+        self._namespaces = (self._afel_ns, self._ext_afel_ns, self._schema_ns)
+        self.__check_vocabulary(afel_publicID, afel_names, ext_afel_publicID, ext_afel_names)
+
+    @staticmethod
+    def __check_vocabulary(afel_publicID, afel_names, ext_afel_publicID, ext_afel_names):
+        """
+        Check once that the constants of the generated vocabulary module, used instead of the closed namespaces while
+        converting, are terms of the namespaces loaded
+        """
+        for label, publicID, names, generated_publicID, generated_names in (
+                ('AFEL', afel_publicID, afel_names, vocabulary.AFEL_NS, vocabulary.AFEL_NAMES),
+                ('extended AFEL', ext_afel_publicID, ext_afel_names, vocabulary.EXT_AFEL_NS,
+                 vocabulary.EXT_AFEL_NAMES)):
+            if publicID != generated_publicID:
+                raise ValueError("The vocabulary module was generated for the %s public id %s, not %s: regenerate it "
+                                 "with afelTraces2rdf.common.vocabularyBuilder" % (label, generated_publicID, publicID))
+            unknown = sorted(generated_names - names)
+            if unknown:
+                raise ValueError("Terms of the vocabulary module are not in the %s schema (%s): regenerate it with "
+                                 "afelTraces2rdf.common.vocabularyBuilder" % (label, ', '.join(unknown)))
+            if names - generated_names:
+                LOG.warning("%d terms of the %s schema have no constant in the vocabulary module" %
+                            (len(names - generated_names), label))
 
 
     @property
@@ -42,20 +70,20 @@ class AfelNamespacesManager(metaclass=Singleton):
     def schema_ns(self):
         return self._schema_ns
 
-    @staticmethod
-    def __get_closed_ns(source, publicID):
-        g = Graph()
-        g.load(source, publicID=publicID)
-        names = set()
-        for s, _, _ in g:
-            try:
-                name = g.qname(s)
-                if name.startswith('ns1:'):
-                    names.add(name[4:])
-            except Exception as e:
-                if not str(e).startswith("Can't split"):
-                    raise e
-        return ClosedNamespace(publicID, names)
+    @property
+    def schema_kwargs(self) -> dict:
+        """
+        The arguments the namespaces were initialized with (e.g. to initialize them in a worker process)
+        """
+        return dict(self._schema_kwargs)
+
+    @property
+    def namespaces(self) -> tuple:
+        """
+        The AFEL, extended AFEL and Schema namespaces (a new tuple each time they are initialized)
+        """
+        return self._namespaces
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import ujson as json
+
+__all__ = ['OutputCache']
+
+LOG = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1 << 20
+
+
+class OutputCache:
+    """
+    Content-addressed cache of the outputs of the migrator.
+    An output is stored under the fingerprint of everything it depends on: the input files (size, modification
+    time and content hash), the schema sources, the migrator sources and the options that change the output. A
+    rerun with the same fingerprint hard-links the cached output instead of converting again. The cache size is
+    bounded: the least recently used outputs are evicted first.
+    """
+    INDEX_FILENAME = 'cache_index.json'
+
+    def __init__(self, directory: str, max_size: int=1 << 30):
+        """
+        :param directory: the cache directory
+        :param max_size: the maximum size of the cached outputs, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._index = self._load_index()
+
+    @property
+    def index_filename(self) -> str:
+        return os.path.join(self.directory, self.INDEX_FILENAME)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict(entries=dict(), files=dict())
+
+    def _save_index(self) -> None:
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix='.index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_filename, self.index_filename)
+
+    def file_digest(self, filename: str) -> str:
+        """
+        :return: the content hash of a file. It is only computed again if the size or the modification time of the
+        file changed since the last computation.
+        """
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        known = self._index['files'].get(filename)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        self._index['files'][filename] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def fingerprint(self, sources: list, options: dict) -> str:
+        """
+        Compute the fingerprint of an output
+        :param sources: the files, directories (all their files) or remote sources (URLs, identified by their
+        name only) the output depends on
+        :param options: the options that change the output
+        :return: the fingerprint
+        """
+        fingerprint = hashlib.sha256()
+        for source in sources:
+            if source is None:
+                fingerprint.update(b'\0')
+                continue
+            filenames = [source]
+            if os.path.isdir(source):
+                filenames = sorted(os.path.join(root, filename) for root, _, filenames in os.walk(source)
+                                   for filename in filenames)
+            for filename in filenames:
+                fingerprint.update(filename.encode('utf-8'))
+                if os.path.isfile(filename):
+                    fingerprint.update(self.file_digest(filename).encode('ascii'))
+        fingerprint.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        self._save_index()
+        return fingerprint.hexdigest()
+
+    def get(self, fingerprint: str, destination: str) -> bool:
+        """
+        Link the cached output of a fingerprint to the destination, if any
+        :return: True if the output was cached
+        """
+        entry = self._index['entries'].get(fingerprint)
+        if entry is None:
+            return False
+        cached = os.path.join(self.directory, entry['filename'])
+        try:
+            st = os.stat(cached)
+        except OSError:
+            st = None
+        if st is None or st.st_size != entry['size'] or st.st_mtime_ns != entry['mtime']:
+            # The cached output was removed or modified in place (through a link): it cannot be used anymore
+            LOG.warning("Cached output %s is missing or has been modified, discarding it." % cached)
+            self._remove(fingerprint)
+            self._save_index()
+            return False
+        self._link(cached, destination)
+        entry['last_used'] = time.time()
+        self._save_index()
+        return True
+
+    def put(self, fingerprint: str, filename: str) -> bool:
+        """
+        Store an output in the cache (as a link of the file if possible), then evict the least recently used
+        outputs beyond the cache size
+        :return: True if the output is kept in the cache (False if it is larger than the cache)
+        """
+        entry_filename = fingerprint + os.path.splitext(filename)[1]
+        cached = os.path.join(self.directory, entry_filename)
+        self._link(filename, cached)
+        st = os.stat(cached)
+        self._index['entries'][fingerprint] = dict(filename=entry_filename, size=st.st_size, mtime=st.st_mtime_ns,
+                                                   last_used=time.time())
+        self._evict()
+        self._save_index()
+        return fingerprint in self._index['entries']
+
+    def _evict(self) -> None:
+        entries = self._index['entries']
+        total_size = sum(entry['size'] for entry in entries.values())
+        for fingerprint in sorted(entries, key=lambda fp: entries[fp]['last_used']):
+            if total_size <= self.max_size:
+                break
+            total_size -= entries[fingerprint]['size']
+            LOG.info("Evicting cached output %s" % entries[fingerprint]['filename'])
+            self._remove(fingerprint)
+
+    def _remove(self, fingerprint: str) -> None:
+        entry = self._index['entries'].pop(fingerprint)
+        try:
+            os.remove(os.path.join(self.directory, entry['filename']))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _link(source: str, destination: str) -> None:
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            return
+        # Link into a temporary file then rename it, so that the destination is never partially written
+        tmp_destination = destination + '.tmp'
+        if os.path.lexists(tmp_destination):
+            os.remove(tmp_destination)
+        try:
+            os.link(source, tmp_destination)
+        except OSError:  # other filesystem, or no hard link support
+            shutil.copy2(source, tmp_destination)
+        os.replace(tmp_destination, destination)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import hashlib
+from .namespaces import concatenate_uriref
+from .vocabulary import AFEL, EXTAFL, SCHEMA
+
+__all__ = ['Partition', 'SHARED_PARTITION']
+
+SHARED_PARTITION = 'shared'
+
+# Prefixes of the subjects of the shared triples
+_SHARED_PREFIXES = (concatenate_uriref(AFEL.Artifact, ''), concatenate_uriref(EXTAFL.Questionnaire, ''),
+                    concatenate_uriref(SCHEMA.Question, ''))
+
+
+class Partition:
+    """
+    A slice of the conversion, to distribute it over several nodes.
+    Partition K/N keeps the learners whose user id hashes to K (modulo N), with all their activities and answers.
+    The shared partition keeps the triples that are not related to a single learner (artifacts, questionnaires
+    and questions) so that they are written only once. The union of the N partitions and of the shared one is
+    the output of a single-node conversion.
+    """
+    def __init__(self, index, count: int):
+        """
+        :param index: the partition index (from 0 to count - 1), or SHARED_PARTITION
+        :param count: the number of learners partitions
+        """
+        if count < 1:
+            raise ValueError("The number of partitions must be positive")
+        if index != SHARED_PARTITION and not 0 <= index < count:
+            raise ValueError("The partition index must be in [0, %d[ or '%s'" % (count, SHARED_PARTITION))
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Partition':
+        """
+        Parse a partition specification "K/N", where K is the index or 'shared'
+        """
+        try:
+            index, count = spec.split('/')
+            index = index.strip()
+            return cls(index if index == SHARED_PARTITION else int(index), int(count))
+        except ValueError as e:
+            raise ValueError("Wrong partition '%s', K/N or %s/N expected (%s)" % (spec, SHARED_PARTITION, str(e)))
+
+    @property
+    def is_shared(self) -> bool:
+        return self.index == SHARED_PARTITION
+
+    @staticmethod
+    def user_partition(userid: str, count: int) -> int:
+        # A stable hash (python hash is salted per process) so that every node computes the same slices
+        return int(hashlib.md5(userid.encode('utf-8')).hexdigest(), 16) % count
+
+    def contains_user(self, userid: str) -> bool:
+        """
+        :return: True if the traces of the user have to be processed by this partition.
+        The shared partition processes all of them to retrieve the shared triples.
+        """
+        return self.is_shared or self.user_partition(userid, self.count) == self.index
+
+    @property
+    def shared_prefixes(self) -> tuple:
+        return _SHARED_PREFIXES
+
+    def contains_triple(self, triple) -> bool:
+        """
+        :return: True if the triple belongs to this partition, according to its subject
+        """
+        is_shared_triple = triple[0].startswith(self.shared_prefixes)
+        return is_shared_triple if self.is_shared else not is_shared_triple
+
+    def __str__(self):
+        return "%s/%d" % (self.index, self.count)
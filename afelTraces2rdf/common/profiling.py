@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import signal
+import logging
+import threading
+import cProfile
+import pstats
+from abc import abstractmethod, ABCMeta
+from collections import OrderedDict
+from contextlib import contextmanager
+from .metrics import ConversionMetrics
+
+__all__ = ['SamplingProfiler', 'CProfileProfiler', 'ProfiledMetrics', 'create_profiler']
+
+LOG = logging.getLogger(__name__)
+
+# Section of the samples taken outside of any stage
+OUTSIDE_SECTION = 'main'
+
+# Code of the dump of the RDF representations by class: the representation it dumps gives the activity class
+_COUNT_DUMP_CODE = ConversionMetrics.count_dump.__code__
+
+
+def _frame_label(code) -> str:
+    return '%s (%s:%d)' % (getattr(code, 'co_qualname', code.co_name), os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class _Profiler(metaclass=ABCMeta):
+    """
+    Base class of the profilers of a conversion: the samples are grouped by section (the 'source:stage' of a
+    metrics stage), and written as collapsed stacks (one 'frame;frame;... weight' line per stack, the input of
+    flamegraph.pl or speedscope) and as a top-N summary by section and activity class.
+    """
+    METHOD = None
+    UNIT = None
+
+    def __init__(self):
+        self._sections = [OUTSIDE_SECTION]
+
+    @property
+    def current_section(self) -> str:
+        return self._sections[-1]
+
+    @contextmanager
+    def section(self, name: str):
+        """
+        Attribute the samples taken in the block to a section
+        """
+        self._enter_section(name)
+        try:
+            yield
+        finally:
+            self._sections.pop()
+            self._switch_section(self.current_section)
+
+    def _enter_section(self, name: str) -> None:
+        self._sections.append(name)
+        self._switch_section(name)
+
+    def _switch_section(self, name: str) -> None:
+        pass
+
+    @abstractmethod
+    def start(self) -> None:
+        pass
+
+    @abstractmethod
+    def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    def collapsed_stacks(self) -> list:
+        """
+        :return: the (collapsed stack, weight) of the profile, the root frame being the section
+        """
+        pass
+
+    @abstractmethod
+    def activity_weights(self) -> OrderedDict:
+        """
+        :return: the weight of each (section, activity class), the class being None outside of the dumps
+        """
+        pass
+
+    @abstractmethod
+    def function_weights(self) -> dict:
+        """
+        :return: the self weight of each (section, function)
+        """
+        pass
+
+    def summary(self, top: int=20) -> str:
+        """
+        :return: the text summary of the top sections and activity classes, and of the top functions of each section
+        """
+        activities = sorted(self.activity_weights().items(), key=lambda item: -item[1])
+        total = sum(weight for _, weight in activities) or 1
+        lines = ["Profile (%s, weights in %s)" % (self.METHOD, self.UNIT), "",
+                 "Top %d sections and activity classes:" % top,
+                 "%-32s %-36s %12s %7s" % ('section', 'activity class', 'weight', '%')]
+        for (section, activity), weight in activities[:top]:
+            lines.append("%-32s %-36s %12d %6.1f%%" % (section, activity or '-', weight, 100. * weight / total))
+        by_section = dict()
+        for (section, function), weight in self.function_weights().items():
+            by_section.setdefault(section, []).append((weight, function))
+        for section in sorted(by_section, key=lambda s: -sum(weight for weight, _ in by_section[s])):
+            functions = sorted(by_section[section], reverse=True)[:top]
+            lines.extend(["", "Top %d functions of %s (self weight):" % (top, section)])
+            lines.extend("%12d %6.1f%%  %s" % (weight, 100. * weight / total, function)
+                         for weight, function in functions)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, prefix: str, top: int=20) -> list:
+        """
+        Write the collapsed stacks into PREFIX.collapsed and the summary into PREFIX.txt
+        :return: the files written
+        """
+        filenames = [prefix + '.collapsed', prefix + '.txt']
+        with open(filenames[0], 'w') as f:
+            for stack, weight in sorted(self.collapsed_stacks()):
+                f.write("%s %d\n" % (stack, weight))
+        with open(filenames[1], 'w') as f:
+            f.write(self.summary(top))
+        return filenames
+
+
+class SamplingProfiler(_Profiler):
+    """
+    A statistical profiler: a SIGPROF timer interrupts the process every interval of CPU time and the stack of the
+    interrupted frame is counted. Its overhead does not depend on the number of calls, unlike a tracing profiler.
+    It can only run in the main thread of a platform with setitimer.
+    """
+    METHOD = 'sampling'
+    UNIT = 'samples'
+
+    def __init__(self, interval: float=0.005):
+        """
+        :param interval: the CPU time between two samples, in seconds
+        """
+        super().__init__()
+        self.interval = interval
+        self._samples = dict()
+        self._previous_handler = None
+
+    @staticmethod
+    def is_available() -> bool:
+        return hasattr(signal, 'setitimer') and hasattr(signal, 'SIGPROF') and \
+            threading.current_thread() is threading.main_thread()
+
+    def start(self) -> None:
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame) -> None:
+        codes = []
+        activity = None
+        while frame is not None:
+            code = frame.f_code
+            if code is _COUNT_DUMP_CODE:
+                # The outermost dump gives the activity class (the dumps of its nested resources are part of it)
+                activity = type(frame.f_locals.get('representation')).__name__
+            codes.append(code)
+            frame = frame.f_back
+        key = (self.current_section, activity, tuple(codes))
+        self._samples[key] = self._samples.get(key, 0) + 1
+
+    def collapsed_stacks(self) -> list:
+        stacks = dict()
+        for (section, _, codes), count in self._samples.items():
+            stack = ';'.join([section] + [_frame_label(code) for code in reversed(codes)])
+            stacks[stack] = stacks.get(stack, 0) + count
+        return list(stacks.items())
+
+    def activity_weights(self) -> OrderedDict:
+        weights = OrderedDict()
+        for (section, activity, _), count in self._samples.items():
+            weights[(section, activity)] = weights.get((section, activity), 0) + count
+        return weights
+
+    def function_weights(self) -> dict:
+        weights = dict()
+        for (section, _, codes), count in self._samples.items():
+            key = (section, _frame_label(codes[0]))
+            weights[key] = weights.get(key, 0) + count
+        return weights
+
+
+class CProfileProfiler(_Profiler):
+    """
+    The fallback of the sampling profiler: a cProfile profile per section. As cProfile only records the callers of
+    each function, its collapsed stacks have two frames (caller;function) below the section, weighted by the self
+    time of the function in microseconds, and the activity classes are told by the dump_to_graph method they run.
+    """
+    METHOD = 'cProfile'
+    UNIT = 'microseconds'
+
+    def __init__(self):
+        super().__init__()
+        self._profiles = OrderedDict()
+        self._running = False
+
+    def start(self) -> None:
+        self._running = True
+        self._switch_section(self.current_section)
+
+    def stop(self) -> None:
+        self._profile(self.current_section).disable()
+        self._running = False
+
+    def _profile(self, section: str) -> cProfile.Profile:
+        profile = self._profiles.get(section)
+        if profile is None:
+            profile = self._profiles[section] = cProfile.Profile()
+        return profile
+
+    def _switch_section(self, name: str) -> None:
+        if not self._running:
+            return
+        # Only one profile can be enabled at a time: the one of the new section replaces the previous one
+        for profile in self._profiles.values():
+            profile.disable()
+        self._profile(name).enable()
+
+    def _stats(self):
+        for section, profile in self._profiles.items():
+            yield section, pstats.Stats(profile).stats
+
+    def collapsed_stacks(self) -> list:
+        stacks = []
+        for section, stats in self._stats():
+            for function, (_, _, _, _, callers) in stats.items():
+                for caller, edge in callers.items():
+                    weight = int(edge[2] * 1e6)
+                    if weight > 0:
+                        stacks.append(('%s;%s;%s' % (section, _function_label(caller), _function_label(function)),
+                                       weight))
+        return stacks
+
+    def activity_weights(self) -> OrderedDict:
+        classes = _dump_classes()
+        weights = OrderedDict()
+        for section, stats in self._stats():
+            total = sum(tt for _, _, tt, _, _ in stats.values())
+            in_dumps = 0.
+            for function, (_, _, _, _, callers) in stats.items():
+                for caller, edge in callers.items():
+                    if function in classes and caller[2] == _COUNT_DUMP_CODE.co_name:
+                        weights[(section, classes[function])] = weights.get((section, classes[function]), 0) + \
+                            int(edge[3] * 1e6)
+                        in_dumps += edge[3]
+            weights[(section, None)] = int(max(total - in_dumps, 0) * 1e6)
+        return weights
+
+    def function_weights(self) -> dict:
+        return {(section, _function_label(function)): int(tt * 1e6)
+                for section, stats in self._stats() for function, (_, _, tt, _, _) in stats.items()}
+
+
+def _function_label(function: tuple) -> str:
+    filename, line, name = function
+    return '%s (%s:%d)' % (name, os.path.basename(filename), line) if line else name
+
+
+def _dump_classes() -> dict:
+    """
+    :return: the names of the RDF representation classes running each dump_to_graph method, by pstats function key
+    """
+    from ..tracesLoaders.baseClasses import RdfRepresentation
+    classes = dict()
+    pending = list(RdfRepresentation.__subclasses__())
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        if getattr(cls, '__abstractmethods__', None):
+            continue
+        code = cls.dump_to_graph.__code__
+        classes.setdefault((code.co_filename, code.co_firstlineno, code.co_name), []).append(cls.__name__)
+    return {function: '/'.join(sorted(names)) for function, names in classes.items()}
+
+
+class ProfiledMetrics(ConversionMetrics):
+    """
+    A metrics collector of which each stage is also a section of a profiler
+    """
+    def __init__(self, profiler: _Profiler):
+        super().__init__()
+        self.profiler = profiler
+
+    @contextmanager
+    def stage(self, source: str, stage: str):
+        with self.profiler.section('%s:%s' % (source, stage)), super().stage(source, stage) as record:
+            yield record
+
+
+def create_profiler(interval: float=0.005) -> _Profiler:
+    """
+    :param interval: the sampling interval in seconds
+    :return: a sampling profiler if it can run here, a cProfile profiler otherwise
+    """
+    if SamplingProfiler.is_available():
+        return SamplingProfiler(interval)
+    LOG.warning("Sampling profiler not available, cProfile is used instead")
+    return CProfileProfiler()
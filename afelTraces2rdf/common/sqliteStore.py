@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import sqlite3
+import logging
+from rdflib.store import Store, VALID_STORE, NO_STORE
+from rdflib.term import URIRef, BNode, Literal
+
+__all__ = ['SQLiteStore']
+
+LOG = logging.getLogger(__name__)
+
+_SCHEMA = [
+    # Terms are stored once, and referred to by their id in the quads
+    "CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, "
+    "datatype TEXT NOT NULL, lang TEXT NOT NULL)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS terms_key ON terms (value, kind, datatype, lang)",
+    # The primary key is the SPO index (and the unicity of a triple in a context)
+    "CREATE TABLE IF NOT EXISTS quads (s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL, "
+    "c INTEGER NOT NULL, PRIMARY KEY (s, p, o, c)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS quads_pos ON quads (p, o, s)",
+    "CREATE INDEX IF NOT EXISTS quads_osp ON quads (o, s, p)",
+    "CREATE INDEX IF NOT EXISTS quads_c ON quads (c)",
+    "CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, uri TEXT NOT NULL)",
+]
+
+_URI, _BNODE, _LITERAL = 'U', 'B', 'L'
+
+
+def _term_key(term) -> tuple:
+    if isinstance(term, Literal):
+        return str(term), _LITERAL, str(term.datatype) if term.datatype is not None else '', term.language or ''
+    if isinstance(term, BNode):
+        return str(term), _BNODE, '', ''
+    if isinstance(term, URIRef):
+        return str(term), _URI, '', ''
+    raise TypeError("Term %r cannot be stored" % (term,))
+
+
+def _term(value: str, kind: str, datatype: str, lang: str):
+    if kind == _URI:
+        return URIRef(value)
+    if kind == _BNODE:
+        return BNode(value)
+    return Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None)
+
+
+class SQLiteStore(Store):
+    """
+    A context aware rdflib store in a SQLite database, for graphs larger than memory.
+    Terms are stored once in a dictionary table; quads of term ids are indexed by subject (SPO, the primary key),
+    by predicate (POS), by object (OSP) and by context. Additions are committed by batches. Any rdflib Graph or
+    ConjunctiveGraph (including their SPARQL queries) can be backed by it:
+
+        graph = ConjunctiveGraph(SQLiteStore('path/to/graph.sqlite'))
+    """
+    context_aware = True
+    formula_aware = False
+    transaction_aware = True
+    graph_aware = False
+
+    def __init__(self, configuration: str=None, identifier=None, batch_size: int=50000,
+                 cache_size: int=200000):
+        """
+        :param configuration: the database filename (the store is opened if given)
+        :param batch_size: the number of additions committed together
+        :param cache_size: the maximum number of terms of the in-memory cache of term ids
+        """
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._connection = None
+        self._ids = dict()  # term -> id
+        self._terms = dict()  # id -> term
+        self._pending = 0
+        super().__init__(configuration, identifier)
+
+    def open(self, configuration: str, create: bool=True):
+        if not create and not os.path.exists(configuration):
+            return NO_STORE
+        self._connection = sqlite3.connect(configuration)
+        # The database is rebuilt from the traces if the conversion fails: durability is traded for speed
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute("PRAGMA cache_size=-262144")  # 256 MB of page cache
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._connection.commit()
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction: bool=True) -> None:
+        if self._connection is None:
+            return
+        if commit_pending_transaction:
+            self.commit()
+        else:
+            self.rollback()
+        self._connection.close()
+        self._connection = None
+
+    def destroy(self, configuration: str) -> None:
+        self.close(commit_pending_transaction=False)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(configuration + suffix):
+                os.remove(configuration + suffix)
+
+    def commit(self) -> None:
+        self._connection.commit()
+        self._pending = 0
+
+    def rollback(self) -> None:
+        self._connection.rollback()
+        self._pending = 0
+        self._ids.clear()  # ids of terms added in the transaction are not valid anymore
+        self._terms.clear()
+
+    # Terms
+
+    def _cache(self, term, term_id: int) -> None:
+        if len(self._ids) >= self.cache_size:
+            self._ids.clear()
+            self._terms.clear()
+        self._ids[term] = term_id
+        self._terms[term_id] = term
+
+    def _term_id(self, term, create: bool=False):
+        """
+        :return: the id of a term, or None if it is not stored (and not created)
+        """
+        term_id = self._ids.get(term)
+        if term_id is not None:
+            return term_id
+        key = _term_key(term)
+        row = self._connection.execute("SELECT id FROM terms WHERE value=? AND kind=? AND datatype=? AND lang=?",
+                                       key).fetchone()
+        if row is not None:
+            term_id = row[0]
+        elif create:
+            term_id = self._connection.execute("INSERT INTO terms (value, kind, datatype, lang) VALUES (?, ?, ?, ?)",
+                                               key).lastrowid
+        else:
+            return None
+        self._cache(term, term_id)
+        return term_id
+
+    def _term_of(self, term_id: int):
+        term = self._terms.get(term_id)
+        if term is None:
+            row = self._connection.execute("SELECT value, kind, datatype, lang FROM terms WHERE id=?",
+                                           (term_id,)).fetchone()
+            term = _term(*row)
+            self._cache(term, term_id)
+        return term
+
+    @staticmethod
+    def _context_identifier(context):
+        """
+        :return: the identifier of a context, or None for the union of all contexts
+        """
+        if context is None or getattr(context, 'default_union', False):
+            return None
+        return getattr(context, 'identifier', context)
+
+    # Triples
+
+    def add(self, triple, context, quoted: bool=False) -> None:
+        Store.add(self, triple, context, quoted)
+        self.add_quad(triple, context)
+
+    def add_quad(self, triple, context) -> bool:
+        """
+        Add a triple to a context
+        :return: True if the triple was not in the context yet
+        """
+        identifier = self._context_identifier(context)
+        if identifier is None:
+            raise ValueError("A triple must be added to a context")
+        ids = tuple(self._term_id(term, create=True) for term in triple) + (self._term_id(identifier, create=True),)
+        added = self._connection.execute("INSERT OR IGNORE INTO quads (s, p, o, c) VALUES (?, ?, ?, ?)",
+                                         ids).rowcount > 0
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+        return added
+
+    def addN(self, quads) -> None:
+        for s, p, o, context in quads:
+            self.add((s, p, o), context)
+
+    def _where(self, triple_pattern, context) -> (str, list):
+        """
+        :return: the WHERE clause of a pattern and its parameters, or None if a term of the pattern is not stored
+        """
+        conditions = []
+        parameters = []
+        for column, term in zip(('s', 'p', 'o'), triple_pattern):
+            if term is not None:
+                term_id = self._term_id(term)
+                if term_id is None:
+                    return None
+                conditions.append('%s=?' % column)
+                parameters.append(term_id)
+        identifier = self._context_identifier(context)
+        if identifier is not None:
+            context_id = self._term_id(identifier)
+            if context_id is None:
+                return None
+            conditions.append('c=?')
+            parameters.append(context_id)
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', parameters
+
+    def remove(self, triple_pattern, context=None) -> None:
+        Store.remove(self, triple_pattern, context)
+        where = self._where(triple_pattern, context)
+        if where is not None:
+            self._connection.execute("DELETE FROM quads" + where[0], where[1])
+            self.commit()
+
+    def _contexts_of(self, ids: tuple):
+        for context_id, in self._connection.execute("SELECT c FROM quads WHERE s=? AND p=? AND o=?", ids).fetchall():
+            yield self._term_of(context_id)
+
+    def triples(self, triple_pattern, context=None):
+        where = self._where(triple_pattern, context)
+        if where is None:
+            return
+        select = "SELECT DISTINCT s, p, o FROM quads" if self._context_identifier(context) is None \
+            else "SELECT s, p, o FROM quads"
+        cursor = self._connection.execute(select + where[0], where[1])
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for ids in rows:
+                yield (self._term_of(ids[0]), self._term_of(ids[1]), self._term_of(ids[2])), self._contexts_of(ids)
+
+    def __len__(self, context=None) -> int:
+        if self._context_identifier(context) is None:
+            return self._connection.execute("SELECT COUNT(*) FROM (SELECT DISTINCT s, p, o FROM quads)").fetchone()[0]
+        where = self._where((None, None, None), context)
+        if where is None:
+            return 0
+        return self._connection.execute("SELECT COUNT(*) FROM quads" + where[0], where[1]).fetchone()[0]
+
+    def contexts(self, triple=None):
+        if triple is None:
+            rows = self._connection.execute("SELECT DISTINCT c FROM quads").fetchall()
+        else:
+            where = self._where(triple, None)
+            rows = self._connection.execute("SELECT DISTINCT c FROM quads" + where[0], where[1]).fetchall() \
+                if where is not None else []
+        for context_id, in rows:
+            yield self._term_of(context_id)
+
+    # Namespaces
+
+    def bind(self, prefix: str, namespace) -> None:
+        self._connection.execute("INSERT OR REPLACE INTO namespaces (prefix, uri) VALUES (?, ?)",
+                                 (prefix, str(namespace)))
+
+    def namespace(self, prefix: str):
+        row = self._connection.execute("SELECT uri FROM namespaces WHERE prefix=?", (prefix,)).fetchone()
+        return URIRef(row[0]) if row is not None else None
+
+    def prefix(self, namespace):
+        row = self._connection.execute("SELECT prefix FROM namespaces WHERE uri=?", (str(namespace),)).fetchone()
+        return row[0] if row is not None else None
+
+    def namespaces(self):
+        for prefix, uri in self._connection.execute("SELECT prefix, uri FROM namespaces").fetchall():
+            yield prefix, URIRef(uri)
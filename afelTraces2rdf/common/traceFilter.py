@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import re
+import datetime
+import dateutil.parser as dateparser
+
+__all__ = ['TraceFilter', 'combine_user_filters']
+
+# ISO dates in UTC of a fixed format, that can be compared as strings up to the second
+_CANONICAL_ISO_DATE = re.compile(r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?(?:Z|\+00:00)$')
+_ISO_SECONDS_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def _utc_date(date) -> datetime.datetime:
+    if isinstance(date, str):
+        date = dateparser.parse(date)
+    return date.replace(tzinfo=datetime.timezone.utc) if date.tzinfo is None else date
+
+
+def combine_user_filters(*user_filters):
+    """
+    :param user_filters: predicates on user ids, or None
+    :return: the predicate that selects the users selected by all of them, or None if there is none
+    """
+    user_filters = [user_filter for user_filter in user_filters if user_filter is not None]
+    if not user_filters:
+        return None
+    if len(user_filters) == 1:
+        return user_filters[0]
+    return lambda userid: all(user_filter(userid) for user_filter in user_filters)
+
+
+class TraceFilter:
+    """
+    A selection of the traces to convert: some learners, a time window [since, until[, some sources and some
+    activity types. The parsers apply it as early as possible, on the raw fields of the traces before they are
+    decoded and their dates parsed, so that the traces not selected never turn into objects nor triples.
+    Activities are selected by their start date: a game session is kept with all its traces if its playStart
+    trace is in the time window.
+    """
+    def __init__(self, users=None, since=None, until=None, sources=None, activity_types=None):
+        """
+        :param users: the user ids of the learners to keep (all if None)
+        :param since: the start of the time window, included (datetime or string; UTC if naive)
+        :param until: the end of the time window, excluded (datetime or string; UTC if naive)
+        :param sources: the names of the sources to convert (all if None)
+        :param activity_types: the activity types to keep (e.g. ArtifactView, Search), all if None
+        """
+        self.users = frozenset(users) if users is not None else None
+        self.since = _utc_date(since) if since is not None else None
+        self.until = _utc_date(until) if until is not None else None
+        if self.since is not None and self.until is not None and self.since >= self.until:
+            raise ValueError("The start of the time window must be before its end")
+        self.sources = frozenset(sources) if sources is not None else None
+        self.activity_types = frozenset(activity_types) if activity_types is not None else None
+        self._since_ts = self.since.timestamp() if self.since is not None else None
+        self._until_ts = self.until.timestamp() if self.until is not None else None
+        self._since_iso = self.since.astimezone(datetime.timezone.utc).strftime(_ISO_SECONDS_FORMAT) \
+            if self.since is not None else None
+        self._until_iso = self.until.astimezone(datetime.timezone.utc).strftime(_ISO_SECONDS_FORMAT) \
+            if self.until is not None else None
+
+    @staticmethod
+    def read_users(values) -> list:
+        """
+        Read user ids given either directly, or by files of user ids (one per line)
+        """
+        users = []
+        for value in values:
+            if os.path.isfile(value):
+                with open(value, 'r') as f:
+                    users.extend(line.strip() for line in f if line.strip())
+            else:
+                users.append(value)
+        return users
+
+    @property
+    def has_time_window(self) -> bool:
+        return self.since is not None or self.until is not None
+
+    def contains_user(self, userid: str) -> bool:
+        return self.users is None or userid in self.users
+
+    @property
+    def user_filter(self):
+        """
+        :return: the predicate on user ids of the filter, or None if all users are kept
+        """
+        return self.contains_user if self.users is not None else None
+
+    def contains_source(self, source: str) -> bool:
+        return self.sources is None or source in self.sources
+
+    def contains_timestamp(self, timestamp: float) -> bool:
+        """
+        :param timestamp: a POSIX timestamp, in seconds
+        """
+        return (self._since_ts is None or timestamp >= self._since_ts) and \
+               (self._until_ts is None or timestamp < self._until_ts)
+
+    def contains_date(self, date: datetime.datetime) -> bool:
+        return self.contains_timestamp(date.timestamp())
+
+    def contains_iso_date(self, value: str):
+        """
+        Check a raw ISO date without parsing it, when it is a UTC date of a fixed format
+        :return: True or False, or None if the date has to be parsed to decide
+        """
+        if not _CANONICAL_ISO_DATE.match(value):
+            return None
+        seconds = value[:19]
+        if self._since_iso is not None and seconds <= self._since_iso:
+            return False if seconds < self._since_iso else None
+        if self._until_iso is not None and seconds >= self._until_iso:
+            return False if seconds > self._until_iso else None
+        return True
+
+    def raw_action_types(self, activity_types_mapping: dict):
+        """
+        :param activity_types_mapping: the raw action types of each activity type of a source
+        :return: the set of the raw action types to keep for this source, or None if all are kept
+        """
+        if self.activity_types is None:
+            return None
+        return frozenset(action_type for activity_type, action_types in activity_types_mapping.items()
+                         if activity_type in self.activity_types for action_type in action_types)
+
+    def to_dict(self) -> dict:
+        return dict(users=sorted(self.users) if self.users is not None else None,
+                    since=self.since.isoformat() if self.since is not None else None,
+                    until=self.until.isoformat() if self.until is not None else None,
+                    sources=sorted(self.sources) if self.sources is not None else None,
+                    activity_types=sorted(self.activity_types) if self.activity_types is not None else None)
+
+    def __str__(self):
+        return ', '.join('%s=%s' % (key, value) for key, value in self.to_dict().items() if value is not None)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import sys
+import glob
+import marshal
+import hashlib
+import logging
+import datetime
+import tempfile
+import ujson as json
+
+__all__ = ['TraceSnapshots']
+
+LOG = logging.getLogger(__name__)
+
+_MAGIC = b'AFELSNP1'
+
+# Version of the content of the snapshots, to change when the normalization of the traces changes
+SNAPSHOT_VERSION = 1
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_NAIVE_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _encode_date(date: datetime.datetime) -> tuple:
+    """
+    :return: the date as (microseconds since the epoch, UTC offset in seconds or None if it is naive)
+    """
+    offset = date.utcoffset()
+    if offset is None:
+        return (date - _NAIVE_EPOCH) // datetime.timedelta(microseconds=1), None
+    return (date - _EPOCH) // datetime.timedelta(microseconds=1), int(offset.total_seconds())
+
+
+def _decode_date(value: tuple) -> datetime.datetime:
+    microseconds, offset = value
+    if offset is None:
+        return _NAIVE_EPOCH + datetime.timedelta(microseconds=microseconds)
+    date = _EPOCH + datetime.timedelta(microseconds=microseconds)
+    return date if offset == 0 else date.astimezone(datetime.timezone(datetime.timedelta(seconds=offset)))
+
+
+class TraceSnapshots:
+    """
+    Directory of snapshots of the traces of the exports, as the parsers have them once normalized and sorted, so that
+    a later conversion of the same file (e.g. after a change of the RDF mapping or of the output format) loads them
+    instead of decoding the JSON hits, parsing the dates and sorting the traces again.
+    A snapshot is keyed by the content hash of the export, the source and the options that select the traces (the
+    partition and the trace filter). The traces are stored as rows of values (one tuple of keys per distinct set of
+    keys) written with marshal, the dates as integers; the users are stored by id and resolved by the learners parser
+    when the snapshot is loaded. The least recently used snapshots of each source beyond max_per_source are removed.
+    """
+    def __init__(self, directory: str, options: dict=None, max_per_source: int=4):
+        """
+        :param directory: the snapshot directory
+        :param options: the options that select the traces (JSON serializable), part of the key of the snapshots
+        :param max_per_source: the number of snapshots kept for each source
+        """
+        self.directory = directory
+        self.max_per_source = max_per_source
+        self._options = json.dumps(options if options is not None else dict(), sort_keys=True)
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, source: str, hits) -> str:
+        """
+        :return: the filename of the snapshot of the MappedHits of an export of a source
+        """
+        # marshal is specific to the Python version
+        key = '\0'.join((str(SNAPSHOT_VERSION), '%d.%d' % sys.version_info[:2], source, hits.digest(), self._options))
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '%s-%s.snapshot' % (source, digest))
+
+    def load(self, source: str, hits, date_field: str, learners_parser) -> list:
+        """
+        :param source: the source name
+        :param hits: the MappedHits of the export
+        :param date_field: the field of the traces that holds their date
+        :param learners_parser: the learners parser that resolves the users of the traces
+        :return: the normalized and sorted traces, or None if there is no snapshot of the export
+        """
+        filename = self.filename(source, hits)
+        try:
+            with open(filename, 'rb') as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    raise ValueError("not a snapshot")
+                content = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            LOG.warning("Snapshot %s cannot be read (%s), discarding it." % (filename, e))
+            self._remove(filename)
+            return None
+        os.utime(filename)
+        schemas = content['schemas']
+        get_user = learners_parser.get_user_by_userid
+        traces = []
+        for row in content['rows']:
+            trace = dict(zip(schemas[row[0]], row[1:]))
+            trace[date_field] = _decode_date(trace[date_field])
+            trace['user'] = get_user(trace['user_id'])
+            traces.append(trace)
+        LOG.info("%d %s traces loaded from the snapshot %s" % (len(traces), source, os.path.basename(filename)))
+        return traces
+
+    def save(self, source: str, hits, traces: list, date_field: str) -> str:
+        """
+        Save the normalized and sorted traces of an export (replaced atomically)
+        :param source: the source name
+        :param hits: the MappedHits of the export
+        :param traces: the traces
+        :param date_field: the field of the traces that holds their date
+        :return: the snapshot filename
+        """
+        schemas = []
+        schema_indexes = dict()
+        rows = []
+        for trace in traces:
+            keys = tuple(key for key in trace if key != 'user')
+            index = schema_indexes.get(keys)
+            if index is None:
+                index = schema_indexes[keys] = len(schemas)
+                schemas.append(keys)
+            rows.append((index,) + tuple(_encode_date(trace[key]) if key == date_field else trace[key] for key in keys))
+        filename = self.filename(source, hits)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix='.snapshot')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_MAGIC)
+                marshal.dump(dict(source=source, schemas=schemas, rows=rows), f)
+            os.replace(tmp_filename, filename)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+        LOG.info("%d %s traces saved in the snapshot %s" % (len(traces), source, os.path.basename(filename)))
+        self._evict(source)
+        return filename
+
+    def _evict(self, source: str) -> None:
+        snapshots = sorted(glob.glob(os.path.join(self.directory, '%s-*.snapshot' % source)),
+                           key=os.path.getmtime, reverse=True)
+        for filename in snapshots[self.max_per_source:]:
+            LOG.info("Removing the snapshot %s" % os.path.basename(filename))
+            self._remove(filename)
+
+    @staticmethod
+    def _remove(filename: str) -> None:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
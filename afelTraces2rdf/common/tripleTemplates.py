@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import logging
+from rdflib import Literal, URIRef
+from rdflib.namespace import RDF
+from .vocabulary import AFEL, EXTAFL, SCHEMA
+
+__all__ = ['TripleTemplate', 'When', 'Constant', 'LITERAL', 'RESOURCE']
+
+LOG = logging.getLogger(__name__)
+
+# Conversions of the objects of the triples: into a Literal, or taken as is (a URIRef)
+LITERAL = 'literal'
+RESOURCE = 'resource'
+
+# Constants of the terms of each prefix
+_PREFIX_TERMS = dict(afel=AFEL, extafl=EXTAFL, schema=SCHEMA, rdf=RDF)
+
+
+class Constant:
+    """
+    A constant object of a template triple, converted once (a RESOURCE constant given as 'prefix:Name' is a term)
+    """
+    def __init__(self, value):
+        self.value = value
+
+
+class When:
+    """
+    A conditional block of a template: its triples are added only if the attribute of the condition is true
+    """
+    def __init__(self, condition: str, properties: list):
+        """
+        :param condition: the attribute path of the condition (e.g. 'is_achieved')
+        :param properties: the properties of the block, as for TripleTemplate
+        """
+        self.condition = condition
+        self.properties = properties
+
+
+class TripleTemplate:
+    """
+    The declarative template of the triples of an RdfRepresentation class: the class of its subject (whose URI is
+    the class URI, '#' and an attribute of the instance) and its properties. Each property is a tuple
+    (predicate, value[, conversion]):
+
+    - the predicate is a 'prefix:name' term, the prefixes being afel, extafl, schema and rdf;
+    - the value is an attribute path of the instance (e.g. 'user.rdf'), an argument of the template, or a Constant;
+    - the conversion is LITERAL (the default), RESOURCE, or a callable applied to the value.
+
+    A template is compiled once into an emitter function, in which the terms are already resolved and the constant
+    literals already built: dumping an instance only reads its attributes and adds the triples.
+    """
+    def __init__(self, rdf_type: str, properties: list, subject_id: str='id', arguments: tuple=()):
+        """
+        :param rdf_type: the class of the subject ('prefix:Name'), or None for a base template only to be extended
+        :param properties: the properties of the subject, and When blocks
+        :param subject_id: the attribute path of the id of the subject
+        :param arguments: the names of additional arguments of the emitter (e.g. a computed artifact URI)
+        """
+        self.rdf_type = rdf_type
+        self.properties = list(properties)
+        self.subject_id = subject_id
+        self.arguments = tuple(arguments)
+        self._subject = None
+        self._emit = None
+        self.source = None
+
+    def extended(self, rdf_type: str, properties: list, arguments: tuple=()) -> 'TripleTemplate':
+        """
+        :return: a template of another class whose properties are the given ones followed by those of this template
+        """
+        return TripleTemplate(rdf_type, list(properties) + self.properties, subject_id=self.subject_id,
+                              arguments=self.arguments + tuple(arguments))
+
+    def subject(self, instance) -> URIRef:
+        """
+        :return: the URI of the subject of an instance
+        """
+        if self._subject is None:
+            self._compile()
+        return self._subject(instance)
+
+    def dump(self, instance, graph, *arguments) -> int:
+        """
+        Add the triples of an instance to a graph
+        :param instance: the instance
+        :param graph: the graph
+        :param arguments: the values of the arguments of the template
+        :return: the number of triples added
+        """
+        if self._emit is None:
+            self._compile()
+        return self._emit(instance, graph.add, *arguments)
+
+    def _compile(self) -> None:
+        if self.rdf_type is None:
+            raise ValueError("A base template must be extended with the class of its subject")
+        bindings = dict(URIRef=URIRef, Literal=Literal)
+        terms = dict()
+
+        def bind(value) -> str:
+            name = '_c%d' % len(bindings)
+            bindings[name] = value
+            return name
+
+        def term(spec: str) -> str:
+            if spec not in terms:
+                terms[spec] = bind(_resolve_term(spec))
+            return terms[spec]
+
+        def value(spec, conversion) -> str:
+            if isinstance(spec, Constant):
+                constant = spec.value
+                if conversion == RESOURCE:
+                    return term(constant) if isinstance(constant, str) else bind(constant)
+                return bind(Literal(constant) if conversion == LITERAL else conversion(constant))
+            root, _, path = spec.partition('.')
+            expression = root if root in self.arguments else 'obj.' + spec
+            if root in self.arguments and path:
+                expression += '.' + path
+            if conversion == LITERAL:
+                return 'Literal(%s)' % expression
+            if conversion == RESOURCE:
+                return expression
+            return '%s(%s)' % (bind(conversion), expression)
+
+        def block(properties, indent: str) -> (list, int):
+            lines = []
+            nb_triples = 0
+            for prop in properties:
+                if isinstance(prop, When):
+                    sub_lines, sub_nb = block(prop.properties, indent + '    ')
+                    lines.append('%sif obj.%s:' % (indent, prop.condition))
+                    lines.extend(sub_lines)
+                    lines.append('%s    n += %d' % (indent, sub_nb))
+                else:
+                    predicate, spec = prop[:2]
+                    conversion = prop[2] if len(prop) > 2 else LITERAL
+                    lines.append('%sadd((s, %s, %s))' % (indent, term(predicate), value(spec, conversion)))
+                    nb_triples += 1
+            return lines, nb_triples
+
+        prefix = bind(str(_resolve_term(self.rdf_type)) + '#')
+        subject = 'URIRef(%s + obj.%s)' % (prefix, self.subject_id)
+        lines, nb_triples = block([('rdf:type', Constant(self.rdf_type), RESOURCE)] + self.properties, '    ')
+        source = '\n'.join(['def subject(obj):', '    return %s' % subject, '',
+                            'def emit(%s):' % ', '.join(('obj', 'add') + self.arguments),
+                            '    s = %s' % subject, '    n = %d' % nb_triples] + lines + ['    return n', ''])
+        exec(compile(source, '<template %s>' % self.rdf_type, 'exec'), bindings)
+        self._subject = bindings['subject']
+        self._emit = bindings['emit']
+        self.source = source
+        LOG.debug("Template of %s compiled" % self.rdf_type)
+
+
+def _resolve_term(spec: str) -> URIRef:
+    prefix, _, name = spec.partition(':')
+    terms = _PREFIX_TERMS.get(prefix)
+    if terms is None:
+        raise ValueError("Unknown prefix of the term %s" % spec)
+    term = getattr(terms, name, None)
+    if not isinstance(term, URIRef):
+        raise ValueError("Unknown term %s: regenerate the vocabulary module if it is a new term of the schemas" % spec)
+    return term
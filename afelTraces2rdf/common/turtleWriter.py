@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import re
+import heapq
+import logging
+import tempfile
+from collections import OrderedDict
+from rdflib import Graph
+from rdflib.namespace import RDF, RDFS, XSD
+from rdflib.term import URIRef, BNode, Literal
+from .vocabulary import AFEL_NS, EXT_AFEL_NS, SCHEMA_NS
+
+__all__ = ['TurtleWriter', 'save_turtle', 'afel_prefixes']
+
+LOG = logging.getLogger(__name__)
+
+# Local names written as prefixed names (a conservative subset of the Turtle PN_LOCAL)
+_LOCAL_NAME_REGEX = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]*$')
+
+# Characters of a literal that must be escaped, and the ones of an IRI (written as \u escapes)
+_LITERAL_ESCAPE_REGEX = re.compile(r'[\\"\x00-\x1f\x7f]')
+_LITERAL_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+_IRI_ESCAPE_REGEX = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+
+# Separator of the terms of the sorted rows: never written unescaped by the terms
+_SEPARATOR = '\t'
+
+# Rank of the predicates in the sorted rows: rdf:type first, as the 'a' of each subject
+_TYPE_RANK = '0'
+_PREDICATE_RANK = '1'
+
+# Maximum number of formatted IRIs kept (the predicates, classes and most shared resources in practice)
+_MAX_CACHED_IRIS = 1 << 18
+
+
+def _escape_literal_char(match) -> str:
+    char = match.group(0)
+    return _LITERAL_ESCAPES.get(char) or '\\u%04X' % ord(char)
+
+
+def _escape_iri_char(match) -> str:
+    return '\\u%04X' % ord(match.group(0))
+
+
+def afel_prefixes() -> OrderedDict:
+    """
+    :return: the prefixes of the AFEL, extended AFEL and Schema namespaces (and of rdf, rdfs and xsd)
+    """
+    return OrderedDict([('afel', AFEL_NS), ('extafl', EXT_AFEL_NS), ('schema', SCHEMA_NS), ('rdf', str(RDF)),
+                        ('rdfs', str(RDFS)), ('xsd', str(XSD))])
+
+
+class TurtleWriter:
+    """
+    A Turtle writer that does without the rdflib serializer: the triples are formatted when added, as rows
+    'subject predicate object' sorted by runs in memory and spilled into temporary files when a run is full. The runs
+    are then merged, so that the triples of each subject (and the objects of each predicate) are consecutive and
+    written as compact Turtle, while the memory used stays bounded by the size of a run.
+    """
+    def __init__(self, prefixes: OrderedDict=None, run_size: int=500000, tmp_directory: str=None):
+        """
+        :param prefixes: the namespace of each prefix (the afel, extafl and schema ones by default)
+        :param run_size: the number of triples sorted in memory before being spilled into a temporary file
+        :param tmp_directory: the directory of the temporary files (the system one by default)
+        """
+        self.prefixes = afel_prefixes() if prefixes is None else OrderedDict(prefixes)
+        self.run_size = run_size
+        self.tmp_directory = tmp_directory
+        # The longest namespace first, for a namespace nested in another one (e.g. extafl in afel)
+        self._namespaces = sorted(((namespace, prefix) for prefix, namespace in self.prefixes.items()),
+                                  key=lambda item: -len(item[0]))
+        self._terms = dict()  # formatted IRIs
+        self._rows = []
+        self._runs = []
+
+    def _iri(self, iri: str) -> str:
+        term = self._terms.get(iri)
+        if term is None:
+            for namespace, prefix in self._namespaces:
+                if iri.startswith(namespace) and _LOCAL_NAME_REGEX.match(iri[len(namespace):]):
+                    term = '%s:%s' % (prefix, iri[len(namespace):])
+                    break
+            if term is None:
+                term = '<%s>' % _IRI_ESCAPE_REGEX.sub(_escape_iri_char, iri)
+            if len(self._terms) < _MAX_CACHED_IRIS:
+                self._terms[iri] = term
+        return term
+
+    def _term(self, term) -> str:
+        if isinstance(term, URIRef):
+            return self._iri(term)
+        if isinstance(term, Literal):
+            text = '"%s"' % _LITERAL_ESCAPE_REGEX.sub(_escape_literal_char, term)
+            if term.language:
+                return '%s@%s' % (text, term.language)
+            if term.datatype:
+                return '%s^^%s' % (text, self._iri(term.datatype))
+            return text
+        if isinstance(term, BNode):
+            return '_:%s' % term
+        raise ValueError("Cannot write the term %r in Turtle" % (term,))
+
+    def add(self, triple: tuple) -> None:
+        """
+        Add a (subject, predicate, object) triple
+        """
+        s, p, o = triple
+        predicate = _TYPE_RANK + 'a' if p == RDF.type else _PREDICATE_RANK + self._iri(p)
+        self._rows.append(_SEPARATOR.join((self._term(s), predicate, self._term(o))))
+        if len(self._rows) >= self.run_size:
+            self._spill()
+
+    def add_graph(self, graph: Graph) -> None:
+        """
+        Add the triples of a graph
+        """
+        for triple in graph.triples((None, None, None)):
+            self.add(triple)
+
+    def _spill(self) -> None:
+        self._rows.sort()
+        run = tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='\n', dir=self.tmp_directory,
+                                     prefix='.turtle')
+        for row in self._rows:
+            run.write(row)
+            run.write('\n')
+        run.seek(0)
+        self._runs.append(run)
+        LOG.debug("Run of %d triples spilled" % len(self._rows))
+        self._rows = []
+
+    def _sorted_rows(self):
+        self._rows.sort()
+        if not self._runs:
+            return iter(self._rows)
+        return heapq.merge(self._rows, *((line[:-1] for line in run) for run in self._runs))
+
+    def write(self, destination) -> int:
+        """
+        Write the triples added, grouped by subject and sorted
+        :param destination: the destination (a filename or a binary file)
+        :return: the number of triples written (the duplicates being written once)
+        """
+        if isinstance(destination, str):
+            with open(destination, 'wb') as f:
+                return self.write(f)
+        try:
+            return self._write(destination)
+        finally:
+            for run in self._runs:
+                run.close()
+            self._runs = []
+            self._rows = []
+
+    def _write(self, f) -> int:
+        header = ''.join('@prefix %s: <%s> .\n' % (prefix, namespace) for prefix, namespace in self.prefixes.items())
+        f.write((header + '\n').encode('utf-8'))
+        nb_triples = 0
+        previous_row = None
+        subject = predicate = None
+        lines = []
+        for row in self._sorted_rows():
+            if row == previous_row:
+                continue
+            previous_row = row
+            s, p, o = row.split(_SEPARATOR)
+            if s != subject:
+                if subject is not None:
+                    lines.append(' .\n\n')
+                    if len(lines) > 4096:
+                        f.write(''.join(lines).encode('utf-8'))
+                        lines = []
+                lines.append('%s %s %s' % (s, p[1:], o))
+                subject, predicate = s, p
+            elif p != predicate:
+                lines.append(' ;\n    %s %s' % (p[1:], o))
+                predicate = p
+            else:
+                lines.append(', %s' % o)
+            nb_triples += 1
+        if subject is not None:
+            lines.append(' .\n')
+        f.write(''.join(lines).encode('utf-8'))
+        return nb_triples
+
+
+def save_turtle(graph: Graph, destination, prefixes: OrderedDict=None, run_size: int=500000) -> int:
+    """
+    Save a graph into a Turtle file with a TurtleWriter
+    :param graph: the graph
+    :param destination: the destination (a filename or a binary file)
+    :param prefixes: the namespace of each prefix (the afel, extafl and schema ones by default)
+    :param run_size: the number of triples sorted in memory at once
+    :return: the number of triples written
+    """
+    writer = TurtleWriter(prefixes=prefixes, run_size=run_size)
+    writer.add_graph(graph)
+    nb_triples = writer.write(destination)
+    LOG.debug("%d triples written in Turtle" % nb_triples)
+    return nb_triples
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import logging
+import tempfile
+from collections import OrderedDict
+import ujson as json
+
+__all__ = ['ConsistencyValidator']
+
+LOG = logging.getLogger(__name__)
+
+
+class _IssueRecord:
+    """
+    Occurrences of a kind of issue: their count and the first ones as samples
+    """
+    __slots__ = ('count', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.samples = []
+
+    def add(self, sample: dict, max_samples: int) -> None:
+        self.count += 1
+        if len(self.samples) < max_samples:
+            self.samples.append(sample)
+
+
+class _SourceRecord:
+    """
+    What is known of the traces of a source: their number, their ids and the range of their timestamps
+    """
+    __slots__ = ('nb_traces', 'ids', 'first', 'last')
+
+    def __init__(self):
+        self.nb_traces = 0
+        self.ids = set()
+        self.first = self.last = None
+
+
+class ConsistencyValidator:
+    """
+    Check the consistency of the traces while they are converted, in the same pass: orphaned and unfinished game
+    sessions, unknown and unused learners, timestamp ranges per source, duplicate trace ids and answers out of
+    the Likert range. The checks are reported by the parsers, and the validator produces a structured report.
+    """
+    ISSUES = ['unknown_learners', 'duplicate_ids', 'orphan_play_ends', 'changes_without_session',
+              'unfinished_sessions', 'answers_out_of_range']
+
+    def __init__(self, max_samples: int=100):
+        """
+        :param max_samples: the maximum number of occurrences reported for each kind of issue
+        """
+        self.max_samples = max_samples
+        self._issues = OrderedDict((name, _IssueRecord()) for name in self.ISSUES)
+        self._sources = OrderedDict()
+        self._known_learners = set()
+        self._used_learners = set()
+
+    def set_learners(self, userids) -> None:
+        """
+        Declare the learners of the mapping file
+        """
+        self._known_learners.update(userids)
+
+    def _source(self, source: str) -> _SourceRecord:
+        record = self._sources.get(source)
+        if record is None:
+            record = self._sources[source] = _SourceRecord()
+        return record
+
+    def _issue(self, name: str, **sample) -> None:
+        self._issues[name].add(sample, self.max_samples)
+
+    def check_learner(self, source: str, userid, trace_id=None) -> bool:
+        """
+        Check that the learner of a trace or an answer is known, and mark it as used
+        :return: True if the learner is known
+        """
+        if userid not in self._known_learners:
+            self._issue('unknown_learners', source=source, user=userid, id=trace_id)
+            return False
+        self._used_learners.add(userid)
+        return True
+
+    def record_item(self, source: str, date=None) -> None:
+        """
+        Count an item (trace or answer) of a source and record its timestamp, if any
+        """
+        record = self._source(source)
+        record.nb_traces += 1
+        if date is not None:
+            if record.first is None or date < record.first:
+                record.first = date
+            if record.last is None or date > record.last:
+                record.last = date
+
+    def check_trace(self, source: str, trace_id: str, userid, date) -> bool:
+        """
+        Check a trace: its learner, the unicity of its id, and record its timestamp
+        :return: True if the learner of the trace is known
+        """
+        self.record_item(source, date)
+        ids = self._sources[source].ids
+        if trace_id in ids:
+            self._issue('duplicate_ids', source=source, id=trace_id)
+        else:
+            ids.add(trace_id)
+        return self.check_learner(source, userid, trace_id)
+
+    def orphan_play_end(self, trace_id: str, play_session: str) -> None:
+        self._issue('orphan_play_ends', id=trace_id, play_session=play_session)
+
+    def change_without_session(self, trace_id: str, action_type: str, play_session: str) -> None:
+        self._issue('changes_without_session', id=trace_id, action_type=action_type, play_session=play_session)
+
+    def unfinished_session(self, trace_id: str, play_session: str, user) -> None:
+        self._issue('unfinished_sessions', id=trace_id, play_session=play_session, user=user)
+
+    def check_answer(self, questionnaire_id: str, question_id: str, userid, value, value_range: tuple) -> None:
+        """
+        Check that a rating answer is in its Likert range
+        :param value_range: the minimum and maximum values of the answer (both included)
+        """
+        if not value_range[0] <= value <= value_range[1]:
+            self._issue('answers_out_of_range', questionnaire=questionnaire_id, question=question_id, user=userid,
+                        value=value, range=list(value_range))
+
+    @property
+    def unused_learners(self) -> list:
+        return sorted(self._known_learners - self._used_learners)
+
+    @property
+    def nb_issues(self) -> int:
+        return sum(record.count for record in self._issues.values()) + len(self.unused_learners)
+
+    def to_dict(self) -> dict:
+        unused_learners = self.unused_learners
+        return dict(
+            valid=self.nb_issues == 0,
+            nb_issues=self.nb_issues,
+            learners=dict(known=len(self._known_learners), used=len(self._used_learners),
+                          unused=dict(count=len(unused_learners), samples=unused_learners[:self.max_samples])),
+            sources=OrderedDict((source, dict(nb_items=record.nb_traces,
+                                              first=record.first.isoformat() if record.first is not None else None,
+                                              last=record.last.isoformat() if record.last is not None else None))
+                                for source, record in self._sources.items()),
+            issues=OrderedDict((name, dict(count=record.count, samples=record.samples))
+                               for name, record in self._issues.items()))
+
+    def write_report(self, destination: str) -> None:
+        """
+        Write the JSON report into a file
+        """
+        directory = os.path.dirname(os.path.abspath(destination))
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.validation')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(self.to_dict(), indent=2))
+            os.replace(tmp_name, destination)
+        except Exception:
+            os.remove(tmp_name)
+            raise
+
+    def log_summary(self, level=logging.INFO) -> None:
+        for source, record in self._sources.items():
+            LOG.log(level, "%-12s %9d items from %s to %s" % (source, record.nb_traces, record.first, record.last))
+        for name, record in self._issues.items():
+            LOG.log(level, "%-24s %9d" % (name, record.count))
+        LOG.log(level, "%-24s %9d" % ('unused_learners', len(self.unused_learners)))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Generated by afelTraces2rdf.common.vocabularyBuilder, do not edit.
+# AFEL schema: ./resources/afel_schema_subset.rdf
+#   sha256 303b4e375befa9f0e7f379b70489b196e6ca6393097fb9755ce2164f4a947aef
+# Extended AFEL schema: ./resources/afel_schema_extension.rdf
+#   sha256 e3c6867b191e7ed676f66e55afe19514c4bc85b6f56caee3a93571ac168b485d
+from rdflib import URIRef
+
+__all__ = ['AFEL', 'EXTAFL', 'SCHEMA', 'AFEL_NS', 'EXT_AFEL_NS', 'SCHEMA_NS', 'AFEL_NAMES', 'EXT_AFEL_NAMES']
+
+AFEL_NS = 'http://vocab.afel-project.eu/'
+EXT_AFEL_NS = 'http://vocab.afel-project.eu/extension/'
+SCHEMA_NS = 'http://schema.org/'
+
+
+class AFEL:
+    """
+    Terms of the AFEL namespace
+    """
+    Artifact = URIRef('http://vocab.afel-project.eu/Artifact')
+    ArtifactView = URIRef('http://vocab.afel-project.eu/ArtifactView')
+    Learner = URIRef('http://vocab.afel-project.eu/Learner')
+    URL = URIRef('http://vocab.afel-project.eu/URL')
+    User = URIRef('http://vocab.afel-project.eu/User')
+    UserActivity = URIRef('http://vocab.afel-project.eu/UserActivity')
+    artifact = URIRef('http://vocab.afel-project.eu/artifact')
+    content = URIRef('http://vocab.afel-project.eu/content')
+    email = URIRef('http://vocab.afel-project.eu/email')
+    eventEndDate = URIRef('http://vocab.afel-project.eu/eventEndDate')
+    eventID = URIRef('http://vocab.afel-project.eu/eventID')
+    eventStartDate = URIRef('http://vocab.afel-project.eu/eventStartDate')
+    firstName = URIRef('http://vocab.afel-project.eu/firstName')
+    id = URIRef('http://vocab.afel-project.eu/id')
+    lastName = URIRef('http://vocab.afel-project.eu/lastName')
+    person = URIRef('http://vocab.afel-project.eu/person')
+    resourceID = URIRef('http://vocab.afel-project.eu/resourceID')
+    user = URIRef('http://vocab.afel-project.eu/user')
+    userID = URIRef('http://vocab.afel-project.eu/userID')
+    userName = URIRef('http://vocab.afel-project.eu/userName')
+
+
+class EXTAFL:
+    """
+    Terms of the extended AFEL namespace
+    """
+    ActivityCount = URIRef('http://vocab.afel-project.eu/extension/ActivityCount')
+    DidactaliaGamePlayed = URIRef('http://vocab.afel-project.eu/extension/DidactaliaGamePlayed')
+    DisplayChange = URIRef('http://vocab.afel-project.eu/extension/DisplayChange')
+    FacetAdd = URIRef('http://vocab.afel-project.eu/extension/FacetAdd')
+    FacetRemove = URIRef('http://vocab.afel-project.eu/extension/FacetRemove')
+    GUIInteraction = URIRef('http://vocab.afel-project.eu/extension/GUIInteraction')
+    GameAttributeChange = URIRef('http://vocab.afel-project.eu/extension/GameAttributeChange')
+    GamePlayed = URIRef('http://vocab.afel-project.eu/extension/GamePlayed')
+    GoBack = URIRef('http://vocab.afel-project.eu/extension/GoBack')
+    Questionnaire = URIRef('http://vocab.afel-project.eu/extension/Questionnaire')
+    RecommendedArtifactView = URIRef('http://vocab.afel-project.eu/extension/RecommendedArtifactView')
+    ScopeView = URIRef('http://vocab.afel-project.eu/extension/ScopeView')
+    Search = URIRef('http://vocab.afel-project.eu/extension/Search')
+    activityCount = URIRef('http://vocab.afel-project.eu/extension/activityCount')
+    activityType = URIRef('http://vocab.afel-project.eu/extension/activityType')
+    answersDetailsState = URIRef('http://vocab.afel-project.eu/extension/answersDetailsState')
+    audioState = URIRef('http://vocab.afel-project.eu/extension/audioState')
+    bucketSize = URIRef('http://vocab.afel-project.eu/extension/bucketSize')
+    bucketStart = URIRef('http://vocab.afel-project.eu/extension/bucketStart')
+    correctAtFirst = URIRef('http://vocab.afel-project.eu/extension/correctAtFirst')
+    correctAtFourth = URIRef('http://vocab.afel-project.eu/extension/correctAtFourth')
+    correctAtSecond = URIRef('http://vocab.afel-project.eu/extension/correctAtSecond')
+    correctAtThird = URIRef('http://vocab.afel-project.eu/extension/correctAtThird')
+    destination = URIRef('http://vocab.afel-project.eu/extension/destination')
+    display = URIRef('http://vocab.afel-project.eu/extension/display')
+    facet = URIRef('http://vocab.afel-project.eu/extension/facet')
+    gamePropertyName = URIRef('http://vocab.afel-project.eu/extension/gamePropertyName')
+    gamePropertyValue = URIRef('http://vocab.afel-project.eu/extension/gamePropertyValue')
+    labelState = URIRef('http://vocab.afel-project.eu/extension/labelState')
+    language = URIRef('http://vocab.afel-project.eu/extension/language')
+    latitude = URIRef('http://vocab.afel-project.eu/extension/latitude')
+    longitude = URIRef('http://vocab.afel-project.eu/extension/longitude')
+    score = URIRef('http://vocab.afel-project.eu/extension/score')
+    totalElements = URIRef('http://vocab.afel-project.eu/extension/totalElements')
+    user = URIRef('http://vocab.afel-project.eu/extension/user')
+    zoomLevel = URIRef('http://vocab.afel-project.eu/extension/zoomLevel')
+
+
+class SCHEMA:
+    """
+    Terms of the schema.org namespace used by the conversion
+    """
+    Answer = URIRef('http://schema.org/Answer')
+    ChooseAction = URIRef('http://schema.org/ChooseAction')
+    CommentAction = URIRef('http://schema.org/CommentAction')
+    Question = URIRef('http://schema.org/Question')
+    Rating = URIRef('http://schema.org/Rating')
+    actionOption = URIRef('http://schema.org/actionOption')
+    agent = URIRef('http://schema.org/agent')
+    author = URIRef('http://schema.org/author')
+    comment = URIRef('http://schema.org/comment')
+    endTime = URIRef('http://schema.org/endTime')
+    identifier = URIRef('http://schema.org/identifier')
+    isPartOf = URIRef('http://schema.org/isPartOf')
+    location = URIRef('http://schema.org/location')
+    name = URIRef('http://schema.org/name')
+    object = URIRef('http://schema.org/object')
+    query = URIRef('http://schema.org/query')
+    ratingValue = URIRef('http://schema.org/ratingValue')
+    resultComment = URIRef('http://schema.org/resultComment')
+    startTime = URIRef('http://schema.org/startTime')
+    superEvent = URIRef('http://schema.org/superEvent')
+    text = URIRef('http://schema.org/text')
+
+
+AFEL_NAMES = frozenset([
+    'Artifact', 'ArtifactView', 'Learner', 'URL', 'User', 'UserActivity', 'artifact', 'content', 'email',
+    'eventEndDate', 'eventID', 'eventStartDate', 'firstName', 'id', 'lastName', 'person', 'resourceID', 'user',
+    'userID', 'userName',
+])
+EXT_AFEL_NAMES = frozenset([
+    'ActivityCount', 'DidactaliaGamePlayed', 'DisplayChange', 'FacetAdd', 'FacetRemove', 'GUIInteraction',
+    'GameAttributeChange', 'GamePlayed', 'GoBack', 'Questionnaire', 'RecommendedArtifactView', 'ScopeView', 'Search',
+    'activityCount', 'activityType', 'answersDetailsState', 'audioState', 'bucketSize', 'bucketStart', 'correctAtFirst',
+    'correctAtFourth', 'correctAtSecond', 'correctAtThird', 'destination', 'display', 'facet', 'gamePropertyName',
+    'gamePropertyValue', 'labelState', 'language', 'latitude', 'longitude', 'score', 'totalElements', 'user',
+    'zoomLevel',
+])
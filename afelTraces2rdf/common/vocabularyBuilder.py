@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import re
+import glob
+import keyword
+import hashlib
+import logging
+import argparse
+import tempfile
+from urllib.request import urlopen
+from rdflib import Graph
+
+__all__ = ['VocabularyBuilder', 'schema_names']
+
+LOG = logging.getLogger(__name__)
+
+_PACKAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_DESTINATION = os.path.join(_PACKAGE_DIRECTORY, 'common', 'vocabulary.py')
+
+# The terms of the AFEL schema used by the conversion, from which the committed vocabulary module is generated
+DEFAULT_AFEL_SOURCE = './resources/afel_schema_subset.rdf'
+
+SCHEMA_NS = 'http://schema.org/'
+
+# Terms of schema.org used by the package: the 'schema:' terms of the templates and the attributes of the SCHEMA class
+_SCHEMA_TERM_REGEX = re.compile(r"""['"]schema:(\w+)['"]|\bSCHEMA\.(\w+)""")
+
+_IDENTIFIER_REGEX = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def schema_names(source, publicID) -> set:
+    """
+    :return: the names of the terms of a schema (the subjects of the schema in the namespace of its public id)
+    """
+    g = Graph()
+    g.load(source, publicID=publicID)
+    names = set()
+    for s, _, _ in g:
+        try:
+            name = g.qname(s)
+            if name.startswith('ns1:'):
+                names.add(name[4:])
+        except Exception as e:
+            if not str(e).startswith("Can't split"):
+                raise e
+    return names
+
+
+def _source_digest(source: str) -> str:
+    """
+    :return: the SHA-256 of the content of a schema source (a filename or an URL)
+    """
+    if os.path.exists(source):
+        with open(source, 'rb') as f:
+            content = f.read()
+    else:
+        with urlopen(source) as f:
+            content = f.read()
+    return hashlib.sha256(content).hexdigest()
+
+
+def _package_schema_terms() -> set:
+    terms = set()
+    for filename in glob.glob(os.path.join(_PACKAGE_DIRECTORY, '**', '*.py'), recursive=True):
+        if os.path.abspath(filename) == os.path.abspath(DEFAULT_DESTINATION):
+            continue
+        with open(filename, 'r', encoding='utf-8') as f:
+            for match in _SCHEMA_TERM_REGEX.finditer(f.read()):
+                terms.add(match.group(1) or match.group(2))
+    return terms
+
+
+class VocabularyBuilder:
+    """
+    Generate the vocabulary module: a class of URIRef constants per namespace (AFEL, EXTAFL and SCHEMA), built once
+    when the module is imported, so that the conversion reads its terms as class attributes instead of going through
+    the AfelNamespacesManager and the lookups of its closed namespaces.
+    The constants of the AFEL and extended AFEL namespaces are the terms of their schemas; the schema.org namespace
+    being open, its constants are the terms the package uses. The namespaces manager checks once, when it is
+    initialized, that the constants are terms of the schemas it loads.
+    """
+    def __init__(self, afel_source: str, afel_publicID: str, ext_afel_source: str, ext_afel_publicID: str):
+        """
+        :param afel_source: the AFEL schema source
+        :param afel_publicID: the AFEL schema public id
+        :param ext_afel_source: the extended AFEL schema source
+        :param ext_afel_publicID: the extended AFEL schema public id
+        """
+        self.afel_source = afel_source
+        self.afel_publicID = afel_publicID
+        self.ext_afel_source = ext_afel_source
+        self.ext_afel_publicID = ext_afel_publicID
+
+    @staticmethod
+    def _constant_names(label: str, names) -> list:
+        constants = []
+        for name in sorted(names):
+            if _IDENTIFIER_REGEX.match(name) and not keyword.iskeyword(name) and not name.startswith('__'):
+                constants.append(name)
+            else:
+                LOG.warning("The %s term %s is not a Python identifier: it has no constant" % (label, name))
+        return constants
+
+    @staticmethod
+    def _class_source(class_name: str, description: str, namespace: str, names: list) -> list:
+        lines = ['class %s:' % class_name, '    """', '    %s' % description, '    """']
+        lines.extend('    %s = URIRef(%r)' % (name, namespace + name) for name in names)
+        return lines + ['', '']
+
+    @staticmethod
+    def _names_source(constant: str, names: list) -> list:
+        lines = ['%s = frozenset([' % constant]
+        line = '   '
+        for name in names:
+            item = ' %r,' % name
+            if len(line) + len(item) > 120:
+                lines.append(line)
+                line = '   '
+            line += item
+        if names:
+            lines.append(line)
+        return lines + ['])']
+
+    def source(self) -> str:
+        """
+        :return: the source of the vocabulary module
+        """
+        afel_names = self._constant_names('AFEL', schema_names(self.afel_source, self.afel_publicID))
+        ext_afel_names = self._constant_names('extended AFEL', schema_names(self.ext_afel_source,
+                                                                            self.ext_afel_publicID))
+        schema_terms = self._constant_names('schema.org', _package_schema_terms())
+        lines = ['# -*- coding: utf-8 -*-',
+                 '# Generated by afelTraces2rdf.common.vocabularyBuilder, do not edit.',
+                 '# AFEL schema: %s' % self.afel_source,
+                 '#   sha256 %s' % _source_digest(self.afel_source),
+                 '# Extended AFEL schema: %s' % self.ext_afel_source,
+                 '#   sha256 %s' % _source_digest(self.ext_afel_source),
+                 'from rdflib import URIRef', '',
+                 "__all__ = ['AFEL', 'EXTAFL', 'SCHEMA', 'AFEL_NS', 'EXT_AFEL_NS', 'SCHEMA_NS', 'AFEL_NAMES', "
+                 "'EXT_AFEL_NAMES']", '',
+                 'AFEL_NS = %r' % self.afel_publicID,
+                 'EXT_AFEL_NS = %r' % self.ext_afel_publicID,
+                 'SCHEMA_NS = %r' % SCHEMA_NS, '', '']
+        lines.extend(self._class_source('AFEL', 'Terms of the AFEL namespace', self.afel_publicID, afel_names))
+        lines.extend(self._class_source('EXTAFL', 'Terms of the extended AFEL namespace', self.ext_afel_publicID,
+                                        ext_afel_names))
+        lines.extend(self._class_source('SCHEMA', 'Terms of the schema.org namespace used by the conversion',
+                                        SCHEMA_NS, schema_terms))
+        lines.extend(self._names_source('AFEL_NAMES', afel_names))
+        lines.extend(self._names_source('EXT_AFEL_NAMES', ext_afel_names))
+        LOG.info("Vocabulary of %d AFEL, %d extended AFEL and %d schema.org terms" %
+                 (len(afel_names), len(ext_afel_names), len(schema_terms)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, destination: str=DEFAULT_DESTINATION) -> None:
+        """
+        Write the vocabulary module (replaced atomically)
+        """
+        source = self.source()
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(destination)), prefix='.vocabulary')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(source)
+            os.replace(tmp_name, destination)
+        except Exception:
+            os.remove(tmp_name)
+            raise
+        LOG.info("Vocabulary module written in %s" % destination)
+
+
+def configure_args():
+    parser = argparse.ArgumentParser(description="Generate the module of the constants of the AFEL, extended AFEL "
+                                                 "and schema.org terms used by the conversion")
+    parser.add_argument('-ap', '--afel-publicid', help='Afel schema public id', type=str,
+                        default='http://vocab.afel-project.eu/')
+    parser.add_argument('-as', '--afel-schema', help='Afel schema source (the subset of the terms used by the '
+                                                     'conversion by default)', type=str, default=DEFAULT_AFEL_SOURCE)
+    parser.add_argument('-eap', '--ext-afel-publicid', help='Extended Afel schema public id', type=str,
+                        default='http://vocab.afel-project.eu/extension/')
+    parser.add_argument('-eas', '--ext-afel-schema', help='Extended Afel schema source', type=str,
+                        default='./resources/afel_schema_extension.rdf')
+    parser.add_argument('-o', '--output', help='Generated module', type=str, default=DEFAULT_DESTINATION)
+    return parser.parse_args()
+
+
+def main():
+    from .utils import get_default_loggin_config
+    get_default_loggin_config(logging.INFO)
+    args = configure_args()
+    VocabularyBuilder(afel_source=args.afel_schema, afel_publicID=args.afel_publicid,
+                      ext_afel_source=args.ext_afel_schema, ext_afel_publicID=args.ext_afel_publicid).write(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,110 +1,307 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import glob
 import warnings
 import logging
 import argparse
-from collections import namedtuple
-from rdflib import Graph
+import ujson as json
+from collections import namedtuple, OrderedDict
+from rdflib import Graph, ConjunctiveGraph, URIRef
 from .common.namespaces import AfelNamespacesManager
+from .common.metrics import ConversionMetrics, REPORT_FORMATS
+from .common.partitioning import Partition
+from .common.mappedHits import MappedHits
+from .common.outputCache import OutputCache
+from .common.validation import ConsistencyValidator
+from .common.traceFilter import TraceFilter, combine_user_filters
+from .common.traceSnapshots import TraceSnapshots
+from .common.sqliteStore import SQLiteStore
+from .common.profiling import ProfiledMetrics, create_profiler
+from .common.turtleWriter import save_turtle
+from .analysis.activityHistogram import ActivityHistogram
+from .analysis.queryCache import write_dataset_stamp
+from .analysis.textIndex import TextIndex
 from .tracesLoaders.learners import LearnerMappingParser
 from .tracesLoaders.afelAppTraces import AfelAppTracesParser
 from .tracesLoaders.didactaliaTraces import DidactaliaLearningTracesParser
-from .tracesLoaders.afelQuestionnaire import AfelQuestionnaireParser
-from .tracesLoaders.knowledgeQuestionnaires import KnowledgeQuestionairesParser
+from .tracesLoaders.questionnaires import QuestionnaireManifest, QuestionnaireParser, DEFAULT_MANIFEST
 from .common.utils import get_default_loggin_config
 
 LOG = logging.getLogger(__name__)
 
-# NamedTuple structure used to manipulate files or parsers collection
-COLLECTIONS_NAME = ['learners', 'didactalia', 'afelApp', 'appQuest', 'appQuestDetails', 'knowledge']
+# NamedTuple structure used to manipulate files or parsers collection (the questionnaires are given by a manifest)
+COLLECTIONS_NAME = ['learners', 'didactalia', 'afelApp', 'questionnaires']
 TracesCollection = namedtuple('TracesCollection', COLLECTIONS_NAME)
+# Sources that can be selected (the learners are always required), the questionnaires of the default manifest being
+# those of the sources appQuest and knowledge
+SOURCES = ['didactalia', 'afelApp', 'appQuest', 'knowledge']
+# Base URI of the named graphs of the sources
+GRAPH_BASE = 'http://data.afel-project.eu/graph/'
+# Formats that keep the named graphs
+NAMED_GRAPHS_FORMATS = ['nquads', 'trig']
+# Activity types that can be selected, of all sources
+ACTIVITY_TYPES = sorted(set(DidactaliaLearningTracesParser.ACTIVITY_TYPES) | set(AfelAppTracesParser.ACTIVITY_TYPES))
 
 
 class GraphDuplicateWatcher(Graph):
-    __NORMAL_PREFIXES = ["http://vocab.afel-project.eu/Artifact",]
-
     def __init__(self, *largs, **kwargs):
         super().__init__(*largs, **kwargs)
-        self.__duplicate_checker = set()
+        # The triples of a disk-backed graph are not kept in memory: its store tells whether a triple is a duplicate
+        self.__duplicate_checker = set() if not isinstance(self.store, SQLiteStore) else None
         self.__duplicates_count = 0
 
     def add(self, triple):
+        if self.__duplicate_checker is None:
+            if not self.store.add_quad(triple, self):
+                LOG.warning("DUPLICATE FOUND: %s %s %s" % triple)
+                self.__duplicates_count += 1
+            return
         hash_key = "_".join((p for p in triple))
         if hash_key in self.__duplicate_checker:
-            if not self.__is_duplicates_normal(triple):
-                LOG.warning("DUPLICATE FOUND: %s %s %s" % triple)
+            LOG.warning("DUPLICATE FOUND: %s %s %s" % triple)
             self.__duplicates_count += 1
         else:
             self.__duplicate_checker.add(hash_key)
         super().add(triple)
 
-    @classmethod
-    def __is_duplicates_normal(cls, triple):
-        return any((triple[0].startswith(pr) for pr in cls.__NORMAL_PREFIXES))
-
     @property
     def duplicates_count(self):
         return self.__duplicates_count
 
 
+class PartitionGraph(GraphDuplicateWatcher):
+    """
+    A graph that only keeps the triples of a given partition
+    """
+    def __init__(self, partition: Partition, *largs, **kwargs):
+        super().__init__(*largs, **kwargs)
+        self.__partition = partition
+        self.__dropped_count = 0
+
+    def add(self, triple):
+        if self.__partition.contains_triple(triple):
+            super().add(triple)
+        else:
+            self.__dropped_count += 1
+
+    @property
+    def partition(self):
+        return self.__partition
+
+    @property
+    def dropped_count(self):
+        return self.__dropped_count
+
+
+class SourceGraphsDataset(ConjunctiveGraph):
+    """
+    A dataset with a named graph per source (<graph base><source name>). Each graph watches its own duplicates,
+    and keeps only the triples of the partition if any.
+    """
+    def __init__(self, graph_base: str=GRAPH_BASE, partition: Partition=None, store='default'):
+        super().__init__(store=store)
+        self.graph_base = graph_base
+        self.__partition = partition
+        self.__graphs = OrderedDict()
+
+    def source_graph(self, source: str) -> GraphDuplicateWatcher:
+        """
+        :return: the named graph of a source, created at its first use
+        """
+        graph = self.__graphs.get(source)
+        if graph is None:
+            identifier = URIRef(self.graph_base + source)
+            if self.__partition is None:
+                graph = GraphDuplicateWatcher(store=self.store, identifier=identifier)
+            else:
+                graph = PartitionGraph(self.__partition, store=self.store, identifier=identifier)
+            self.__graphs[source] = graph
+        return graph
+
+    @property
+    def source_graphs(self) -> list:
+        return list(self.__graphs.values())
+
+    @property
+    def nb_quads(self) -> int:
+        return sum(len(graph) for graph in self.__graphs.values())
+
+    @property
+    def duplicates_count(self):
+        return sum(graph.duplicates_count for graph in self.__graphs.values())
+
+    @property
+    def dropped_count(self):
+        return sum(graph.dropped_count for graph in self.__graphs.values())
+
+
+def traces_files(files_collection: TracesCollection) -> list:
+    """
+    :return: the filenames of a files collection, including the files of the questionnaires
+    """
+    questionnaires = files_collection.questionnaires
+    return [files_collection.learners, files_collection.didactalia, files_collection.afelApp] + \
+        (questionnaires.files if questionnaires is not None else [])
+
+
 def check_files_locations(files_collection: TracesCollection):
     """
     Check that all filenames has been given and exist. Raise an assertException otherwise.
     :param files_collection: the collection of filenames
     :return: the files collection
     """
-    assert all((loc is None or os.path.exists(loc) for loc in files_collection))
+    assert all((loc is None or os.path.exists(loc) for loc in traces_files(files_collection)))
     assert files_collection.learners is not None
     return files_collection
 
 
-def process_traces(files_collection: TracesCollection):
+def select_sources(files_collection: TracesCollection, trace_filter: TraceFilter) -> TracesCollection:
+    """
+    :return: the files collection without the sources that are not selected by the trace filter
+    """
+    questionnaires = files_collection.questionnaires
+    return files_collection._replace(questionnaires=questionnaires.select(trace_filter.contains_source)
+                                     if questionnaires is not None else None,
+                                     **{source: None for source in SOURCES
+                                        if source in COLLECTIONS_NAME and not trace_filter.contains_source(source)})
+
+
+def default_questionnaires(app_questionnaire: str, app_quest_details: str,
+                           knowledge_directory: str) -> QuestionnaireManifest:
+    """
+    :return: the manifest of the questionnaires of the 2nd AFEL evaluation, with the App questionnaire files and the
+    knowledge questionnaires directory given
+    """
+    manifest = QuestionnaireManifest.load(DEFAULT_MANIFEST)
+    for layout in manifest.questionnaires:
+        if layout.source == 'appQuest':
+            layout.relocate(app_questionnaire, app_quest_details)
+        elif layout.source == 'knowledge':
+            layout.relocate(os.path.join(knowledge_directory, os.path.basename(layout.filename)))
+    return manifest
+
+
+def process_traces(files_collection: TracesCollection, metrics: ConversionMetrics=None, partition: Partition=None,
+                   validator: ConsistencyValidator=None, trace_filter: TraceFilter=None, graph_base: str=None,
+                   histogram: ActivityHistogram=None, histogram_triples: bool=False, store: SQLiteStore=None,
+                   workers: int=None, text_index: TextIndex=None, snapshots: TraceSnapshots=None,
+                   decode_whole: bool=False):
     """
     Create parser for each traces collection and parse & convert all traces
     :param files_collection: the traces files collection
-    :return: the parsers collection as a TracesCollection namedtuple
+    :param metrics: the metrics collector of the conversion stages (optional)
+    :param partition: the partition to convert (optional, all the traces are converted if None)
+    :param validator: the consistency validator of the traces (optional)
+    :param trace_filter: the selection of the traces to convert (optional, all the traces are converted if None)
+    :param graph_base: the base URI of the named graph of each source (optional, all the triples are put in a single
+    graph if None)
+    :param histogram: the histogram that counts the activities converted (optional)
+    :param histogram_triples: True to add the counts of the histogram to the graph (in the 'histograms' named graph
+    if any)
+    :param store: the disk-backed store of the graph (optional, the graph is kept in memory if None)
+    :param workers: the number of worker processes that convert the questionnaire files (optional, they are
+    converted in this process if None)
+    :param text_index: the inverted index of the free text of the activities converted (optional)
+    :param snapshots: the snapshots of the normalized Didactalia and AFEL App traces, loaded instead of the exports
+    when they are up to date, saved otherwise (optional)
+    :param decode_whole: True to decode the Didactalia and AFEL App exports at once when all their hits are needed,
+    instead of hit by hit (faster, but each export is copied in memory)
+    :return: the graph, or the SourceGraphsDataset of the named graphs
     """
-
-    graph = GraphDuplicateWatcher()  # TODO : Replace with classic Graph()
+    metrics = metrics if metrics is not None else ConversionMetrics()
+    if partition is not None:
+        LOG.info("Process partition %s" % partition)
+    store_kwargs = dict(store=store) if store is not None else dict()
+    if graph_base is not None:
+        graph = SourceGraphsDataset(graph_base, partition=partition, **store_kwargs)
+        graph_of = graph.source_graph
+    else:
+        if partition is None:
+            graph = GraphDuplicateWatcher(**store_kwargs)  # TODO : Replace with classic Graph()
+        else:
+            graph = PartitionGraph(partition, **store_kwargs)
+        graph_of = lambda source: graph
     total_nb_triples = 0
 
     LOG.info("Process learners...")
-    learners_parser = LearnerMappingParser()
+    learners_parser = LearnerMappingParser(metrics=metrics, user_filter=combine_user_filters(
+        partition.contains_user if partition is not None else None,
+        trace_filter.user_filter if trace_filter is not None else None))
     with open(files_collection.learners, 'r') as f:
-        total_nb_triples += learners_parser.load_and_dump(f, graph)
+        total_nb_triples += learners_parser.load_and_dump(f, graph_of(learners_parser.SOURCE_NAME))
+    if validator is not None:
+        validator.set_learners(learners_parser.selected_userids)
     LOG.info("Process learners done.")
 
+    if trace_filter is not None:
+        LOG.info("Traces selected: %s" % trace_filter)
+        files_collection = select_sources(files_collection, trace_filter)
+
     if files_collection.didactalia is not None:
         LOG.info("Process Didactalia traces...")
-        parser = DidactaliaLearningTracesParser()
-        with open(files_collection.didactalia, 'rb') as f:
-            total_nb_triples += parser.load_and_dump(f, learners_parser, graph)
+        parser = DidactaliaLearningTracesParser(metrics=metrics, validator=validator, trace_filter=trace_filter,
+                                                snapshots=snapshots)
+        with MappedHits(files_collection.didactalia, decode_whole=decode_whole) as hits:
+            total_nb_triples += parser.load_and_dump(hits, learners_parser, graph_of(parser.SOURCE_NAME))
+        if histogram is not None:
+            histogram.add_activities(parser.SOURCE_NAME, parser.activities)
+        if text_index is not None:
+            text_index.add_activities(parser.SOURCE_NAME, parser.activities)
         LOG.info("Process Didactalia traces done.")
 
     if files_collection.afelApp is not None:
         LOG.info("Process Afel App traces...")
-        parser = AfelAppTracesParser()
-        with open(files_collection.afelApp, 'rb') as f:
-            total_nb_triples += parser.load_and_dump(f, learners_parser, graph)
+        parser = AfelAppTracesParser(metrics=metrics, validator=validator, trace_filter=trace_filter,
+                                     snapshots=snapshots)
+        with MappedHits(files_collection.afelApp, decode_whole=decode_whole) as hits:
+            total_nb_triples += parser.load_and_dump(hits, learners_parser, graph_of(parser.SOURCE_NAME))
+        if histogram is not None:
+            histogram.add_activities(parser.SOURCE_NAME, parser.activities)
+        if text_index is not None:
+            text_index.add_activities(parser.SOURCE_NAME, parser.activities)
         LOG.info("Process Afel App done.")
 
-    if files_collection.appQuest is not None:
-        LOG.info("Process Afel App Questionaire traces...")
-        parser = AfelQuestionnaireParser()
-        with open(files_collection.appQuest, 'r') as f_data, open(files_collection.appQuestDetails, 'rb') as f_details:
-            total_nb_triples += parser.load_and_dump(f_details, f_data, learners_parser, graph)
-        LOG.info("Process Afel App Questionnaire done.")
-
-    if files_collection.knowledge is not None:
-        LOG.info("Process knowledge questionnaires...")
-        parser = KnowledgeQuestionairesParser()
-        total_nb_triples += parser.load_and_dump(files_collection.knowledge, learners_parser, graph)
-        LOG.info("Process knowledge questionnaires done.")
+    if files_collection.questionnaires is not None:
+        LOG.info("Process questionnaires...")
+        layouts = files_collection.questionnaires.questionnaires
+        if workers is not None and workers > 1 and validator is None:
+            # The validation keeps its state in this process: only the conversion without it is distributed
+            from .asyncPipeline import convert_questionnaires
+            for layout, triples, nb_triples in convert_questionnaires(layouts, files_collection.learners, workers,
+                                                                      metrics=metrics, partition=partition,
+                                                                      trace_filter=trace_filter):
+                source_graph = graph_of(layout.source)
+                for triple in triples:
+                    source_graph.add(triple)
+                total_nb_triples += nb_triples
+                LOG.info("Process of %s done." % layout)
+        else:
+            for layout in layouts:
+                LOG.info("Process %s..." % layout)
+                parser = QuestionnaireParser(layout, metrics=metrics, validator=validator, trace_filter=trace_filter)
+                total_nb_triples += parser.load_files_and_dump(learners_parser, graph_of(layout.source))
+                LOG.info("Process of %s done." % layout)
+        LOG.info("Process questionnaires done.")
+
+    if histogram is not None and histogram_triples:
+        LOG.info("Add activity histograms...")
+        with metrics.stage('histograms', 'insertion') as stage:
+            nb_triples = histogram.dump_to_graph(graph_of('histograms'))
+            stage.items += len(histogram)
+            stage.triples += nb_triples
+        total_nb_triples += nb_triples
+        LOG.info("Add activity histograms done.")
 
     LOG.info("%d triples have been generated." % total_nb_triples)
     LOG.info("%d triples are duplicates" % graph.duplicates_count)
+    if partition is not None:
+        LOG.info("%d triples belong to other partitions" % graph.dropped_count)
+        total_nb_triples -= graph.dropped_count
     LOG.info("%d triples should have been written" % (total_nb_triples - graph.duplicates_count))
+    metrics.set_counter('generated_triples', total_nb_triples)
+    metrics.set_counter('duplicate_triples', graph.duplicates_count)
+    metrics.log_summary(logging.DEBUG)
     return graph
 
 
@@ -117,10 +314,43 @@ def save_graph_to_file(graph:Graph, destination: str, format: str='pretty-xml',
     :param kwargs: extra params such as base and enconding
     :return: the graph
     """
-    graph.serialize(destination, format, **kwargs)
+    if format == 'nquads' and isinstance(graph, SourceGraphsDataset):
+        save_sorted_nquads(graph, destination)
+    elif format == 'turtle' and not kwargs and not isinstance(graph, ConjunctiveGraph):
+        save_turtle(graph, destination)
+    else:
+        graph.serialize(destination, format, **kwargs)
     return graph
 
 
+def save_sorted_nquads(dataset: SourceGraphsDataset, destination: str) -> int:
+    """
+    Save the named graphs of a dataset into a N-Quads file, graph by graph and sorted within each graph, as expected
+    by the bulk loaders of triple stores (e.g. the TDB2 parallel loader of Jena)
+    :param dataset: the dataset
+    :param destination: the destination filename
+    :return: the number of quads written
+    """
+    nb_quads = 0
+    with open(destination, 'wb') as f:
+        for graph in sorted(dataset.source_graphs, key=lambda g: g.identifier):
+            suffix = (' %s .\n' % graph.identifier.n3()).encode('utf-8')
+            # N-Triples rows end with " ." : the graph name is inserted before it
+            lines = sorted(line[:-2] for line in graph.serialize(format='nt').splitlines() if line.strip())
+            for line in lines:
+                f.write(line)
+                f.write(suffix)
+            nb_quads += len(lines)
+    return nb_quads
+
+
+def migrator_sources() -> list:
+    """
+    :return: the source files of the application, on which the output depends
+    """
+    return sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '**', '*.py'), recursive=True))
+
+
 def configure_args():
     parser = argparse.ArgumentParser(description="Convert Didactalia logs, AFEL App logs, "
                                                  "AFEL App Questionnaire and Knowledge "
@@ -146,12 +376,101 @@ def configure_args():
                         default='resources/raw_traces/didactalia_activity/behaviour_traces.json')
     parser.add_argument('-at', '--afelapp-traces', help='AFEL App traces json file', type=str,
                         default='resources/raw_traces/app_logs/app_logs.json')
-    parser.add_argument('-aq', '--afelapp-questionaire', help='AFEL App questionaire', type=str,
+    parser.add_argument('-aq', '--afelapp-questionaire', help='AFEL App questionaire (of the default questionnaires '
+                                                              'manifest)', type=str,
                         default='resources/raw_traces/app_questionnaire/app_questionnaire.csv')
-    parser.add_argument('-aqd', '--afelapp-quest-details', help='AFEL App questionaire detail', type=str,
+    parser.add_argument('-aqd', '--afelapp-quest-details', help='AFEL App questionaire detail (of the default '
+                                                                'questionnaires manifest)', type=str,
                         default='resources/raw_traces/app_questionnaire/question_details.json')
-    parser.add_argument('-kq', '--knowledge-directory', help='Knowledge questionnaire directory', type=str,
+    parser.add_argument('-kq', '--knowledge-directory', help='Knowledge questionnaire directory (of the default '
+                                                             'questionnaires manifest)', type=str,
                         default='resources/raw_traces/knowledge_questionnaire')
+    parser.add_argument('-qm', '--questionnaires-manifests', help='JSON manifests of the questionnaires of one or '
+                                                                  'several evaluation campaigns, instead of the '
+                                                                  'default manifest (%s)' % DEFAULT_MANIFEST,
+                        type=str, nargs='+', default=None)
+
+    parser.add_argument('-p', '--partition', help="Convert only a slice K/N of the learners (K from 0 to N-1), or "
+                                                  "the triples shared by all slices (artifacts, questionnaires and "
+                                                  "questions) with shared/N", type=str, default=None)
+
+    parser.add_argument('-ng', '--named-graphs', help="Put the triples of each source in its own named graph "
+                                                      "(<graph base><source>). Requires the 'nquads' (sorted output, "
+                                                      "ready for bulk loading) or 'trig' format", action='store_true')
+    parser.add_argument('-gb', '--graph-base', help='Base URI of the named graphs', type=str, default=GRAPH_BASE)
+
+    parser.add_argument('-ht', '--histogram-table', help='CSV file of the number of activities converted, by hour and '
+                                                        'by day, per source and activity type (and per user with '
+                                                        '--histogram-users)', type=str, default=None)
+    parser.add_argument('-hu', '--histogram-users', help='Also count the activities of each user in the histogram '
+                                                         'table', action='store_true')
+    parser.add_argument('-hg', '--histogram-triples', help='Add the numbers of activities by day, per source and '
+                                                           'activity type, to the output as ActivityCount resources',
+                        action='store_true')
+    parser.add_argument('-ti', '--text-index', help='File of the inverted index of the free text of the activities '
+                                                    '(search queries, artifact contents and scope labels) converted',
+                        type=str, default=None)
+
+    parser.add_argument('-st', '--store', help='SQLite database file in which the graph is built, instead of memory, '
+                                               'for datasets larger than memory (replaced if it exists). It can then '
+                                               'be queried with an rdflib graph backed by a SQLiteStore', type=str,
+                        default=None)
+
+    parser.add_argument('-us', '--users', help='Convert only the traces of these learners: user ids, or files of user '
+                                               'ids (one per line)', type=str, nargs='+', default=None)
+    parser.add_argument('-si', '--since', help='Convert only the activities that start, and the questionnaire answers '
+                                               'given, from this date (ISO date, UTC if no timezone is given)',
+                        type=str, default=None)
+    parser.add_argument('-un', '--until', help='Convert only the activities that start, and the questionnaire answers '
+                                               'given, before this date (ISO date, UTC if no timezone is given)',
+                        type=str, default=None)
+    parser.add_argument('-so', '--sources', help='Convert only these sources', type=str, nargs='+', choices=SOURCES,
+                        default=None)
+    parser.add_argument('-ty', '--activity-types', help='Convert only the activities of these types', type=str,
+                        nargs='+', choices=ACTIVITY_TYPES, default=None)
+
+    parser.add_argument('-ay', '--async-pipeline', help='Convert the sources with an asynchronous pipeline that '
+                                                        'overlaps file reads, parsing in worker processes and '
+                                                        'output writes', action='store_true')
+    parser.add_argument('-w', '--workers', help='Number of worker processes of the asynchronous pipeline '
+                                                '(default: number of CPUs), or of the pool that converts the '
+                                                'questionnaire files otherwise (default: no pool)', type=int,
+                        default=None)
+
+    parser.add_argument('-cd', '--cache-directory', help='Directory of the output cache: an output already computed '
+                                                         'from the same inputs and options is reused',
+                        type=str, default=None)
+    parser.add_argument('-cs', '--cache-size', help='Maximum size of the output cache in MB (default: 1024)',
+                        type=int, default=1024)
+    parser.add_argument('-sd', '--snapshot-directory', help='Directory of the snapshots of the normalized Didactalia '
+                                                            'and AFEL App traces: an export already parsed is loaded '
+                                                            'from its snapshot', type=str, default=None)
+    parser.add_argument('-dw', '--decode-whole', help='Decode the Didactalia and AFEL App exports at once when no '
+                                                      'learner nor trace filter applies: about twice as fast, but '
+                                                      'each export is copied in memory', action='store_true')
+
+    parser.add_argument('-va', '--validate', help='Check the consistency of the traces during the conversion '
+                                                  '(game sessions, learners, timestamps, duplicate ids, answers '
+                                                  'ranges)', action='store_true')
+    parser.add_argument('-vr', '--validation-report', help='JSON report file of the validation (default: the report '
+                                                           'is printed)', type=str, default=None)
+
+    parser.add_argument('-mr', '--metrics-report', help='Report file of the per-stage metrics of the conversion',
+                        type=str, default=None)
+    parser.add_argument('-mf', '--metrics-format', help='Format of the metrics report: json or prometheus (textfile '
+                                                        'collector format)', type=str, choices=REPORT_FORMATS,
+                        default='json')
+    parser.add_argument('-ds', '--dataset-stamp', help='Write the version stamp of the output (its content hash) into '
+                                                       'this file, for the query result cache of the analyses',
+                        type=str, default=None)
+    parser.add_argument('-pf', '--profile', help='Profile the conversion stages and the serialization, and write the '
+                                                 'collapsed stacks (for flame graphs) into PREFIX.collapsed and the '
+                                                 'top functions by stage and activity class into PREFIX.txt',
+                        type=str, default=None, metavar='PREFIX')
+    parser.add_argument('-pt', '--profile-top', help='Number of entries of each top of the profile summary',
+                        type=int, default=20)
+    parser.add_argument('-pi', '--profile-interval', help='Sampling interval of the profiler, in milliseconds of CPU '
+                                                          'time', type=float, default=5.)
 
     return parser.parse_args()
 
@@ -161,23 +480,54 @@ def main():
     args = configure_args()
 
     # Init namespace manager with the different given arguments
+    schema_kwargs = dict(afel_source=args.afel_schema,
+                         afel_publicID=args.afel_publicid,
+                         ext_afel_source=args.ext_afel_schema,
+                         ext_afel_publicID=args.ext_afel_publicid)
     try:
-        AfelNamespacesManager(afel_source=args.afel_schema,
-                              afel_publicID=args.afel_publicid,
-                              ext_afel_source=args.ext_afel_schema,
-                              ext_afel_publicID=args.ext_afel_publicid)
+        AfelNamespacesManager(**schema_kwargs)
     except Exception as e:
         print("Namespace given cannot be treated. Please check you AFEL schema, publicid and EXT-AFEL schema, public.")
         print("Details: %s" % str(e))
         sys.exit(1)
 
+    # Parse the partition if any
+    try:
+        partition = Partition.parse(args.partition) if args.partition is not None else None
+    except ValueError as e:
+        print("Partition given cannot be treated.")
+        print("Details: %s" % str(e))
+        sys.exit(1)
+
+    # Build the trace filter if any
+    trace_filter = None
+    if any(option is not None for option in (args.users, args.since, args.until, args.sources, args.activity_types)):
+        try:
+            trace_filter = TraceFilter(users=TraceFilter.read_users(args.users) if args.users is not None else None,
+                                       since=args.since, until=args.until, sources=args.sources,
+                                       activity_types=args.activity_types)
+        except (ValueError, OverflowError, OSError) as e:
+            print("Traces selection given cannot be treated.")
+            print("Details: %s" % str(e))
+            sys.exit(1)
+
+    # Load the questionnaires manifests
+    try:
+        if args.questionnaires_manifests is not None:
+            questionnaires = QuestionnaireManifest.load(*args.questionnaires_manifests)
+        else:
+            questionnaires = default_questionnaires(args.afelapp_questionaire, args.afelapp_quest_details,
+                                                    args.knowledge_directory)
+    except (OSError, ValueError, KeyError) as e:
+        print("Questionnaires manifest cannot be treated.")
+        print("Details: %s" % str(e))
+        sys.exit(1)
+
     # Build traces files collections
     files_collec = TracesCollection(learners=args.user_mapping,
                                     didactalia=args.didactalia_traces,
                                     afelApp=args.afelapp_traces,
-                                    appQuest=args.afelapp_questionaire,
-                                    appQuestDetails=args.afelapp_quest_details,
-                                    knowledge=args.knowledge_directory)
+                                    questionnaires=questionnaires)
 
     # Assert that all file exists
     try:
@@ -187,17 +537,148 @@ def main():
         print("Details: %s" % str(e))
         sys.exit(1)
 
+    if args.validate and args.async_pipeline:
+        print("The validation cannot be run with the asynchronous pipeline.")
+        sys.exit(1)
+    if args.named_graphs and args.file_format not in NAMED_GRAPHS_FORMATS:
+        print("Named graphs require one of the formats %s." % ', '.join(NAMED_GRAPHS_FORMATS))
+        sys.exit(1)
+    if args.named_graphs and args.async_pipeline:
+        print("Named graphs cannot be produced with the asynchronous pipeline.")
+        sys.exit(1)
+    if args.text_index is not None and args.async_pipeline:
+        print("The text index cannot be built by the asynchronous pipeline.")
+        sys.exit(1)
+    if args.store is not None and args.async_pipeline:
+        print("The asynchronous pipeline cannot build the graph in a store.")
+        sys.exit(1)
+    if args.snapshot_directory is not None and args.async_pipeline:
+        print("The asynchronous pipeline parses the traces in its workers: it cannot use the snapshots.")
+        sys.exit(1)
+    if args.profile is not None and args.async_pipeline:
+        print("The profiler only samples this process: it cannot be run with the asynchronous pipeline.")
+        sys.exit(1)
+    if args.validate and trace_filter is not None:
+        print("The validation requires all the traces: it cannot be run with a traces selection.")
+        sys.exit(1)
+
+    # Look for the output in the cache (not when validating, counting or indexing the activities, building a store or
+    # profiling, as the traces have to be read)
+    profiler = create_profiler(args.profile_interval / 1000.) if args.profile is not None else None
+    metrics = ProfiledMetrics(profiler) if profiler is not None else ConversionMetrics()
+    validator = ConsistencyValidator() if args.validate else None
+    histogram = ActivityHistogram(per_user=args.histogram_users) \
+        if args.histogram_table is not None or args.histogram_triples else None
+    text_index = TextIndex() if args.text_index is not None else None
+    snapshots = None
+    if args.snapshot_directory is not None:
+        if validator is not None:
+            LOG.warning("The traces are validated while they are normalized: the snapshots are not used.")
+        else:
+            snapshots = TraceSnapshots(args.snapshot_directory, options=dict(
+                partition=args.partition, trace_filter=trace_filter.to_dict() if trace_filter is not None else None))
+    cache = fingerprint = None
+    if args.cache_directory is not None and validator is None and args.histogram_table is None and args.store is None \
+            and profiler is None and text_index is None:
+        cache = OutputCache(args.cache_directory, max_size=args.cache_size * 1024 * 1024)
+        fingerprint = cache.fingerprint(traces_files(files_collec) + questionnaires.sources +
+                                        [args.afel_schema, args.ext_afel_schema] + migrator_sources(),
+                                        dict(file_format=args.file_format, partition=args.partition,
+                                             afel_publicid=args.afel_publicid,
+                                             ext_afel_publicid=args.ext_afel_publicid,
+                                             trace_filter=trace_filter.to_dict() if trace_filter is not None else None,
+                                             graph_base=args.graph_base if args.named_graphs else None,
+                                             histogram_triples=args.histogram_triples))
+        if cache.get(fingerprint, args.destination):
+            LOG.info("Output found in cache (%s), linked to %s." % (fingerprint, args.destination))
+            metrics.set_counter('cache_hit', 1)
+            if args.dataset_stamp is not None:
+                write_dataset_stamp(args.dataset_stamp, args.destination)
+            if args.metrics_report is not None:
+                metrics.write_report(args.metrics_report, format=args.metrics_format)
+            print("Bye bye.")
+            sys.exit(0)
+        metrics.set_counter('cache_hit', 0)
+
+    # Write into a new file when the output is cached, not to modify a previous output linked to the cache
+    output = args.destination if cache is None else args.destination + '.tmp'
     with warnings.catch_warnings():
         warnings.simplefilter("default")
 
         # Start process
-        LOG.info("Start processing traces files...")
-        graph = process_traces(files_collec)
-        LOG.info("Processing traces files done.")
-
-        LOG.info("Saving into file...")
-        save_graph_to_file(graph, destination=args.destination, format=args.file_format)
-        LOG.info("Saving done.")
+        if args.async_pipeline:
+            from .asyncPipeline import AsyncConversionPipeline
+            LOG.info("Start processing and saving traces files with the asynchronous pipeline...")
+            AsyncConversionPipeline(files_collec, schema_kwargs, workers=args.workers, metrics=metrics,
+                                    partition=partition, trace_filter=trace_filter, histogram=histogram,
+                                    histogram_triples=args.histogram_triples,
+                                    decode_whole=args.decode_whole).run(output, file_format=args.file_format)
+            LOG.info("Processing and saving done.")
+        else:
+            store = None
+            if args.store is not None:
+                if os.path.exists(args.store):
+                    LOG.info("Replacing the store %s" % args.store)
+                    SQLiteStore().destroy(args.store)
+                store = SQLiteStore(args.store)
+            if profiler is not None:
+                profiler.start()
+            try:
+                LOG.info("Start processing traces files...")
+                graph_base = args.graph_base if args.named_graphs else None
+                graph = process_traces(files_collec, metrics=metrics, partition=partition, validator=validator,
+                                       trace_filter=trace_filter, graph_base=graph_base, histogram=histogram,
+                                       histogram_triples=args.histogram_triples, store=store, workers=args.workers,
+                                       text_index=text_index, snapshots=snapshots, decode_whole=args.decode_whole)
+                LOG.info("Processing traces files done.")
+
+                LOG.info("Saving into file...")
+                with metrics.stage('output', 'serialization') as stage:
+                    save_graph_to_file(graph, destination=output, format=args.file_format)
+                    stage.items += 1
+                    stage.triples += graph.nb_quads if isinstance(graph, SourceGraphsDataset) else len(graph)
+                LOG.info("Saving done.")
+            finally:
+                # Stopped even if the conversion fails, for the timer not to outlive it, with a partial profile
+                if profiler is not None:
+                    profiler.stop()
+                    LOG.info("Profile written in %s" % ', '.join(profiler.write(args.profile, top=args.profile_top)))
+            if store is not None:
+                store.close()
+                LOG.info("Graph stored in %s" % args.store)
+
+        if cache is not None:
+            os.replace(output, args.destination)
+            if cache.put(fingerprint, args.destination):
+                LOG.info("Output stored in cache (%s)." % fingerprint)
+            else:
+                LOG.warning("Output larger than the cache size, not cached.")
+
+        if args.dataset_stamp is not None:
+            stamp = write_dataset_stamp(args.dataset_stamp, args.destination)
+            LOG.info("Dataset version %s written in %s" % (stamp['version'], args.dataset_stamp))
+
+        if args.metrics_report is not None:
+            metrics.write_report(args.metrics_report, format=args.metrics_format)
+            LOG.info("Metrics report written in %s" % args.metrics_report)
+
+        if args.histogram_table is not None:
+            histogram.log_summary()
+            histogram.write_table(args.histogram_table)
+            LOG.info("Activity histograms written in %s" % args.histogram_table)
+
+        if text_index is not None:
+            text_index.save(args.text_index)
+            text_index.log_summary()
+            LOG.info("Text index written in %s" % args.text_index)
+
+        if validator is not None:
+            validator.log_summary()
+            if args.validation_report is not None:
+                validator.write_report(args.validation_report)
+                LOG.info("Validation report written in %s" % args.validation_report)
+            else:
+                print(json.dumps(validator.to_dict(), indent=2))
 
     print("Bye bye.")
     sys.exit(0)
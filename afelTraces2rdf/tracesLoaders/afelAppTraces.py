@@ -3,14 +3,20 @@
 import logging
 from abc import ABCMeta
 from collections import defaultdict
-import ujson as json
 import datetime
 import pytz
 import urllib.parse as urlparse
-from rdflib.namespace import RDF, URIRef
-from rdflib import Literal, Graph
+from rdflib import Graph, URIRef
 from .baseClasses import RdfRepresentation
-from ..common.namespaces import AfelNamespacesManager, concatenate_uriref
+from .artifactRegistry import ArtifactRegistry
+from ..common.namespaces import concatenate_uriref
+from ..common.vocabulary import AFEL
+from ..common.tripleTemplates import TripleTemplate, Constant, RESOURCE
+from ..common.metrics import ConversionMetrics
+from ..common.mappedHits import MappedHits, load_hits, select_hits_where
+from ..common.validation import ConsistencyValidator
+from ..common.traceFilter import TraceFilter
+from ..common.traceSnapshots import TraceSnapshots
 from .learners import LearnerMappingParser
 
 __all__ = ['AfelAppTracesParser']
@@ -24,6 +30,13 @@ class AfelAppEvent(RdfRepresentation, metaclass=ABCMeta):
     """
     Abstract class to represent an AFEL App trace
     """
+    # The common triples of AFEL App traces, extended by the template of each activity
+    _TEMPLATE = TripleTemplate(None, [('afel:user', 'user.rdf', RESOURCE),
+                                      ('afel:eventID', 'id'),
+                                      ('afel:eventStartDate', 'start_date'),
+                                      ('afel:eventEndDate', 'end_date'),
+                                      ('schema:location', Constant(AFEL_URL))])
+
     def __init__(self, trace):
         self.id = trace['_id']
         self.user_id = trace['user_id']
@@ -32,15 +45,12 @@ class AfelAppEvent(RdfRepresentation, metaclass=ABCMeta):
         self.label = trace['label']
         self.message = trace['message']
 
-    def complete_dump(self, activity, graph: Graph) -> int:
-        ans = AfelNamespacesManager().afel_ns
-        schema_ns = AfelNamespacesManager().schema_ns
-        graph.add((activity, ans.user, self.user.rdf))
-        graph.add((activity, ans.eventID, Literal(self.id)))
-        graph.add((activity, ans.eventStartDate, Literal(self.start_date)))
-        graph.add((activity, ans.eventEndDate, Literal(self.end_date)))
-        graph.add((activity, schema_ns.location, Literal(AFEL_URL)))
-        return 5
+    @property
+    def rdf(self) -> URIRef:
+        return self._TEMPLATE.subject(self)
+
+    def dump_to_graph(self, graph: Graph) -> int:
+        return self._TEMPLATE.dump(self, graph)
 
 
 class AfelAppArtifactView(AfelAppEvent):
@@ -48,30 +58,21 @@ class AfelAppArtifactView(AfelAppEvent):
     Represent a Artifact viewed trace
     The trace will be mapped to an ArtifactView and an Artifact URIRef.
     """
+    _TEMPLATE = AfelAppEvent._TEMPLATE.extended('afel:ArtifactView', [('afel:artifact', 'artifact', RESOURCE)],
+                                                arguments=('artifact',))
+
     def __init__(self, trace):
         super().__init__(trace)
         self.artifact_url = trace['label']
         self.artifact_content = trace['message']
 
-    @property
-    def rdf(self) -> URIRef:
-        ans = AfelNamespacesManager().afel_ns
-        return concatenate_uriref(ans.ArtifactView, self.id)
-
     def dump_to_graph(self, graph: Graph) -> int:
-        ans = AfelNamespacesManager().afel_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ans.ArtifactView))
         # Create item viewed
-        item_viewed = concatenate_uriref(ans.Artifact, urlparse.quote(self.artifact_url.strip()))
-        graph.add((item_viewed, RDF.type, ans.Artifact))
-        graph.add((item_viewed, ans.resourceID, Literal(self.artifact_url.strip())))
-        graph.add((item_viewed, ans.URL, Literal(self.artifact_url)))
-        graph.add((item_viewed, ans.content, Literal(self.artifact_content)))
-        # Map item viewed to the activity
-        graph.add((activity, ans.artifact, item_viewed))
-        return self.complete_dump(activity, graph) + 6
+        item_viewed = concatenate_uriref(AFEL.Artifact, urlparse.quote(self.artifact_url.strip()))
+        nb_triples = ArtifactRegistry.of(graph).dump_artifact(graph, item_viewed, self.artifact_url.strip(),
+                                                              url=self.artifact_url, content=self.artifact_content)
+        # Create the activity, mapped to the item viewed
+        return self._TEMPLATE.dump(self, graph, item_viewed) + nb_triples
 
 
 class AfelAppRecommendedArtifactView(AfelAppEvent):
@@ -79,31 +80,21 @@ class AfelAppRecommendedArtifactView(AfelAppEvent):
     Represent a Recommended Artifact viewed trace.
     The trace will be mapped to a RecommendedArtifactView URIRef.
     """
+    _TEMPLATE = AfelAppEvent._TEMPLATE.extended('extafl:RecommendedArtifactView', [
+        ('afel:artifact', 'artifact', RESOURCE)], arguments=('artifact',))
+
     def __init__(self, trace):
         super().__init__(trace)
         self.artifact_url = trace['label']
         self.artifact_content = trace['message']
 
-    @property
-    def rdf(self) -> URIRef:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.RecommendedArtifactView, self.id)
-
     def dump_to_graph(self, graph: Graph) -> int:
-        ans = AfelNamespacesManager().afel_ns
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.RecommendedArtifactView))
         # Create item viewed
-        item_viewed = concatenate_uriref(ans.Artifact, urlparse.quote(self.artifact_url.strip()))
-        graph.add((item_viewed, RDF.type, ans.Artifact))
-        graph.add((item_viewed, ans.resourceID, Literal(self.artifact_url.strip())))
-        graph.add((item_viewed, ans.URL, Literal(self.artifact_url)))
-        graph.add((item_viewed, ans.content, Literal(self.artifact_content)))
-        # Map item viewed to the activity
-        graph.add((activity, ans.artifact, item_viewed))
-        return self.complete_dump(activity, graph) + 6
+        item_viewed = concatenate_uriref(AFEL.Artifact, urlparse.quote(self.artifact_url.strip()))
+        nb_triples = ArtifactRegistry.of(graph).dump_artifact(graph, item_viewed, self.artifact_url.strip(),
+                                                              url=self.artifact_url, content=self.artifact_content)
+        # Create the activity, mapped to the item viewed
+        return self._TEMPLATE.dump(self, graph, item_viewed) + nb_triples
 
 
 class AfelAppGoBack(AfelAppEvent):
@@ -111,78 +102,47 @@ class AfelAppGoBack(AfelAppEvent):
     Represent a 'Back' trace (when a user goes back in a previous interface in the application).
     The trace will be mapped to a GoBack URIRef.
     """
+    _TEMPLATE = AfelAppEvent._TEMPLATE.extended('extafl:GoBack', [('extafl:destination', 'destination')])
+
     def __init__(self, trace):
         super().__init__(trace)
         self.destination = trace['label']
         self.comment = trace['message']
 
-    @property
-    def rdf(self):
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.GoBack, self.id)
-
-    def dump_to_graph(self, graph: Graph):
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.GoBack))
-        graph.add((activity, ext_ans.destination, Literal(self.destination)))
-        return self.complete_dump(activity, graph) + 2
-
 
 class AfelAppDisplayChange(AfelAppEvent):
     """
     Represent a display change trace (when a user changes the visualisation displayed).
     The trace will be mapped to a DisplayChange URIRef.
     """
+    _TEMPLATE = AfelAppEvent._TEMPLATE.extended('extafl:DisplayChange', [('extafl:display', 'display')])
+
     def __init__(self, trace):
         super().__init__(trace)
         self.display = trace['label']
         self.comment = trace['message']
 
-    @property
-    def rdf(self):
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.DisplayChange, self.id)
-
-    def dump_to_graph(self, graph: Graph):
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.DisplayChange))
-        graph.add((activity, ext_ans.display, Literal(self.display)))
-        return self.complete_dump(activity, graph) + 2
-
 
 class AfelAppViewScope(AfelAppEvent):
     """
     Represent a scope viewed trace (when a user views a specific scope).
     The trace will be mapped to an ArtifactView and an Artifact URIRef.
     """
+    _TEMPLATE = AfelAppEvent._TEMPLATE.extended('extafl:ScopeView', [('afel:artifact', 'artifact', RESOURCE)],
+                                                arguments=('artifact',))
+
     def __init__(self, trace):
         super().__init__(trace)
         self.scope = trace['label']
         self.comment = trace['message']
 
-    @property
-    def rdf(self):
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.ScopeView, self.id)
-
-    def dump_to_graph(self, graph: Graph):
-        ans = AfelNamespacesManager().afel_ns
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.ScopeView))
+    def dump_to_graph(self, graph: Graph) -> int:
         # Create item viewed
-        item_viewed = concatenate_uriref(ans.Artifact, urlparse.quote(self.scope.strip()))
-        graph.add((item_viewed, RDF.type, ans.Artifact))
-        graph.add((item_viewed, ans.resourceID, Literal(self.scope.strip())))
-        graph.add((item_viewed, ans.content, Literal(self.comment)))
-        # Map item viewed to the activity
-        graph.add((activity, ans.artifact, item_viewed))
-        return self.complete_dump(activity, graph) + 5
+        item_viewed = concatenate_uriref(AFEL.Artifact, urlparse.quote(self.scope.strip()))
+        nb_triples = ArtifactRegistry.of(graph).dump_artifact(graph, item_viewed, self.scope.strip(),
+                                                              content=self.comment)
+        # Create the activity, mapped to the item viewed
+        return self._TEMPLATE.dump(self, graph, item_viewed) + nb_triples
 
 
 class AfelAppTracesParser:
@@ -190,25 +150,96 @@ class AfelAppTracesParser:
     The parser to load a json file of AFEL App traces and create related RDF triples
     """
     _TIMEZONE = pytz.timezone('UTC')
-
-    def __init__(self):
+    SOURCE_NAME = 'afelApp'
+    # Field of the normalized traces that holds their date
+    DATE_FIELD = 'time'
+    # Types of the traces of each activity type
+    ACTIVITY_TYPES = dict(ArtifactView=('activitycheck',),
+                          GoBack=('back',),
+                          DisplayChange=('displaychange',),
+                          ScopeView=('view scope',),
+                          RecommendedArtifactView=('recocheck',))
+
+    def __init__(self, metrics: ConversionMetrics=None, validator: ConsistencyValidator=None,
+                 trace_filter: TraceFilter=None, snapshots: TraceSnapshots=None):
         self._activities = []
+        self._metrics = metrics if metrics is not None else ConversionMetrics()
+        self._validator = validator
+        self._trace_filter = trace_filter
+        # The validation is done while the traces are normalized: the snapshots are only used without it
+        self._snapshots = snapshots if validator is None else None
 
     def load_and_dump(self, fin, learners_parser: LearnerMappingParser,  graph: Graph) -> int:
         self.load(fin, learners_parser)
         return self.dump_to_graph(graph)
 
-    def load(self, f, learners_parser: LearnerMappingParser):
-        raw_traces = json.load(f)
-        raw_traces = raw_traces['hits']['hits']
+    @property
+    def activities(self) -> list:
+        return self._activities
 
-        traces = sorted((self._process_raw_trace(rt, learners_parser) for rt in raw_traces), key=lambda x: x['time'])
+    def load(self, f, learners_parser: LearnerMappingParser):
+        """
+        Load and normalize traces
+        :param f: the json file object of the traces, or the MappedHits of the file
+        :param learners_parser: the learners parser
+        """
+        snapshots = self._snapshots if isinstance(f, MappedHits) else None
+        traces = None
+        if snapshots is not None:
+            with self._metrics.stage(self.SOURCE_NAME, 'snapshot') as stage:
+                traces = snapshots.load(self.SOURCE_NAME, f, self.DATE_FIELD, learners_parser)
+                stage.items += len(traces) if traces is not None else 0
+        if traces is None:
+            traces = self._load_traces(f, learners_parser)
+            if snapshots is not None:
+                with self._metrics.stage(self.SOURCE_NAME, 'snapshot'):
+                    snapshots.save(self.SOURCE_NAME, f, traces, self.DATE_FIELD)
+        self._build(traces)
+
+    def _load_traces(self, f, learners_parser: LearnerMappingParser) -> list:
+        """
+        :return: the normalized traces, sorted
+        """
+        conditions = self._raw_conditions(learners_parser)
+        with self._metrics.stage(self.SOURCE_NAME, 'loading') as stage:
+            # Without any condition to check on the raw hits, all of them may be decoded at once
+            raw_traces = load_hits(f, selective=bool(conditions))
+            stage.items += len(raw_traces)
+
+        with self._metrics.stage(self.SOURCE_NAME, 'normalization') as stage:
+            traces = [self._process_raw_trace(rt, learners_parser)
+                      for rt in select_hits_where(raw_traces, conditions)]
+            if self._validator is not None:
+                traces = [tr for tr in traces if tr is not None]
+            stage.items += len(traces)
+
+        with self._metrics.stage(self.SOURCE_NAME, 'sorting') as stage:
+            traces.sort(key=lambda x: x['time'])
+            stage.items += len(traces)
         LOG.debug("%d AFEL traces read." % len(traces))
-        self._process_traces(traces)
+        return traces
+
+    def _build(self, traces: list) -> None:
+        with self._metrics.stage(self.SOURCE_NAME, 'building') as stage:
+            nb_activities = len(self._activities)
+            self._process_traces(traces)
+            stage.items += len(self._activities) - nb_activities
 
     def dump_to_graph(self, graph: Graph) -> int:
         LOG.debug("Going to dump %d AFEL traces into RDF" % len(self._activities))
-        return sum((a.dump_to_graph(graph) for a in self._activities))
+        with self._metrics.stage(self.SOURCE_NAME, 'insertion') as stage:
+            nb_total_triples = self._metrics.count_dump(self.SOURCE_NAME, self._activities, graph)
+            stage.items += len(self._activities)
+            stage.triples += nb_total_triples
+        return nb_total_triples
+
+    def dump_finished_to_graph(self, graph: Graph) -> int:
+        """
+        Dump the activities loaded so far and release them, to convert traces incrementally
+        """
+        nb_total_triples = self.dump_to_graph(graph)
+        self._activities = []
+        return nb_total_triples
 
     def _process_traces(self, traces):
         action_type_mapper = defaultdict(lambda: (lambda x: None))
@@ -224,13 +255,31 @@ class AfelAppTracesParser:
             if activity is not None:
                 self._activities.append(activity)
 
-    @classmethod
-    def _process_raw_trace(cls, rt, learners_parser: LearnerMappingParser):
+    def _raw_conditions(self, learners_parser: LearnerMappingParser) -> list:
+        """
+        :return: the conditions on the raw fields of the traces to decode
+        """
+        conditions = [(('user',), learners_parser.is_selected)] if learners_parser.has_user_filter else []
+        trace_filter = self._trace_filter
+        if trace_filter is None:
+            return conditions
+        action_types = trace_filter.raw_action_types(self.ACTIVITY_TYPES)
+        if action_types is not None:
+            conditions.append((('type',), lambda action_type: action_type in action_types))
+        if trace_filter.has_time_window:
+            # Time is a UNIX timestamp in ms: it is checked before any date conversion
+            conditions.append((('time',), lambda time: trace_filter.contains_timestamp(time // 1000)))
+        return conditions
+
+    def _process_raw_trace(self, rt, learners_parser: LearnerMappingParser):
         tr = rt['_source']
         tr['_id'] = rt['_id']
         dt = datetime.datetime.fromtimestamp(tr['time'] // 1000)  # convert UTC unix TS im ms to naive dt in sec.
-        tr['time'] = cls._TIMEZONE.localize(dt).astimezone(pytz.utc)  # convert naive dt into aware dt
+        tr['time'] = self._TIMEZONE.localize(dt).astimezone(pytz.utc)  # convert naive dt into aware dt
         tr['user_id'] = tr['user']
+        if self._validator is not None and not self._validator.check_trace(self.SOURCE_NAME, tr['_id'],
+                                                                            tr['user_id'], tr['time']):
+            return None  # Unknown learner: reported and skipped, to validate the whole file
         tr['user'] = learners_parser.get_user_by_userid(tr['user_id'])
         return tr
 
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import hashlib
+import weakref
+from rdflib.namespace import RDF
+from rdflib import Graph, Literal, URIRef
+from ..common.vocabulary import AFEL
+
+__all__ = ['ArtifactRegistry']
+
+
+class ArtifactRegistry:
+    """
+    Registry of the artifacts dumped into a graph.
+    The same artifact is viewed by many activities, from several sources: its descriptive triples (type, resource
+    id, url and contents) are added only the first time they are met, and the activities only add their link to
+    the artifact. Contents (the messages of the AFEL App traces, possibly large) are kept by hash: each distinct
+    content is stored in a single literal.
+    """
+    __REGISTRIES = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        self._emitted = set()  # keys of the descriptive triples already added
+        self._contents = dict()  # content hash -> content literal
+
+    @classmethod
+    def of(cls, graph: Graph) -> 'ArtifactRegistry':
+        """
+        :return: the registry of the artifacts of a graph, created at its first use
+        """
+        registry = cls.__REGISTRIES.get(graph)
+        if registry is None:
+            registry = cls()
+            cls.__REGISTRIES[graph] = registry
+        return registry
+
+    def content_literal(self, content: str) -> (bytes, Literal):
+        """
+        :return: the hash of a content and its shared literal
+        """
+        key = hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+        literal = self._contents.get(key)
+        if literal is None:
+            literal = Literal(content)
+            self._contents[key] = literal
+        return key, literal
+
+    def dump_artifact(self, graph: Graph, artifact: URIRef, resource_id: str, url: str=None,
+                      content: str=None) -> int:
+        """
+        Add the descriptive triples of an artifact that have not been added yet
+        :param graph: the graph
+        :param artifact: the artifact URIRef
+        :param resource_id: the artifact resource id
+        :param url: the artifact URL (optional)
+        :param content: a content of the artifact (optional)
+        :return: the number of triples added
+        """
+        nb_triples = self._add(graph, (artifact, RDF.type, AFEL.Artifact), AFEL.Artifact)
+        nb_triples += self._add(graph, (artifact, AFEL.resourceID, Literal(resource_id)), resource_id)
+        if url is not None:
+            nb_triples += self._add(graph, (artifact, AFEL.URL, Literal(url)), url)
+        if content is not None:
+            key, literal = self.content_literal(content)
+            nb_triples += self._add(graph, (artifact, AFEL.content, literal), key)
+        return nb_triples
+
+    def _add(self, graph: Graph, triple, value_key) -> int:
+        # Triples are identified by their subject, predicate and a key of their object (the hash for contents)
+        key = (triple[0], triple[1], value_key)
+        if key in self._emitted:
+            return 0
+        self._emitted.add(key)
+        graph.add(triple)
+        return 1
+
+    def __len__(self) -> int:
+        return sum(1 for key in self._emitted if key[1] == RDF.type)
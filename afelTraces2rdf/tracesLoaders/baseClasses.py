@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 # Author: Rémi Venant
 from abc import abstractmethod, ABCMeta
-from rdflib import Graph, Literal, URIRef
-from rdflib.namespace import RDF
-from ..common.namespaces import AfelNamespacesManager, concatenate_uriref
+from rdflib import Graph, URIRef
+from ..common.tripleTemplates import TripleTemplate, When, RESOURCE
 
 __all__ = ['RdfRepresentation', 'Person', 'User', 'Questionnaire', 'Question', 'Answer', 'CommentAnswer',
            'RatingAnswer', 'IntRatingAnswer', 'FloatRatingAnswer']
@@ -25,6 +24,11 @@ class Person(RdfRepresentation, metaclass=ABCMeta):
 
 
 class User(RdfRepresentation):
+    _TEMPLATE = TripleTemplate('afel:User', [('afel:userID', 'userid'),
+                                             ('afel:userName', 'username'),
+                                             When('person', [('afel:person', 'person.rdf', RESOURCE)])],
+                               subject_id='username')
+
     def __init__(self, userid, username, person: Person=None):
         self.userid = userid
         self.username = username
@@ -32,22 +36,17 @@ class User(RdfRepresentation):
 
     @property
     def rdf(self) -> URIRef:
-        ans = AfelNamespacesManager().afel_ns
-        return concatenate_uriref(ans.User, self.username)
+        return self._TEMPLATE.subject(self)
 
     def dump_to_graph(self, graph: Graph) -> int:
-        ans = AfelNamespacesManager().afel_ns
-        rdf_rep = self.rdf
-        graph.add((rdf_rep, RDF.type, ans.User))
-        graph.add((rdf_rep, ans.userID, Literal(self.userid)))
-        graph.add((rdf_rep, ans.userName, Literal(self.username)))
-        if self.person is not None:
-            graph.add((rdf_rep, ans.person, self.person.rdf))
-
-        return 4 if self.person is not None else 3
+        return self._TEMPLATE.dump(self, graph)
 
 
 class Questionnaire(RdfRepresentation):
+    _TEMPLATE = TripleTemplate('extafl:Questionnaire', [('schema:identifier', 'id'),
+                                                        ('schema:name', 'name'),
+                                                        ('schema:comment', 'comment')])
+
     def __init__(self, qid: str, name: str, comment: str):
         self.id = qid
         self.name = name
@@ -55,23 +54,18 @@ class Questionnaire(RdfRepresentation):
 
     @property
     def rdf(self) -> URIRef:
-        extans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(extans.Questionnaire, self.id)
+        return self._TEMPLATE.subject(self)
 
     def dump_to_graph(self, graph: Graph) -> int:
-        extans = AfelNamespacesManager().ext_afel_ns
-        schns = AfelNamespacesManager().schema_ns
-        # Dump Learner triples
-        rdf = self.rdf
-        graph.add((rdf, RDF.type, extans.Questionnaire))
-        graph.add((rdf, schns.identifier, Literal(self.id)))
-        graph.add((rdf, schns.name, Literal(self.name)))
-        graph.add((rdf, schns.comment, Literal(self.comment)))
-
-        return 4
+        return self._TEMPLATE.dump(self, graph)
 
 
 class Question(RdfRepresentation):
+    _TEMPLATE = TripleTemplate('schema:Question', [('schema:identifier', 'fullid'),
+                                                   ('schema:text', 'text'),
+                                                   ('schema:isPartOf', 'questionnaire.rdf', RESOURCE)],
+                               subject_id='fullid')
+
     def __init__(self, qid, text, questionnaire: Questionnaire):
         self.id = qid
         self.fullid = questionnaire.id + '_' + qid
@@ -80,93 +74,56 @@ class Question(RdfRepresentation):
 
     @property
     def rdf(self) -> URIRef:
-        schema = AfelNamespacesManager().schema_ns
-        return concatenate_uriref(schema.Question, self.fullid)
+        return self._TEMPLATE.subject(self)
 
     def dump_to_graph(self, graph: Graph) -> int:
-        schema = AfelNamespacesManager().schema_ns
-        rdf = self.rdf
-        graph.add((rdf, RDF.type, schema.Question))
-        graph.add((rdf, schema.identifier, Literal(self.fullid)))
-        graph.add((rdf, schema.text, Literal(self.text)))
-        graph.add((rdf, schema.isPartOf, self.questionnaire.rdf))
-
-        return 4
+        return self._TEMPLATE.dump(self, graph)
 
 
 class Answer(RdfRepresentation, metaclass=ABCMeta):
+    # Properties of the answer, and of the action of the user that answered (whose template has the argument answer)
+    _ANSWER_TEMPLATE = TripleTemplate(None, [('schema:identifier', 'id'),
+                                             ('schema:author', 'user.rdf', RESOURCE)])
+    _ACTION_TEMPLATE = TripleTemplate(None, [('schema:identifier', 'id'),
+                                             ('schema:startTime', 'date'),
+                                             ('schema:endTime', 'date'),
+                                             ('schema:agent', 'user.rdf', RESOURCE),
+                                             ('schema:object', 'question.rdf', RESOURCE)], arguments=('answer',))
+
     def __init__(self, user: User, date, question: Question):
         self.user = user
         self.question = question
         self.date = date
         self.id = self.question.fullid + "_" + self.user.userid
 
+    @property
+    def rdf(self) -> URIRef:
+        return self._ANSWER_TEMPLATE.subject(self)
+
+    def dump_to_graph(self, graph: Graph) -> int:
+        nb_triples = self._ANSWER_TEMPLATE.dump(self, graph)
+        return self._ACTION_TEMPLATE.dump(self, graph, self.rdf) + nb_triples
+
 
 class CommentAnswer(Answer):
+    _ANSWER_TEMPLATE = Answer._ANSWER_TEMPLATE.extended('schema:Answer', [('schema:text', 'text')])
+    _ACTION_TEMPLATE = Answer._ACTION_TEMPLATE.extended('schema:CommentAction',
+                                                        [('schema:resultComment', 'answer', RESOURCE)])
+
     def __init__(self, user: User, date, question: Question, text):
         super().__init__(user, date, question)
         self.text = text
 
-    @property
-    def rdf(self) -> URIRef:
-        schema = AfelNamespacesManager().schema_ns
-        return concatenate_uriref(schema.Answer, self.id)
-
-    def dump_to_graph(self, graph: Graph) -> int:
-        schema = AfelNamespacesManager().schema_ns
-        # Create Comment
-        rdf_answer = self.rdf
-        graph.add((rdf_answer, RDF.type, schema.Answer))
-        graph.add((rdf_answer, schema.identifier, Literal(self.id)))
-        graph.add((rdf_answer, schema.text, Literal(self.text)))
-        # Create CommentAction
-        rdf_action = concatenate_uriref(schema.CommentAction, self.id)
-        graph.add((rdf_action, RDF.type, schema.CommentAction))
-        graph.add((rdf_action, schema.identifier, Literal(self.id)))
-        graph.add((rdf_action, schema.startTime, Literal(self.date)))
-        graph.add((rdf_action, schema.endTime, Literal(self.date)))
-        # Link both comment and commentAction to user
-        graph.add((rdf_answer, schema.author, self.user.rdf))
-        graph.add((rdf_action, schema.agent, self.user.rdf))
-        # Link CommentAction to Comment and CommentAction to Question
-        graph.add((rdf_action, schema.resultComment, rdf_answer))
-        graph.add((rdf_action, schema.object, self.question.rdf))
-
-        return 11
-
 
 class RatingAnswer(Answer):
+    _ANSWER_TEMPLATE = Answer._ANSWER_TEMPLATE.extended('schema:Rating', [('schema:ratingValue', 'value')])
+    _ACTION_TEMPLATE = Answer._ACTION_TEMPLATE.extended('schema:ChooseAction',
+                                                        [('schema:actionOption', 'answer', RESOURCE)])
+
     def __init__(self, user: User, date, question: Question, value):
         super().__init__(user, date, question)
         self.value = value
 
-    @property
-    def rdf(self) -> URIRef:
-        schema = AfelNamespacesManager().schema_ns
-        return concatenate_uriref(schema.Rating, self.id)
-
-    def dump_to_graph(self, graph: Graph) -> int:
-        schema = AfelNamespacesManager().schema_ns
-        # Create Comment
-        rdf_answer = self.rdf
-        graph.add((rdf_answer, RDF.type, schema.Rating))
-        graph.add((rdf_answer, schema.identifier, Literal(self.id)))
-        graph.add((rdf_answer, schema.ratingValue, Literal(self.value)))
-        # Create CommentAction
-        rdf_action = concatenate_uriref(schema.ChooseAction, self.id)
-        graph.add((rdf_action, RDF.type, schema.ChooseAction))
-        graph.add((rdf_action, schema.identifier, Literal(self.id)))
-        graph.add((rdf_action, schema.startTime, Literal(self.date)))
-        graph.add((rdf_action, schema.endTime, Literal(self.date)))
-        # Link both comment and commentAction to user
-        graph.add((rdf_answer, schema.author, self.user.rdf))
-        graph.add((rdf_action, schema.agent, self.user.rdf))
-        # Link CommentAction to Comment and CommentAction to Question
-        graph.add((rdf_action, schema.actionOption, rdf_answer))
-        graph.add((rdf_action, schema.object, self.question.rdf))
-
-        return 11
-
 
 class IntRatingAnswer(RatingAnswer):
     def __init__(self, user: User, date, question: Question, value):
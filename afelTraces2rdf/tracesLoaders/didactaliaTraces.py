@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
 import logging
 from collections import defaultdict
-import ujson as json
 import datetime
 import dateutil.parser as dateparser
 import urllib.parse as urlparse
 from abc import ABCMeta
-from rdflib.namespace import RDF
-from rdflib import Literal, Graph, URIRef
+from rdflib import Graph, URIRef
 from .baseClasses import RdfRepresentation
-from ..common.namespaces import AfelNamespacesManager, concatenate_uriref
+from .artifactRegistry import ArtifactRegistry
+from ..common.namespaces import concatenate_uriref
+from ..common.vocabulary import AFEL
+from ..common.tripleTemplates import TripleTemplate, When, Constant, RESOURCE
+from ..common.metrics import ConversionMetrics
+from ..common.mappedHits import MappedHits, load_hits, select_hits_where
+from ..common.validation import ConsistencyValidator
+from ..common.traceFilter import TraceFilter
+from ..common.traceSnapshots import TraceSnapshots
 from .learners import LearnerMappingParser
 
 
@@ -19,11 +25,25 @@ LOG = logging.getLogger(__name__)
 
 DIDACTALIA_URL = 'https://didactalia.net'
 
+# Duration given to the game sessions that have no playEnd trace
+UNFINISHED_GAME_DURATION = datetime.timedelta(days=1)
+
+# Traces that belong to a game session, besides its playStart trace
+SESSION_ACTION_TYPES = frozenset(['playEnd', 'answersDetailsStateChange', 'playStudyChange', 'labelStateChange',
+                                  'languageChange', 'audioStateChange'])
+
 
 class DidactaliaLearningActivity(RdfRepresentation, metaclass=ABCMeta):
     """
     Abstract class to represent a didactalia trace
     """
+    # The common triples of didactalia traces, extended by the template of each activity
+    _TEMPLATE = TripleTemplate(None, [('afel:user', 'user.rdf', RESOURCE),
+                                      ('afel:eventID', 'id'),
+                                      ('afel:eventStartDate', 'start_date'),
+                                      ('afel:eventEndDate', 'end_date'),
+                                      ('schema:location', Constant(DIDACTALIA_URL))])
+
     def __init__(self, trace):
         self.id = trace['_id']
         self.start_date = self.end_date = trace['date']
@@ -31,15 +51,12 @@ class DidactaliaLearningActivity(RdfRepresentation, metaclass=ABCMeta):
         self.user = trace['user']
         self.community_id = trace['community_id']
 
-    def complete_dump(self, activity, graph: Graph) -> int:
-        ans = AfelNamespacesManager().afel_ns
-        schema_ans = AfelNamespacesManager().schema_ns
-        graph.add((activity, ans.user, self.user.rdf))
-        graph.add((activity, ans.eventID, Literal(self.id)))
-        graph.add((activity, ans.eventStartDate, Literal(self.start_date)))
-        graph.add((activity, ans.eventEndDate, Literal(self.end_date)))
-        graph.add((activity, schema_ans.location, Literal(DIDACTALIA_URL)))
-        return 5
+    @property
+    def rdf(self) -> URIRef:
+        return self._TEMPLATE.subject(self)
+
+    def dump_to_graph(self, graph: Graph) -> int:
+        return self._TEMPLATE.dump(self, graph)
 
 
 class ArtifactView(DidactaliaLearningActivity):
@@ -47,30 +64,21 @@ class ArtifactView(DidactaliaLearningActivity):
     Represents the 'resourceVisited' trace, when a user open a pedagogical resource.
     The trace will be mapped to a ArtifactView UriRef, and an Artifact UriRef.
     """
+    _TEMPLATE = DidactaliaLearningActivity._TEMPLATE.extended('afel:ArtifactView', [
+        ('afel:artifact', 'artifact', RESOURCE)], arguments=('artifact',))
+
     def __init__(self, trace):
         super().__init__(trace)
         self.item = trace['Item']
         self.referer_url = trace['referer_url']
 
-    @property
-    def rdf(self) -> URIRef:
-        ans = AfelNamespacesManager().afel_ns
-        return concatenate_uriref(ans.ArtifactView, self.id)
-
     def dump_to_graph(self, graph: Graph) -> int:
-        ans = AfelNamespacesManager().afel_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ans.ArtifactView))
         # Create item viewed
-        item_viewed = concatenate_uriref(ans.Artifact, urlparse.quote(self.item.strip()))
-        graph.add((item_viewed, RDF.type, ans.Artifact))
-        graph.add((item_viewed, ans.resourceID, Literal(self.item.strip())))
-        graph.add((item_viewed, ans.URL, Literal(self.referer_url)))
-        # Map item viewed to the activity
-        graph.add((activity, ans.artifact, item_viewed))
-        # Create the common triples of didactalia traces
-        return self.complete_dump(activity, graph) + 5
+        item_viewed = concatenate_uriref(AFEL.Artifact, urlparse.quote(self.item.strip()))
+        nb_triples = ArtifactRegistry.of(graph).dump_artifact(graph, item_viewed, self.item.strip(),
+                                                              url=self.referer_url)
+        # Create the activity, mapped to the item viewed
+        return self._TEMPLATE.dump(self, graph, item_viewed) + nb_triples
 
 
 class SearchActivity(DidactaliaLearningActivity):
@@ -78,78 +86,58 @@ class SearchActivity(DidactaliaLearningActivity):
     Represents the 'freeTextSearch' trace, when a user submit a query for a research.
     The trace will be mapped to a Search URIRef.
     """
+    _TEMPLATE = DidactaliaLearningActivity._TEMPLATE.extended('extafl:Search', [('schema:query', 'query')])
+
     def __init__(self, trace):
         super().__init__(trace)
         self.query = trace['search_text']
 
-    @property
-    def rdf(self) -> URIRef:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.Search, self.id)
-
-    def dump_to_graph(self, graph: Graph) -> int:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        schema_ans = AfelNamespacesManager().schema_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.Search))
-        graph.add((activity, schema_ans.query, Literal(self.query)))
-        # Create the common triples of didactalia traces
-        return self.complete_dump(activity, graph) + 2
-
 
 class FacetAddActivity(DidactaliaLearningActivity):
     """
     Represents  the 'facetsSearchAdd' trace, when a user add a facet to narrow the research.
     The trace will be mapped to a FacetAdd URIRef.
     """
+    _TEMPLATE = DidactaliaLearningActivity._TEMPLATE.extended('extafl:FacetAdd', [('extafl:facet', 'facet')])
+
     def __init__(self, trace):
         super().__init__(trace)
         self.facet = trace['facet']
 
-    @property
-    def rdf(self) -> URIRef:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.FacetAdd, self.id)
-
-    def dump_to_graph(self, graph: Graph) -> int:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        # Create activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.FacetAdd))
-        graph.add((activity, ext_ans.facet, Literal(self.facet)))
-        # Create the common triples of didactalia traces
-        return self.complete_dump(activity, graph) + 2
-
 
 class FacetRemoveActivity(DidactaliaLearningActivity):
     """
     Represents  the 'facetsSearchRemove' trace, when a user remove a facet to widen the research field.
     The trace will be mapped to a FacetRemove URIRef.
     """
+    _TEMPLATE = DidactaliaLearningActivity._TEMPLATE.extended('extafl:FacetRemove', [('extafl:facet', 'facet')])
+
     def __init__(self, trace):
         super().__init__(trace)
         self.facet = trace['facet']
 
-    @property
-    def rdf(self) -> URIRef:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.FacetRemove, self.id)
-
-    def dump_to_graph(self, graph: Graph) -> int:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.FacetRemove))
-        graph.add((activity, ext_ans.facet, Literal(self.facet)))
-        # Create the common triples of didactalia traces
-        return self.complete_dump(activity, graph) + 2
-
 
 class GamePlayedActivity(DidactaliaLearningActivity):
     """
     Represents a couple 'playStart' and 'playEnd' linked by their playSession attribute.
     The two traces will be mapped into a single DidactaliaGamePlayed UriRef.
     """
+    _TEMPLATE = DidactaliaLearningActivity._TEMPLATE.extended('extafl:DidactaliaGamePlayed', [
+        ('afel:artifact', 'artifact', RESOURCE),
+        ('extafl:language', 'game_language'),
+        ('extafl:labelState', 'label_state'),
+        ('extafl:audioState', 'audio_state'),
+        ('extafl:answersDetailsState', 'answers_details_state'),
+        ('extafl:longitude', 'longitude'),
+        ('extafl:latitude', 'latitude'),
+        ('extafl:zoomLevel', 'zoom_level'),
+        When('is_achieved', [('extafl:correctAtFirst', 'correct_at_first'),
+                             ('extafl:correctAtSecond', 'correct_at_second'),
+                             ('extafl:correctAtThird', 'correct_at_third'),
+                             ('extafl:correctAtFourth', 'correct_at_fourth'),
+                             ('extafl:totalElements', 'total_elements'),
+                             ('extafl:score', 'score')])], arguments=('artifact',))
+
     def __init__(self, trace):
         """
         Construct the instance with the playStart trace
@@ -178,8 +166,8 @@ class GamePlayedActivity(DidactaliaLearningActivity):
         self._is_activity_achieved = False
 
     @property
-    def rdf(self) -> URIRef:
-        return concatenate_uriref(AfelNamespacesManager().ext_afel_ns.DidactaliaGamePlayed, self.id)
+    def is_achieved(self) -> bool:
+        return self._is_activity_achieved
 
     def end_activity(self, trace) -> None:
         """
@@ -195,41 +183,27 @@ class GamePlayedActivity(DidactaliaLearningActivity):
         self.end_date = trace['date']
         self._is_activity_achieved = True
 
-    def dump_to_graph(self, graph: Graph) -> None:
-        ans = AfelNamespacesManager().afel_ns
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        # Add the activity to the graph
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.DidactaliaGamePlayed))
+    def start_hit(self) -> dict:
+        """
+        :return: the raw hit of the playStart trace of the session (JSON serializable), to restore the session later
+        """
+        return {'_id': self.id,
+                '_source': {'date': self.start_date.isoformat(), 'user_id': self.user_id,
+                            'community_id': self.community_id, 'actionType': 'playStart',
+                            'playSession': self.play_session, 'resource_id': self.resource_id,
+                            'gameLanguage': self.game_language, 'labelState': self.label_state,
+                            'answersDetailsState': self.answers_details_state, 'audioState': self.audio_state,
+                            'longitude': self.longitude, 'latitude': self.latitude, 'zoomLevel': self.zoom_level}}
+
+    def dump_to_graph(self, graph: Graph) -> int:
         # Create the artifact related to the game
-        game = concatenate_uriref(ans.Artifact, self.resource_id)
-        graph.add((game, RDF.type, ans.Artifact))
-        graph.add((game, ans.resourceID, Literal(self.resource_id)))
-        graph.add((activity, ans.artifact, game))
-        # Add the whole properties
-        graph.add((activity, ext_ans.language, Literal(self.game_language)))
-        graph.add((activity, ext_ans.labelState, Literal(self.label_state)))
-        graph.add((activity, ext_ans.audioState, Literal(self.audio_state)))
-        graph.add((activity, ext_ans.answersDetailsState, Literal(self.answers_details_state)))
-        graph.add((activity, ext_ans.longitude, Literal(self.longitude)))
-        graph.add((activity, ext_ans.latitude, Literal(self.latitude)))
-        graph.add((activity, ext_ans.zoomLevel, Literal(self.zoom_level)))
-        nb_triples = 11
+        game = concatenate_uriref(AFEL.Artifact, self.resource_id)
+        nb_triples = ArtifactRegistry.of(graph).dump_artifact(graph, game, self.resource_id)
         if not self._is_activity_achieved:
             LOG.debug("Game activity is going to be dumped while it is not achieved, adding one day to the start")
-            oneday = datetime.timedelta(days=1)
-            self.end_date = self.start_date + oneday
-        else:
-            graph.add((activity, ext_ans.correctAtFirst, Literal(self.correct_at_first)))
-            graph.add((activity, ext_ans.correctAtSecond, Literal(self.correct_at_second)))
-            graph.add((activity, ext_ans.correctAtThird, Literal(self.correct_at_third)))
-            graph.add((activity, ext_ans.correctAtFourth, Literal(self.correct_at_fourth)))
-            graph.add((activity, ext_ans.totalElements, Literal(self.total_elements)))
-            graph.add((activity, ext_ans.score, Literal(self.score)))
-            nb_triples += 6
-
-        # Create the common triples of didactalia traces
-        return self.complete_dump(activity, graph) + nb_triples
+            self.end_date = self.start_date + UNFINISHED_GAME_DURATION
+        # Add the activity, with the results of the game if it is achieved
+        return self._TEMPLATE.dump(self, graph, game) + nb_triples
 
 
 class GameAttributeChanged(DidactaliaLearningActivity):
@@ -237,6 +211,12 @@ class GameAttributeChanged(DidactaliaLearningActivity):
     Represents  any of the change event trace that can happend during a game session.
     The trace will be mapped to a GameAttributeChange URIRef.
     """
+    _TEMPLATE = DidactaliaLearningActivity._TEMPLATE.extended('extafl:GameAttributeChange', [
+        ('extafl:gamePropertyName', 'attribute_name'),
+        ('extafl:gamePropertyValue', 'attribute_value'),
+        # Link the activity to the game played activity if it exists
+        When('game_played_activity', [('schema:superEvent', 'game_played_activity.rdf', RESOURCE)])])
+
     def __init__(self, trace, game_played_activity: GamePlayedActivity=None):
         super().__init__(trace)
         self.game_played_activity = game_played_activity
@@ -258,59 +238,151 @@ class GameAttributeChanged(DidactaliaLearningActivity):
         else:
             raise Exception("Wrong application state!")
 
-    @property
-    def rdf(self) -> URIRef:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        return concatenate_uriref(ext_ans.GameAttributeChange, self.id)
-
-    def dump_to_graph(self, graph: Graph) -> None:
-        ext_ans = AfelNamespacesManager().ext_afel_ns
-        schema_ans = AfelNamespacesManager().schema_ns
-        # Create the activity
-        activity = self.rdf
-        graph.add((activity, RDF.type, ext_ans.GameAttributeChange))
-        graph.add((activity, ext_ans.gamePropertyName, Literal(self.attribute_name)))
-        graph.add((activity, ext_ans.gamePropertyValue, Literal(self.attribute_value)))
-        nb_triples = 3
-        # Link the activity to the game played activity if it exists
-        if self.game_played_activity is not None:
-            graph.add((activity, schema_ans.superEvent, self.game_played_activity.rdf))
-            nb_triples += 1
-        return self.complete_dump(activity, graph) + nb_triples
-
 
 class DidactaliaLearningTracesParser:
     """
     The parser to load a json file of didactalia traces and create related RDF triples
     """
-    def __init__(self):
+    SOURCE_NAME = 'didactalia'
+    # Field of the normalized traces that holds their date
+    DATE_FIELD = 'date'
+    # Action types of the traces of each activity type
+    ACTIVITY_TYPES = dict(ArtifactView=('resourceVisited',),
+                          Search=('freeTextSearch',),
+                          FacetAdd=('facetsSearchAdd',),
+                          FacetRemove=('facetsSearchRemove',),
+                          DidactaliaGamePlayed=('playStart', 'playEnd'),
+                          GameAttributeChange=('answersDetailsStateChange', 'playStudyChange', 'labelStateChange',
+                                               'languageChange', 'audioStateChange'))
+
+    def __init__(self, metrics: ConversionMetrics=None, validator: ConsistencyValidator=None,
+                 trace_filter: TraceFilter=None, snapshots: TraceSnapshots=None):
         self._activities = []
+        self._game_played_activities = dict()  # A buffer to store game_played activities by their playSession
+        self._metrics = metrics if metrics is not None else ConversionMetrics()
+        self._validator = validator
+        self._trace_filter = trace_filter
+        # The validation is done while the traces are normalized: the snapshots are only used without it
+        self._snapshots = snapshots if validator is None else None
 
     def load_and_dump(self, fin, learners_parser: LearnerMappingParser,  graph: Graph) -> int:
         self.load(fin, learners_parser)
         return self.dump_to_graph(graph)
 
+    @property
+    def activities(self) -> list:
+        return self._activities
+
     def load(self, f, learners_parser: LearnerMappingParser) -> None:
-        raw_traces = json.load(f)
-        raw_traces = raw_traces['hits']['hits']
+        """
+        Load and normalize traces
+        :param f: the json file object of the traces, or the MappedHits of the file
+        :param learners_parser: the learners parser
+        """
+        snapshots = self._snapshots if isinstance(f, MappedHits) else None
+        traces = None
+        if snapshots is not None:
+            with self._metrics.stage(self.SOURCE_NAME, 'snapshot') as stage:
+                traces = snapshots.load(self.SOURCE_NAME, f, self.DATE_FIELD, learners_parser)
+                stage.items += len(traces) if traces is not None else 0
+        if traces is None:
+            traces = self._load_traces(f, learners_parser)
+            if snapshots is not None:
+                with self._metrics.stage(self.SOURCE_NAME, 'snapshot'):
+                    snapshots.save(self.SOURCE_NAME, f, traces, self.DATE_FIELD)
+        self._build(traces)
+
+    def _load_traces(self, f, learners_parser: LearnerMappingParser) -> list:
+        """
+        :return: the normalized traces, sorted
+        """
+        conditions = self._raw_conditions(learners_parser)
+        with self._metrics.stage(self.SOURCE_NAME, 'loading') as stage:
+            # Without any condition to check on the raw hits, all of them may be decoded at once
+            raw_traces = load_hits(f, selective=bool(conditions))
+            stage.items += len(raw_traces)
+
+        with self._metrics.stage(self.SOURCE_NAME, 'normalization') as stage:
+            traces = [self._process_raw_trace(rt, learners_parser)
+                      for rt in select_hits_where(raw_traces, conditions)]
+            if self._validator is not None:
+                traces = [tr for tr in traces if tr is not None]
+            if self._trace_filter is not None:
+                traces = self._filter_traces(traces)
+            stage.items += len(traces)
 
         # Sort traces based on their timestamp to retrieve properly related game events
         # then on some of their actiontype, since some trace have the same timestamp :(
-        actionType_order = defaultdict(lambda: 1, playStart=0, playEnd=2)
-        actionType_order
-        traces = sorted([self._process_raw_trace(rt, learners_parser) for rt in raw_traces],
-                        key=lambda x: (actionType_order[x['actionType']], x['date']))
+        with self._metrics.stage(self.SOURCE_NAME, 'sorting') as stage:
+            actionType_order = defaultdict(lambda: 1, playStart=0, playEnd=2)
+            traces.sort(key=lambda x: (actionType_order[x['actionType']], x['date']))
+            stage.items += len(traces)
         LOG.debug("%d Didactalia traces read." % len(traces))
-        self._process_traces(traces)
+        return traces
+
+    def _build(self, traces: list) -> None:
+        with self._metrics.stage(self.SOURCE_NAME, 'building') as stage:
+            nb_activities = len(self._activities)
+            self._process_traces(traces)
+            if self._trace_filter is not None and self._trace_filter.activity_types is not None \
+                    and 'DidactaliaGamePlayed' not in self._trace_filter.activity_types:
+                # The game sessions were only kept to link their attribute changes to them
+                self._activities = [a for a in self._activities if not isinstance(a, GamePlayedActivity)]
+            stage.items += len(self._activities) - nb_activities
 
     def dump_to_graph(self, graph: Graph) -> int:
         LOG.debug("Going to dump %d Didactalia traces into RDF" % len(self._activities))
-        nb_total_triples = sum((a.dump_to_graph(graph) for a in self._activities))
+        if self._validator is not None:
+            for activity in self._activities:
+                if isinstance(activity, GamePlayedActivity) and not activity.is_achieved:
+                    self._validator.unfinished_session(activity.id, activity.play_session, activity.user_id)
+        with self._metrics.stage(self.SOURCE_NAME, 'insertion') as stage:
+            nb_total_triples = self._metrics.count_dump(self.SOURCE_NAME, self._activities, graph)
+            stage.items += len(self._activities)
+            stage.triples += nb_total_triples
+        return nb_total_triples
+
+    def dump_finished_to_graph(self, graph: Graph) -> int:
+        """
+        Dump the activities loaded so far, except the game sessions that are not ended yet, and release them.
+        It allows to convert traces incrementally: a game session is dumped once its playEnd trace is loaded, or at
+        the final call of dump_to_graph. The traces loaded afterwards are no longer linked to the ended sessions.
+        """
+        finished = [a for a in self._activities if not isinstance(a, GamePlayedActivity) or a.is_achieved]
+        self._activities = [a for a in self._activities if isinstance(a, GamePlayedActivity) and not a.is_achieved]
+        self._game_played_activities = {session: a for session, a in self._game_played_activities.items()
+                                        if not a.is_achieved}
+        LOG.debug("Going to dump %d Didactalia traces into RDF (%d pending game sessions)"
+                  % (len(finished), len(self._activities)))
+        with self._metrics.stage(self.SOURCE_NAME, 'insertion') as stage:
+            nb_total_triples = self._metrics.count_dump(self.SOURCE_NAME, finished, graph)
+            stage.items += len(finished)
+            stage.triples += nb_total_triples
         return nb_total_triples
 
+    @property
+    def open_sessions(self) -> dict:
+        """
+        :return: the raw playStart hits of the game sessions not ended yet, by session id (JSON serializable)
+        """
+        return {session: a.start_hit() for session, a in self._game_played_activities.items() if not a.is_achieved}
+
+    def restore_sessions(self, sessions: dict, learners_parser: LearnerMappingParser) -> None:
+        """
+        Restore the game sessions not ended yet of a previous incremental conversion
+        :param sessions: the raw playStart hits by session id, as given by open_sessions
+        :param learners_parser: the learners parser
+        """
+        # The hits are normalized in place: they are copied first
+        traces = [self._process_raw_trace(dict(hit, _source=dict(hit['_source'])), learners_parser)
+                  for hit in sessions.values()]
+        self._build([tr for tr in traces if tr is not None])
+        LOG.debug("%d open game sessions restored." % len(sessions))
+
     def _process_traces(self, traces):
         # Prepare the mapping actionType - process
-        game_played_activities = dict()  # A buffer to store game_played activities by their playSession
+        game_played_activities = self._game_played_activities
+        validator = self._validator
 
         # Specific treatment wrappers
         def treat_play_start(tr):
@@ -321,6 +393,8 @@ class DidactaliaLearningTracesParser:
         def treat_play_end(tr):
             if tr['playSession'] not in game_played_activities:
                 LOG.warning("Trace playEnd of id %s happened wihtout any relative playStart. Cannot process it" % tr['_id'])
+                if validator is not None:
+                    validator.orphan_play_end(tr['_id'], tr['playSession'])
                 return None
             else:
                 return game_played_activities[tr['playSession']].end_activity(tr)
@@ -330,6 +404,8 @@ class DidactaliaLearningTracesParser:
                 LOG.warning("Trace %s of id %s happened without (t=%s) any relative playStart. "
                             "Process it without any superEvent"
                             % (tr['actionType'], tr['_id'], tr['date'].strftime('%d/%m/%Y %H:%M:%S %z')))
+                if validator is not None:
+                    validator.change_without_session(tr['_id'], tr['actionType'], tr['playSession'])
                 return GameAttributeChanged(tr, None)
             else:
                 return GameAttributeChanged(tr, game_played_activities[trace['playSession']])
@@ -354,11 +430,55 @@ class DidactaliaLearningTracesParser:
             if activity is not None:
                 self._activities.append(activity)
 
-    @staticmethod
-    def _process_raw_trace(rt, learners_parser: LearnerMappingParser):
+    def _raw_conditions(self, learners_parser: LearnerMappingParser) -> list:
+        """
+        :return: the conditions on the raw fields of the traces to decode
+        """
+        conditions = [(('user_id',), learners_parser.is_selected)] if learners_parser.has_user_filter else []
+        trace_filter = self._trace_filter
+        if trace_filter is None:
+            return conditions
+        action_types = trace_filter.raw_action_types(self.ACTIVITY_TYPES)
+        if action_types is not None:
+            if action_types & SESSION_ACTION_TYPES:
+                # The game sessions are required to link their traces to them
+                action_types |= frozenset(self.ACTIVITY_TYPES['DidactaliaGamePlayed'])
+            # Traces without actionType use their type instead: they are checked once normalized
+            conditions.append((('actionType',), lambda action_type: action_type is None or action_type in action_types))
+        if trace_filter.has_time_window:
+            # The traces of a game session are kept as long as the session might be; undecided dates are parsed
+            conditions.append((('actionType', 'date'),
+                               lambda action_type, date: action_type is None or action_type in SESSION_ACTION_TYPES
+                               or not isinstance(date, str) or trace_filter.contains_iso_date(date) is not False))
+        return conditions
+
+    def _filter_traces(self, traces: list) -> list:
+        """
+        Apply the trace filter to the normalized traces that could not be decided on their raw fields, and keep the
+        traces of the game sessions only with their session
+        """
+        trace_filter = self._trace_filter
+        action_types = trace_filter.raw_action_types(self.ACTIVITY_TYPES)
+        if action_types is not None:
+            if action_types & SESSION_ACTION_TYPES:
+                action_types |= frozenset(self.ACTIVITY_TYPES['DidactaliaGamePlayed'])
+            traces = [tr for tr in traces if tr['actionType'] in action_types]
+        if trace_filter.has_time_window:
+            sessions = set(tr['playSession'] for tr in traces
+                           if tr['actionType'] == 'playStart' and trace_filter.contains_date(tr['date']))
+            traces = [tr for tr in traces
+                      if (tr['playSession'] in sessions if tr['actionType'] == 'playEnd' else
+                          trace_filter.contains_date(tr['date']) or
+                          (tr['actionType'] in SESSION_ACTION_TYPES and tr['playSession'] in sessions))]
+        return traces
+
+    def _process_raw_trace(self, rt, learners_parser: LearnerMappingParser):
         tr = rt['_source']
         tr['_id'] = rt['_id']
         tr['date'] = dateparser.parse(tr['date'])
+        if self._validator is not None and not self._validator.check_trace(self.SOURCE_NAME, tr['_id'],
+                                                                            tr['user_id'], tr['date']):
+            return None  # Unknown learner: reported and skipped, to validate the whole file
         tr['user'] = learners_parser.get_user_by_userid(tr['user_id'])
         # Some of the traces do not have any actionType (error from didactalia), we use then the type field instead
         tr['actionType'] = tr['actionType'] if 'actionType' in tr else tr['type']
@@ -3,10 +3,10 @@
 import logging
 import re
 import csv
-from rdflib.namespace import RDF
-from rdflib import Literal, Graph, URIRef
+from rdflib import Graph, URIRef
 from .baseClasses import Person, User
-from ..common.namespaces import AfelNamespacesManager, concatenate_uriref
+from ..common.tripleTemplates import TripleTemplate
+from ..common.metrics import ConversionMetrics
 
 __all__ = ['LearnerMappingParser', 'AFELLearner']
 
@@ -14,6 +14,11 @@ LOG = logging.getLogger(__name__)
 
 
 class AFELLearner(Person):
+    _TEMPLATE = TripleTemplate('afel:Learner', [('afel:email', 'email'),
+                                                ('afel:firstName', 'firstname'),
+                                                ('afel:lastName', 'lastname'),
+                                                ('afel:id', 'userid')], subject_id='username')
+
     def __init__(self, email: str, userid: str):
         self.email = email
         self.username = self.firstname = email.split('@')[0]
@@ -27,35 +32,38 @@ class AFELLearner(Person):
 
     @property
     def rdf(self) -> URIRef:
-        ans = AfelNamespacesManager().afel_ns
-        return concatenate_uriref(ans.Learner, self.username)
+        return self._TEMPLATE.subject(self)
 
     @property
     def user(self) -> User:
         return self._user
 
     def dump_to_graph(self, graph: Graph) -> int:
-        ans = AfelNamespacesManager().afel_ns
-        # Dump Learner triples
-        rdf = self.rdf
-        graph.add((rdf, RDF.type, ans.Learner))
-        graph.add((rdf, ans.email, Literal(self.email)))
-        graph.add((rdf, ans.firstName, Literal(self.firstname)))
-        graph.add((rdf, ans.lastName, Literal(self.lastname)))
-        graph.add((rdf, ans.id, Literal(self.userid)))
-        nb_triples = 5 + self._user.dump_to_graph(graph)
-        return nb_triples
+        return self._TEMPLATE.dump(self, graph) + self._user.dump_to_graph(graph)
 
 
 class LearnerMappingParser:
     """
     The parser to load a csv file of email-id and create RDF triples to represent the learners and their user account
     """
-    def __init__(self):
+    SOURCE_NAME = 'learners'
+
+    def __init__(self, metrics: ConversionMetrics=None, user_filter=None):
+        """
+        :param metrics: the metrics collector (optional)
+        :param user_filter: a predicate on user ids to select the learners to process (optional). All learners are
+        still known, but only the selected ones are dumped, and the traces of the others have to be skipped.
+        """
         self._learners_by_userid = dict()
         self._learners_by_internalid = dict()
+        self._metrics = metrics if metrics is not None else ConversionMetrics()
+        self._user_filter = user_filter
 
     def load_and_dump(self, fin, graph: Graph, dialect='unix', has_header=True, *args, **kwargs):
+        self.load(fin, dialect=dialect, has_header=has_header)
+        return self.dump_to_graph(graph)
+
+    def load(self, fin, dialect='unix', has_header=True) -> None:
         csv_reader = csv.reader(fin, dialect=dialect)
         if has_header:
             # Skip and check the header if any
@@ -66,20 +74,26 @@ class LearnerMappingParser:
         self._learners_by_userid = dict()
         self._learners_by_internalid = dict()
         nb_read = 0
-        for row in csv_reader:
-            if not row[0]:
-                LOG.warning("Incomplete learner email. : email='%s', userid='%s'. Skipping it." % (row[0], row[1]))
-                continue
-            learner = AFELLearner(row[0], row[1])
-            self._learners_by_userid[learner.userid] = learner
-            self._learners_by_internalid[learner.internalid] = learner
-            nb_read += 1
+        with self._metrics.stage(self.SOURCE_NAME, 'building') as stage:
+            for row in csv_reader:
+                if not row[0]:
+                    LOG.warning("Incomplete learner email. : email='%s', userid='%s'. Skipping it." % (row[0], row[1]))
+                    continue
+                learner = AFELLearner(row[0], row[1])
+                self._learners_by_userid[learner.userid] = learner
+                self._learners_by_internalid[learner.internalid] = learner
+                nb_read += 1
+            stage.items += nb_read
         LOG.debug("%d learners read." % nb_read)
+
+    def dump_to_graph(self, graph: Graph) -> int:
         # dump learners to graph
         LOG.debug("Going to dump %d learners into RDF" % len(self._learners_by_userid))
-        nb_triples = 0
-        for learner in self._learners_by_userid.values():
-            nb_triples += learner.dump_to_graph(graph)
+        with self._metrics.stage(self.SOURCE_NAME, 'insertion') as stage:
+            learners = [learner for learner in self._learners_by_userid.values() if self.is_selected(learner.userid)]
+            nb_triples = self._metrics.count_dump(self.SOURCE_NAME, learners, graph)
+            stage.items += len(learners)
+            stage.triples += nb_triples
         LOG.debug("%d triples should have been writen" % nb_triples)
         return nb_triples
 
@@ -89,6 +103,23 @@ class LearnerMappingParser:
     def get_user_by_userid(self, userid: str) -> AFELLearner:
         return self._learners_by_userid[userid].user
 
+    @property
+    def selected_userids(self) -> list:
+        return [userid for userid in self._learners_by_userid if self.is_selected(userid)]
+
+    @property
+    def has_user_filter(self) -> bool:
+        """
+        :return: True if only some learners are selected
+        """
+        return self._user_filter is not None
+
+    def is_selected(self, userid: str) -> bool:
+        """
+        :return: True if the traces of the user have to be processed
+        """
+        return self._user_filter is None or self._user_filter(userid)
+
     '''
     def has_learner(self, userid: str):
         return userid in self._learners_by_userid
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import re
+import csv
+import logging
+import ujson as json
+import pytz
+import dateutil.parser as dateparser
+from rdflib import Graph
+from .baseClasses import Questionnaire, Question, CommentAnswer, RatingAnswer, IntRatingAnswer, FloatRatingAnswer
+from .learners import LearnerMappingParser
+from ..common.metrics import ConversionMetrics
+from ..common.validation import ConsistencyValidator
+from ..common.traceFilter import TraceFilter
+
+__all__ = ['QuestionnaireManifest', 'QuestionnaireLayout', 'QuestionnaireParser', 'DEFAULT_MANIFEST']
+
+LOG = logging.getLogger(__name__)
+
+# The manifest of the questionnaires of the 2nd AFEL evaluation
+DEFAULT_MANIFEST = 'resources/questionnaires_manifest.json'
+
+# Classes of the answers of each answer type of the manifests
+ANSWER_TYPES = dict(int=IntRatingAnswer, float=FloatRatingAnswer, comment=CommentAnswer)
+
+# Policies for the rows of learners unknown from the mapping file: stop the conversion, or skip them
+UNKNOWN_USERS_POLICIES = ('error', 'skip')
+
+
+class QuestionnaireLayout:
+    """
+    The layout of a questionnaire file of a manifest: the questionnaire description, its files (answers, and
+    optionally the texts of its questions), its columns (user, time and IP columns, the other ones being the questions)
+    and the types of its answers.
+    """
+    def __init__(self, qid: str, name: str, comment: str, source: str, filename: str, question_texts: str=None,
+                 dialect: str='unix', user_column: int=0, user_separator: str=None, user_pattern: str=None,
+                 unknown_users: str='error', time_column: int=None, time_zone: str='UTC', date: str=None,
+                 ip_column: int=None, answer_types: list=None, default_answer_type: str=None,
+                 likert_range: list=None, non_likert_questions: list=None):
+        """
+        :param qid: the questionnaire id
+        :param name: the questionnaire name
+        :param comment: the questionnaire comment
+        :param source: the source of the answers (e.g. appQuest, knowledge), for the metrics and named graphs
+        :param filename: the CSV file of the answers, with a header of the question ids
+        :param question_texts: the JSON file of the texts of the questions by id (optional, ids are used as texts)
+        :param dialect: the CSV dialect
+        :param user_column: the index of the column of the user internal ids
+        :param user_separator: the separator of the ids of a row shared by several users (optional)
+        :param user_pattern: the regex whose first group extracts an internal id from a user value that matches it
+        (e.g. from an email address, optional)
+        :param unknown_users: 'error' to stop at the first unknown user, 'skip' to skip its rows
+        :param time_column: the index of the column of the date of the answers (negative from the last column)
+        :param time_zone: the time zone of the dates of the time column
+        :param date: the ISO date given to all the answers when there is no time column
+        :param ip_column: the index of the column of the IP address of the answers, ignored (optional)
+        :param answer_types: runs [type, number of questions] of the types of the answers (int, float or comment)
+        :param default_answer_type: the type of the answers of the questions after the runs (optional)
+        :param likert_range: the range [min, max] of the rating answers, checked by the validation (optional)
+        :param non_likert_questions: the ids of the rating questions out of the Likert scale
+        """
+        if unknown_users not in UNKNOWN_USERS_POLICIES:
+            raise ValueError("Unknown users policy %s of the questionnaire %s" % (unknown_users, qid))
+        if time_column is None and date is None:
+            raise ValueError("The questionnaire %s requires either a time column or a date" % qid)
+        for answer_type in [run[0] for run in answer_types or []] + [default_answer_type]:
+            if answer_type is not None and answer_type not in ANSWER_TYPES:
+                raise ValueError("Unknown answer type %s of the questionnaire %s" % (answer_type, qid))
+        self.id = qid
+        self.name = name
+        self.comment = comment
+        self.source = source
+        self.filename = filename
+        self.question_texts = question_texts
+        self.dialect = dialect
+        self.user_column = user_column
+        self.user_separator = user_separator
+        self.user_pattern = user_pattern
+        self.unknown_users = unknown_users
+        self.time_column = time_column
+        self.time_zone = time_zone
+        self.date = date
+        self.ip_column = ip_column
+        self.answer_types = [tuple(run) for run in answer_types or []]
+        self.default_answer_type = default_answer_type
+        self.likert_range = tuple(likert_range) if likert_range is not None else None
+        self.non_likert_questions = frozenset(non_likert_questions or [])
+        self._user_regex = re.compile(user_pattern) if user_pattern is not None else None
+
+    @classmethod
+    def from_dict(cls, description: dict, directory: str='') -> 'QuestionnaireLayout':
+        """
+        :param description: the description of the questionnaire in a manifest
+        :param directory: the directory of the files of the questionnaire
+        """
+        kwargs = dict(description)
+        kwargs['qid'] = kwargs.pop('id')
+        kwargs['filename'] = os.path.join(directory, kwargs.pop('file'))
+        if kwargs.get('question_texts') is not None:
+            kwargs['question_texts'] = os.path.join(directory, kwargs['question_texts'])
+        try:
+            return cls(**kwargs)
+        except TypeError as e:
+            raise ValueError("Wrong description of the questionnaire %s: %s" % (kwargs['qid'], e))
+
+    def to_dict(self) -> dict:
+        return dict(id=self.id, name=self.name, comment=self.comment, source=self.source, file=self.filename,
+                    question_texts=self.question_texts, dialect=self.dialect, user_column=self.user_column,
+                    user_separator=self.user_separator, user_pattern=self.user_pattern,
+                    unknown_users=self.unknown_users, time_column=self.time_column, time_zone=self.time_zone,
+                    date=self.date, ip_column=self.ip_column, answer_types=[list(run) for run in self.answer_types],
+                    default_answer_type=self.default_answer_type,
+                    likert_range=list(self.likert_range) if self.likert_range is not None else None,
+                    non_likert_questions=sorted(self.non_likert_questions))
+
+    @property
+    def files(self) -> list:
+        """
+        :return: the files of the questionnaire: its answers, and the texts of its questions if any
+        """
+        return [self.filename] + ([self.question_texts] if self.question_texts is not None else [])
+
+    def relocate(self, filename: str, question_texts: str=None) -> None:
+        """
+        Read the questionnaire from other files
+        """
+        self.filename = filename
+        if question_texts is not None:
+            self.question_texts = question_texts
+
+    def question_columns(self, nb_columns: int) -> list:
+        """
+        :return: the indexes of the columns of the questions, in a file of nb_columns columns
+        """
+        others = {index % nb_columns for index in (self.user_column, self.time_column, self.ip_column)
+                  if index is not None}
+        return [index for index in range(nb_columns) if index not in others]
+
+    def answer_classes(self, nb_questions: int) -> list:
+        """
+        :return: the answer class of each question
+        """
+        classes = [ANSWER_TYPES[answer_type] for answer_type, nb in self.answer_types for _ in range(nb)]
+        if len(classes) < nb_questions:
+            if self.default_answer_type is None:
+                raise ValueError("The questionnaire %s has %d questions, but %d answer types"
+                                 % (self.id, nb_questions, len(classes)))
+            classes.extend([ANSWER_TYPES[self.default_answer_type]] * (nb_questions - len(classes)))
+        return classes[:nb_questions]
+
+    def internal_ids(self, value: str) -> list:
+        """
+        :return: the internal ids of the users of a row, given the value of its user column
+        :raise ValueError: if an id cannot be read
+        """
+        ids = []
+        for token in value.split(self.user_separator) if self.user_separator is not None else [value]:
+            match = self._user_regex.search(token) if self._user_regex is not None else None
+            ids.append(int(match.group(1) if match is not None else token.strip()))
+        return ids
+
+    def __str__(self):
+        return "%s (%s)" % (self.name, self.id)
+
+
+class QuestionnaireManifest:
+    """
+    A manifest of the questionnaires of one or several evaluation campaigns, loaded from JSON files:
+
+        {"campaigns": [{"name": ..., "directory": ..., "defaults": {...},
+                        "questionnaires": [{"id": ..., "name": ..., "comment": ..., "source": ..., "file": ...}]}]}
+
+    The directory of a campaign is relative to the manifest file, and the files of its questionnaires to this
+    directory. The defaults of a campaign are given to all its questionnaires (see QuestionnaireLayout for the
+    keys of a questionnaire).
+    """
+    def __init__(self, campaigns: list=None, sources: list=None):
+        """
+        :param campaigns: (campaign name, list of QuestionnaireLayout) tuples
+        :param sources: the manifest files
+        """
+        self.campaigns = list(campaigns) if campaigns is not None else []
+        self.sources = list(sources) if sources is not None else []
+        ids = [layout.id for layout in self.questionnaires]
+        duplicates = sorted({qid for qid in ids if ids.count(qid) > 1})
+        if duplicates:
+            raise ValueError("Questionnaires declared several times: %s" % ', '.join(duplicates))
+
+    @classmethod
+    def load(cls, *filenames) -> 'QuestionnaireManifest':
+        """
+        Load and merge manifest files
+        """
+        campaigns = []
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                manifest = json.load(f)
+            base_directory = os.path.dirname(filename)
+            for campaign in manifest['campaigns']:
+                directory = os.path.join(base_directory, campaign.get('directory', ''))
+                defaults = campaign.get('defaults', dict())
+                layouts = [QuestionnaireLayout.from_dict(dict(defaults, **questionnaire), directory)
+                           for questionnaire in campaign['questionnaires']]
+                campaigns.append((campaign['name'], layouts))
+        return cls(campaigns, sources=filenames)
+
+    @property
+    def questionnaires(self) -> list:
+        return [layout for _, layouts in self.campaigns for layout in layouts]
+
+    @property
+    def files(self) -> list:
+        """
+        :return: the files of all the questionnaires
+        """
+        return [filename for layout in self.questionnaires for filename in layout.files]
+
+    def select(self, source_filter) -> 'QuestionnaireManifest':
+        """
+        :param source_filter: a predicate on the source names
+        :return: the manifest of the questionnaires of the sources selected, or None if there is none
+        """
+        campaigns = [(name, [layout for layout in layouts if source_filter(layout.source)])
+                     for name, layouts in self.campaigns]
+        campaigns = [(name, layouts) for name, layouts in campaigns if layouts]
+        return QuestionnaireManifest(campaigns, sources=self.sources) if campaigns else None
+
+    def to_dict(self) -> dict:
+        return dict(campaigns=[dict(name=name, questionnaires=[layout.to_dict() for layout in layouts])
+                               for name, layouts in self.campaigns])
+
+
+class QuestionnaireParser:
+    """
+    The parser to load the CSV file of the answers of a questionnaire, as described by its layout, and create the
+    RDF triples of the questionnaire, of its questions and of the answers
+    """
+    def __init__(self, layout: QuestionnaireLayout, metrics: ConversionMetrics=None,
+                 validator: ConsistencyValidator=None, trace_filter: TraceFilter=None):
+        """
+        :param layout: the layout of the questionnaire
+        :param metrics: the metrics collector (optional)
+        :param validator: the consistency validator (optional)
+        :param trace_filter: the selection of the traces: the answers are kept if their date is in its time window
+        (optional)
+        """
+        self.layout = layout
+        self._metrics = metrics if metrics is not None else ConversionMetrics()
+        self._validator = validator
+        self._questionnaire = Questionnaire(layout.id, layout.name, layout.comment)
+        self._timezone = pytz.timezone(layout.time_zone)
+        self._date = dateparser.parse(layout.date).astimezone(pytz.utc) if layout.date is not None else None
+        self._time_window = trace_filter if trace_filter is not None and trace_filter.has_time_window else None
+
+    @property
+    def questionnaire(self) -> Questionnaire:
+        return self._questionnaire
+
+    def load_files_and_dump(self, learners_parser: LearnerMappingParser, graph: Graph) -> int:
+        """
+        Load and dump the files of the layout
+        """
+        with open(self.layout.filename, 'r') as f_data:
+            if self.layout.question_texts is None:
+                return self.load_and_dump(f_data, learners_parser, graph)
+            with open(self.layout.question_texts, 'rb') as f_texts:
+                return self.load_and_dump(f_data, learners_parser, graph, f_texts=f_texts)
+
+    def load_and_dump(self, f_data, learners_parser: LearnerMappingParser, graph: Graph, f_texts=None) -> int:
+        """
+        :param f_data: the CSV file object of the answers
+        :param learners_parser: the learners parser
+        :param graph: the graph
+        :param f_texts: the JSON file object of the texts of the questions (optional)
+        :return: the number of triples generated
+        """
+        layout = self.layout
+        source = layout.source
+        total_nb_triples = 0
+        with self._metrics.stage(source, 'loading') as stage:
+            texts = json.load(f_texts) if f_texts is not None else dict()
+            csv_reader = csv.reader(f_data, dialect=layout.dialect)
+            headers = next(csv_reader)
+            columns = layout.question_columns(len(headers))
+            questions = [Question(headers[i], texts.get(headers[i], headers[i]), self._questionnaire)
+                         for i in columns]
+            answer_classes = layout.answer_classes(len(questions))
+            stage.items += len(questions)
+        LOG.debug("nb questions: %d" % len(questions))
+        with self._metrics.stage(source, 'insertion') as stage:
+            # Dump the questionnaire and the questions
+            nb_triples = self._metrics.count_dump(source, [self._questionnaire], graph)
+            nb_triples += self._metrics.count_dump(source, questions, graph)
+            stage.items += 1 + len(questions)
+            stage.triples += nb_triples
+            total_nb_triples += nb_triples
+
+        nb_users = 0
+        nb_skipped_rows = 0
+        answers = []
+        time_window = self._time_window
+        with self._metrics.stage(source, 'building') as stage:
+            for row in csv_reader:
+                date = self._date if layout.time_column is None else self._parse_date(row[layout.time_column])
+                if time_window is not None and date is not None and not time_window.contains_date(date):
+                    nb_skipped_rows += 1
+                    continue
+                for user in self._extract_users(row[layout.user_column], learners_parser):
+                    if not learners_parser.is_selected(user.userid):
+                        continue
+                    user_answers = [answer_classes[k](user, date, questions[k], row[i])
+                                    for k, i in enumerate(columns) if row[i]]
+                    if self._validator is not None:
+                        self._validate_answers(user, date if layout.time_column is not None else None, user_answers)
+                    answers.extend(user_answers)
+                    nb_users += 1
+            stage.items += len(answers)
+        with self._metrics.stage(source, 'insertion') as stage:
+            nb_triples = self._metrics.count_dump(source, answers, graph)
+            stage.items += len(answers)
+            stage.triples += nb_triples
+            total_nb_triples += nb_triples
+        LOG.debug("%d users processed, %d answers processed, %d rows out of the time window"
+                  % (nb_users, len(answers), nb_skipped_rows))
+        return total_nb_triples
+
+    def _parse_date(self, value: str):
+        date = dateparser.parse(value)
+        if date.tzinfo is None:
+            date = self._timezone.localize(date)
+        return date.astimezone(pytz.utc)
+
+    def _extract_users(self, value: str, learners_parser: LearnerMappingParser) -> list:
+        """
+        :return: the users of a row; unknown users are reported and skipped, or stop the conversion, according to
+        the layout
+        """
+        try:
+            internal_ids = self.layout.internal_ids(value)
+        except ValueError:
+            internal_ids = [value]
+        users = []
+        for internal_id in internal_ids:
+            try:
+                users.append(learners_parser.get_user_by_internalid(internal_id))
+            except KeyError:
+                if self.layout.unknown_users == 'error' and self._validator is None:
+                    raise
+                if self.layout.unknown_users == 'skip':
+                    LOG.warning("User %s unknown. Skip it." % internal_id)
+                if self._validator is not None:
+                    self._validator.check_learner(self.layout.source, internal_id)  # reported as unknown
+        return users
+
+    def _validate_answers(self, user, date, answers) -> None:
+        self._validator.check_learner(self.layout.source, user.userid)
+        self._validator.record_item(self.layout.source, date)
+        if self.layout.likert_range is None:
+            return
+        for answer in answers:
+            if isinstance(answer, RatingAnswer) and answer.question.id not in self.layout.non_likert_questions:
+                self._validator.check_answer(self.layout.id, answer.question.id, user.userid, answer.value,
+                                             self.layout.likert_range)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+# author: Rémi Venant
+import os
+import sys
+import time
+import glob
+import logging
+import argparse
+import ujson as json
+from rdflib import Graph
+from .common.namespaces import AfelNamespacesManager
+from .common.metrics import ConversionMetrics
+from .common.mappedHits import MappedHits
+from .common.utils import get_default_loggin_config
+from .tracesLoaders.learners import LearnerMappingParser
+from .tracesLoaders.afelAppTraces import AfelAppTracesParser
+from .tracesLoaders.didactaliaTraces import DidactaliaLearningTracesParser
+from .migrator import save_graph_to_file
+
+__all__ = ['TracesWatcher']
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {'xml': 'rdf', 'n3': 'n3', 'turtle': 'ttl', 'nt': 'nt', 'pretty-xml': 'rdf', 'trix': 'trix',
+                     'trig': 'trig', 'nquads': 'nq'}
+
+
+class TracesWatcher:
+    """
+    Convert the new Elasticsearch export pages dropped into the Didactalia and AFEL App directories, as soon as
+    they are complete. The namespaces, the learners index and the open game sessions are kept in memory between
+    files, and the triples of each file are written as a new delta file in the output directory.
+    The pages converted and the open game sessions are recorded in a state file of the output directory, so that a
+    new watcher resumes the conversion where the previous one stopped. A page that cannot be converted (e.g. a
+    malformed export, an unknown learner) is recorded as failed and is not retried: the parser of its source is
+    restored to the state of the last page converted.
+    """
+    STATE_FILENAME = '.watcher_state.json'
+
+    def __init__(self, learners_parser: LearnerMappingParser, output_directory: str, didactalia_directory: str=None,
+                 afelapp_directory: str=None, file_format: str='nt', pattern: str='*.json',
+                 metrics: ConversionMetrics=None):
+        """
+        :param learners_parser: the learners parser, already loaded
+        :param output_directory: the directory of the delta files
+        :param didactalia_directory: the directory of the Didactalia export pages (optional)
+        :param afelapp_directory: the directory of the AFEL App export pages (optional)
+        :param file_format: the RDF format of the delta files
+        :param pattern: the glob pattern of the export pages
+        :param metrics: the metrics collector (optional)
+        """
+        self._learners_parser = learners_parser
+        self.output_directory = output_directory
+        self.file_format = file_format
+        self.pattern = pattern
+        self._metrics = metrics if metrics is not None else ConversionMetrics()
+        self._sources = []  # [source name, directory, parser]
+        self._didactalia_parser = None
+        if didactalia_directory is not None:
+            self._sources.append(['didactalia', didactalia_directory, None])
+        if afelapp_directory is not None:
+            self._sources.append(['afelApp', afelapp_directory, None])
+        self._pending_sizes = dict()  # size of the files seen at the previous poll, to wait for complete files
+        self._state = self._load_state()
+        for source in self._sources:
+            self._reset_parser(source)
+
+    @property
+    def state_filename(self) -> str:
+        return os.path.join(self.output_directory, self.STATE_FILENAME)
+
+    def _reset_parser(self, source: list) -> None:
+        """
+        Give a source a new parser, with the open game sessions of the state
+        """
+        if source[0] == 'didactalia':
+            source[2] = self._didactalia_parser = DidactaliaLearningTracesParser(metrics=self._metrics)
+            self._didactalia_parser.restore_sessions(self._state['open_sessions'], self._learners_parser)
+        else:
+            source[2] = AfelAppTracesParser(metrics=self._metrics)
+
+    def _load_state(self) -> dict:
+        state = dict(sequence=0, processed=dict(), failed=dict(), open_sessions=dict())
+        if os.path.exists(self.state_filename):
+            with open(self.state_filename, 'r') as f:
+                state.update(json.load(f))
+        return state
+
+    def _save_state(self) -> None:
+        tmp_filename = self.state_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self._state, f)
+        os.replace(tmp_filename, self.state_filename)
+
+    def start(self) -> None:
+        """
+        Write the learners delta if it has not been written by a previous run
+        """
+        os.makedirs(self.output_directory, exist_ok=True)
+        if 'learners' not in self._state['processed']:
+            graph = Graph()
+            self._learners_parser.dump_to_graph(graph)
+            self._write_delta(graph, 'learners')
+            self._state['processed']['learners'] = True
+            self._save_state()
+
+    def poll(self) -> int:
+        """
+        Convert the new complete files of the watched directories
+        :return: the number of files converted
+        """
+        nb_converted = 0
+        for source in self._sources:
+            source_name, directory, _ = source
+            for filename in self._page_filenames(directory):
+                if filename in self._state['processed'] or filename in self._state['failed'] \
+                        or not self._is_complete(filename):
+                    continue
+                try:
+                    self.convert_file(source_name, source[2], filename)
+                    nb_converted += 1
+                except Exception as e:
+                    LOG.error("%s cannot be converted, it is skipped: %s: %s" % (filename, type(e).__name__, e))
+                    self._state['failed'][filename] = "%s: %s" % (type(e).__name__, e)
+                    self._save_state()
+                    # The page may have been partially loaded
+                    self._reset_parser(source)
+        return nb_converted
+
+    def _page_filenames(self, directory: str) -> list:
+        """
+        :return: the export pages of a directory, by modification date. The pages removed in the meantime are ignored.
+        """
+        pages = []
+        for filename in glob.glob(os.path.join(directory, self.pattern)):
+            try:
+                pages.append((os.path.getmtime(filename), filename))
+            except FileNotFoundError:
+                continue
+        return [filename for _, filename in sorted(pages)]
+
+    def _is_complete(self, filename) -> bool:
+        # A file is considered complete once its size did not change between two polls
+        try:
+            size = os.path.getsize(filename)
+        except FileNotFoundError:
+            self._pending_sizes.pop(filename, None)
+            return False
+        previous_size = self._pending_sizes.get(filename)
+        self._pending_sizes[filename] = size
+        if previous_size != size:
+            return False
+        del self._pending_sizes[filename]
+        return True
+
+    def convert_file(self, source_name: str, parser, filename: str) -> int:
+        """
+        Convert an export page into a delta file
+        :return: the number of triples generated
+        """
+        start = time.perf_counter()
+        with MappedHits(filename) as hits:
+            parser.load(hits, self._learners_parser)
+        graph = Graph()
+        nb_triples = parser.dump_finished_to_graph(graph)
+        delta_filename = self._write_delta(graph, source_name, filename)
+        self._state['processed'][filename] = True
+        if parser is self._didactalia_parser:
+            self._state['open_sessions'] = parser.open_sessions
+        self._save_state()
+        LOG.info("%s converted into %s: %d triples in %.3fs" % (filename, delta_filename, nb_triples,
+                                                                time.perf_counter() - start))
+        return nb_triples
+
+    def flush(self) -> int:
+        """
+        Dump the game sessions that are still open into a last delta file, as the batch conversion does. They are
+        no longer restored by the next watcher.
+        :return: the number of triples generated
+        """
+        graph = Graph()
+        nb_triples = 0
+        for source_name, _, parser in self._sources:
+            nb_triples += parser.dump_to_graph(graph)
+        if nb_triples > 0:
+            self._write_delta(graph, 'pending')
+        self._state['open_sessions'] = dict()
+        self._save_state()
+        return nb_triples
+
+    def run(self, poll_interval: float=5., max_polls: int=None, flush: bool=False) -> None:
+        """
+        Watch the directories until interrupted (or until max_polls polls)
+        :param poll_interval: the polling interval in seconds
+        :param max_polls: the maximum number of polls (optional)
+        :param flush: True to flush the open game sessions when stopping, instead of keeping them for the next
+        watcher
+        """
+        self.start()
+        nb_polls = 0
+        try:
+            while max_polls is None or nb_polls < max_polls:
+                self.poll()
+                nb_polls += 1
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            LOG.info("Watcher interrupted.")
+        finally:
+            if flush:
+                self.flush()
+            else:
+                LOG.info("%d open game sessions kept for the next start." % len(self._state['open_sessions']))
+
+    def _write_delta(self, graph: Graph, name: str, filename: str=None) -> str:
+        self._state['sequence'] += 1
+        basename = os.path.splitext(os.path.basename(filename))[0] if filename is not None else ''
+        delta_name = "delta_%06d_%s%s.%s" % (self._state['sequence'], name, '_' + basename if basename else '',
+                                             FORMAT_EXTENSIONS.get(self.file_format, self.file_format))
+        destination = os.path.join(self.output_directory, delta_name)
+        # Write then rename, so that a delta is never read partially
+        tmp_destination = os.path.join(self.output_directory, '.' + delta_name + '.tmp')
+        save_graph_to_file(graph, destination=tmp_destination, format=self.file_format)
+        os.replace(tmp_destination, destination)
+        return destination
+
+
+def configure_args():
+    parser = argparse.ArgumentParser(description="Watch directories of Didactalia and AFEL App export pages and "
+                                                 "convert each new page into a delta RDF file")
+
+    parser.add_argument('output_directory', help='Output directory of the delta RDF files', type=str)
+    parser.add_argument('-ff', '--file-format', help="RDF File format of the deltas (among 'xml', 'n3', 'turtle', "
+                                                     "'nt', 'pretty-xml', 'trix', 'trig' and 'nquads')",
+                        type=str, default='nt')
+    parser.add_argument('-i', '--interval', help='Polling interval in seconds', type=float, default=5.)
+    parser.add_argument('-fp', '--file-pattern', help='Glob pattern of the export pages', type=str,
+                        default='*.json')
+    parser.add_argument('-fl', '--flush', help='Write the game sessions still open into a last delta when stopping, '
+                                               'instead of restoring them at the next start', action='store_true')
+
+    parser.add_argument('-ap', '--afel-publicid', help='Afel schema public id', type=str,
+                        default='http://vocab.afel-project.eu/')
+    parser.add_argument('-as', '--afel-schema', help='Afel schema source', type=str,
+                        default='http://data.afel-project.eu/vocab/afel_schema.rdf')
+    parser.add_argument('-eap', '--ext-afel-publicid', help='Extended Afel schema public id', type=str,
+                        default='http://vocab.afel-project.eu/extension/')
+    parser.add_argument('-eas', '--ext-afel-schema', help='Extended Afel schema source', type=str,
+                        default='./resources/afel_schema_extension.rdf')
+
+    parser.add_argument('-um', '--user-mapping', help='user mail - Userid mapping csv file', type=str,
+                        default='resources/raw_traces/userID_mapping.csv')
+    parser.add_argument('-dd', '--didactalia-directory', help='Directory of the Didactalia export pages', type=str,
+                        default=None)
+    parser.add_argument('-ad', '--afelapp-directory', help='Directory of the AFEL App export pages', type=str,
+                        default=None)
+
+    return parser.parse_args()
+
+
+def main():
+    get_default_loggin_config(logging.INFO)
+    args = configure_args()
+
+    try:
+        AfelNamespacesManager(afel_source=args.afel_schema,
+                              afel_publicID=args.afel_publicid,
+                              ext_afel_source=args.ext_afel_schema,
+                              ext_afel_publicID=args.ext_afel_publicid)
+    except Exception as e:
+        print("Namespace given cannot be treated. Please check you AFEL schema, publicid and EXT-AFEL schema, public.")
+        print("Details: %s" % str(e))
+        sys.exit(1)
+
+    directories = [d for d in (args.didactalia_directory, args.afelapp_directory) if d is not None]
+    if not directories or not all(os.path.isdir(d) for d in directories) or not os.path.exists(args.user_mapping):
+        print("The user mapping file and at least one existing traces directory are required.")
+        sys.exit(1)
+
+    LOG.info("Load learners...")
+    learners_parser = LearnerMappingParser()
+    with open(args.user_mapping, 'r') as f:
+        learners_parser.load(f)
+
+    watcher = TracesWatcher(learners_parser, args.output_directory, didactalia_directory=args.didactalia_directory,
+                            afelapp_directory=args.afelapp_directory, file_format=args.file_format,
+                            pattern=args.file_pattern)
+    LOG.info("Watching %s..." % ', '.join(directories))
+    watcher.run(poll_interval=args.interval, flush=args.flush)
+    print("Bye bye.")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()